@@ -0,0 +1,120 @@
+# admission.py
+"""
+准入控制：按排队深度（在途的问答请求 + 大模型线程池中排队的调用）和最近请求延迟，
+为每个新请求决定降级等级，过载时逐级减少大模型调用，而不是让所有会话一起变慢直到超时
+
+    0 正常      分类 → 各标签分发 → 整合
+    1 跳过整合  各标签的回答分节列出，省掉整合这一次大模型调用
+    2 限制分发  只为正类信念最高的前 DEGRADE_TOP_LABELS 个标签调用大模型（同样不整合）
+    3 仅分类    只返回本地分类结果，不调用大模型
+"""
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from exec_pools import PROVIDER_POOL
+from usage_metrics import USAGE
+
+DEGRADE_LEVELS = {0: "正常", 1: "跳过整合", 2: "限制分发", 3: "仅分类"}
+
+
+def _thresholds(name: str, default: str) -> Tuple[float, ...]:
+    values = tuple(float(x) for x in os.getenv(name, default).split(","))
+    if len(values) != len(DEGRADE_LEVELS) - 1:
+        raise ValueError(f"{name} 应为 {len(DEGRADE_LEVELS) - 1} 个逗号分隔的阈值，对应降级 1 / 2 / 3 级")
+    return values
+
+
+# 是否启用准入控制（关闭时始终按 0 级处理）
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# 排队深度达到各值时进入 1 / 2 / 3 级
+DEGRADE_QUEUE_DEPTH = _thresholds("DEGRADE_QUEUE_DEPTH", "6,12,24")
+# 最近请求的 p90 延迟（秒）达到各值时进入 1 / 2 / 3 级
+DEGRADE_LATENCY = _thresholds("DEGRADE_LATENCY", "30,60,90")
+# 统计延迟的时间窗口（秒），以及窗口内至少要有的请求数（样本太少时不按延迟降级）
+LATENCY_WINDOW_SECONDS = float(os.getenv("LATENCY_WINDOW_SECONDS", "120"))
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", "5"))
+# 2 级降级时保留的标签数
+DEGRADE_TOP_LABELS = int(os.getenv("DEGRADE_TOP_LABELS", "1"))
+
+
+def _level_for(value: float, thresholds: Tuple[float, ...]) -> int:
+    return sum(value >= threshold for threshold in thresholds)
+
+
+class AdmissionController:
+    """
+    记录在途请求数和最近的请求延迟；admit() 在请求开始时给出降级等级，结束时记录本次延迟
+    """
+
+    def __init__(self, queue_thresholds: Tuple[float, ...] = DEGRADE_QUEUE_DEPTH,
+                 latency_thresholds: Tuple[float, ...] = DEGRADE_LATENCY,
+                 window_seconds: float = LATENCY_WINDOW_SECONDS, min_samples: int = LATENCY_MIN_SAMPLES,
+                 backlog: Callable[[], int] = lambda: PROVIDER_POOL.stats()["queued"],
+                 enabled: bool = ADMISSION_ENABLED):
+        self.queue_thresholds = queue_thresholds
+        self.latency_thresholds = latency_thresholds
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.backlog = backlog
+        self.enabled = enabled
+        self._in_flight = 0
+        self._latencies: deque = deque()  # (结束时间, 用时秒数)
+        self._admitted = {level: 0 for level in DEGRADE_LEVELS}
+        self._last_level = 0
+        self._lock = threading.Lock()
+
+    def _p90_latency(self) -> float:
+        # 调用方已持有锁
+        cutoff = time.monotonic() - self.window_seconds
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return 0.0
+        ordered = sorted(seconds for _, seconds in self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def _level(self) -> int:
+        # 调用方已持有锁
+        if not self.enabled:
+            return 0
+        depth = self._in_flight + self.backlog()
+        return max(_level_for(depth, self.queue_thresholds), _level_for(self._p90_latency(), self.latency_thresholds))
+
+    @contextlib.contextmanager
+    def admit(self) -> Iterator[int]:
+        """
+        登记一个请求并给出降级等级；退出时注销并记录用时
+        """
+        with self._lock:
+            level = self._level()
+            self._in_flight += 1
+            self._admitted[level] += 1
+            self._last_level = level
+        start = time.monotonic()
+        try:
+            yield level
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append((end, end - start))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "level": self._level(),
+                "last_level": self._last_level,
+                "in_flight": self._in_flight,
+                "backlog": self.backlog(),
+                "p90_latency": self._p90_latency(),
+                "admitted": {DEGRADE_LEVELS[level]: count for level, count in self._admitted.items()},
+            }
+
+
+ADMISSION = AdmissionController()
+# 准入状态随用量汇总一起落盘（llm_usage.jsonl 的 summary 行中的 gauges.admission）
+USAGE.register_gauge("admission", ADMISSION.stats)
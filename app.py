@@ -1,12 +1,75 @@
 from dotenv import load_dotenv
 import os
+import threading
 import gradio as gr
-from typing import List, Dict, Any
+from collections import Counter
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional
 
 load_dotenv()
 
-from inference import predict
+# 本项目模块在 load_dotenv 之后导入（它们在导入时读取环境变量）；只有 inference（torch / transformers）在首次使用时才导入
 from llm_clients import call_qwen, call_glm, call_deepseek, call_moonshot
+from session_store import SESSION_STORE
+from local_integration import assemble_report, render_markdown
+from usage_metrics import USAGE, usage_context
+from exec_pools import CLASSIFIER_POOL, PROVIDER_POOL, PoolSaturated
+from faq_index import FAQ_ENABLED, FAQIndex
+from admission import ADMISSION, DEGRADE_LEVELS, DEGRADE_TOP_LABELS
+
+# 配置了独立分类服务时通过 HTTP 调用，本进程不加载 BERT 模型
+CLASSIFIER_SERVICE_URL = os.getenv("CLASSIFIER_SERVICE_URL")
+# 启动后是否在后台预先加载本地分类模型（界面先可用，模型在后台加载）；
+# INFERENCE_MODE=compiled 时总是在启动界面前同步加载并预热
+CLASSIFIER_PRELOAD = os.getenv("CLASSIFIER_PRELOAD", "1") == "1"
+if CLASSIFIER_SERVICE_URL:
+    from classifier_service import ClassifierClient
+    predict = ClassifierClient(CLASSIFIER_SERVICE_URL).predict
+else:
+    def predict(text: str) -> list:
+        """
+        本地分类：第一次调用时才导入 inference（torch / transformers）并加载模型，进程启动不承担这部分开销
+        """
+        from inference import predict as local_predict
+        return local_predict(text)
+
+    def predict_with_embedding(text: str) -> tuple:
+        """
+        本地分类并在同一次前向中取问题的句向量，返回 (类别列表, 句向量, 模型指纹)
+        """
+        from inference import predict_with_embedding as local_predict_with_embedding
+        return local_predict_with_embedding(text)
+
+def preload_classifier() -> None:
+    """
+    在后台线程中导入 inference 并加载模型，使首个分类请求不必等待；
+    设置了 CHECKPOINT_WATCH_SECONDS 时随后开始监视 checkpoint 文件，更新后不停服热替换
+    """
+    try:
+        from inference import CHECKPOINT_WATCH_SECONDS, get_models, model_status, watch_checkpoint
+        get_models()
+        # 问答库是由其他 checkpoint 算出的（上次运行后模型文件已更新），先按当前模型重建
+        if FAQ_INDEX is not None and len(FAQ_INDEX) and FAQ_INDEX.model != model_status()["fingerprint"]:
+            rebuild_faq_index()
+    except Exception as e:
+        print(f"⚠️ 本地分类模型预加载失败（首次分类时会重试）: {e}")
+        return
+    if CHECKPOINT_WATCH_SECONDS > 0:
+        watch_checkpoint(on_reload=on_classifier_reloaded)
+
+def on_classifier_reloaded(result: dict) -> None:
+    """
+    分类模型热替换后，问答库中的句向量改用新模型重新计算
+    """
+    if FAQ_INDEX is not None:
+        rebuild_faq_index()
+
+def rebuild_faq_index() -> None:
+    """
+    用当前模型重新计算问答库的句向量；重建完成前指纹不一致，查询一律按未命中处理
+    """
+    from inference import embed
+    FAQ_INDEX.rebuild(lambda texts: embed(texts, with_fingerprint=True))
 
 print("DEBUG: ZHIPUAI_API_KEY =", repr(os.getenv("ZHIPUAI_API_KEY")))
 print("DEBUG: DASHSCOPE_API_KEY =", repr(os.getenv("DASHSCOPE_API_KEY")))
@@ -34,6 +97,43 @@ LABEL_TO_MODEL = {
     "解决类": "Qwen 大模型"       # Qwen 擅长解决方案
 }
 
+# 聊天区每页显示的对话轮数，更早的轮次折叠后按页展开
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "10"))
+
+# 整合方式：Moonshot 整合需额外一次大模型调用；本地整合直接在本地按标签分节、去重并渲染
+MOONSHOT_INTEGRATION = "Moonshot 整合"
+LOCAL_INTEGRATION = "本地整合"
+INTEGRATION_MODES = [MOONSHOT_INTEGRATION, LOCAL_INTEGRATION]
+DEFAULT_INTEGRATION_MODE = LOCAL_INTEGRATION if os.getenv("INTEGRATION_MODE") == "local" else MOONSHOT_INTEGRATION
+
+# 智能路由的投机调用：在本地分类的同时提前发起可能用到的大模型调用，分类结束后丢弃用不到的结果
+# SPECULATIVE_FALLBACK：是否提前发起「未匹配类别」时的 Moonshot 兜底调用
+#   0（默认）关闭；1 每个问题都发起；auto 仅当最近观测到的未匹配比例不低于 SPECULATIVE_FALLBACK_MIN_RATE 时发起
+#   兜底调用只在问题未匹配任何类别时有用，其余情况下结果被丢弃但费用照付：
+#   每次命中类别都多付一次 Moonshot 调用，未匹配比例为 p 时，浪费的调用约为问题数 × (1 - p)
+# SPECULATIVE_TOP_LABELS：提前为历史上出现最频繁的前 N 个标签发起调用（0 表示关闭）
+SPECULATIVE_FALLBACK = os.getenv("SPECULATIVE_FALLBACK", "0")
+SPECULATIVE_FALLBACK_MIN_RATE = float(os.getenv("SPECULATIVE_FALLBACK_MIN_RATE", "0.5"))
+# auto 模式下至少要有这么多次分类才按比例判断（样本不足时不发起）
+SPECULATIVE_FALLBACK_MIN_SAMPLES = int(os.getenv("SPECULATIVE_FALLBACK_MIN_SAMPLES", "20"))
+SPECULATIVE_TOP_LABELS = int(os.getenv("SPECULATIVE_TOP_LABELS", "1"))
+LABEL_FREQUENCY = Counter()
+# 分类次数与其中未匹配任何类别的次数，供 SPECULATIVE_FALLBACK=auto 判断
+CLASSIFY_OUTCOMES = Counter()
+_LABEL_FREQUENCY_LOCK = threading.Lock()
+
+# Gradio 请求队列：最多排队 QUEUE_MAX_SIZE 个请求，每个事件最多 QUEUE_CONCURRENCY 个同时处理；
+# 处理函数内部的本地分类和大模型调用再分别进入 CLASSIFIER_POOL / PROVIDER_POOL（见 exec_pools.py）
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "64"))
+QUEUE_CONCURRENCY = int(os.getenv("QUEUE_CONCURRENCY", "8"))
+
+# 用量统计中非分类标签调用的标签名：Moonshot 整合、未匹配类别时的 Moonshot 兜底
+INTEGRATION_LABEL = "整合"
+FALLBACK_LABEL = "兜底"
+
+# 语义问答库：句向量来自本地分类模型，使用独立分类服务（只返回类别）时不启用
+FAQ_INDEX = FAQIndex() if FAQ_ENABLED and not CLASSIFIER_SERVICE_URL else None
+
 # 定义模型专长描述
 MODEL_EXPERTISE = {
     "Qwen 大模型": "擅长提供解决方案和建议",
@@ -42,11 +142,14 @@ MODEL_EXPERTISE = {
     "DeepSeek 大模型": "擅长深度分析"
 }
 
-def integrate_answers(question: str, individual_answers: dict, labels: list, model_usage_info: dict) -> str:
+def integrate_answers(question: str, individual_answers: dict, labels: list, model_usage_info: dict,
+                      integration_mode: str = DEFAULT_INTEGRATION_MODE) -> str:
     """
     使用 Moonshot 将多个模型的回答整合成一个统一、美观、专业的农业专家级回答
+    integration_mode 为「本地整合」时不调用大模型，直接在本地按标签分节、去掉重复句并渲染
     """
-    if not os.getenv("MOONSHOT_API_KEY"):
+    local = integration_mode == LOCAL_INTEGRATION
+    if not local and not os.getenv("MOONSHOT_API_KEY"):
         return f"""
         <div style="background:#fff9c4; border-left:4px solid #ffc107; padding:12px; border-radius:6px; margin:10px 0;">
             ❌ 无法整合答案：缺少 Moonshot API Key（整合功能必需）
@@ -85,18 +188,15 @@ def integrate_answers(question: str, individual_answers: dict, labels: list, mod
     """
 
     try:
-        integrated_response = call_moonshot(integration_prompt).strip()
-
-        # 如果返回的是 Markdown，尝试转换为简单 HTML（兜底）
-        if integrated_response.startswith("#") or "**" in integrated_response:
-            # 简单转换：标题→<h3>，**bold**→<strong>，- → ✅
-            html_content = integrated_response
-            html_content = html_content.replace("### ", "<h3 style='color:#2e7d32; margin:16px 0 8px 0;'>").replace("\n###", "</h3><h3 style='color:#2e7d32; margin:16px 0 8px 0;'>")
-            html_content = html_content.replace("## ", "<h3 style='color:#2e7d32; margin:16px 0 8px 0;'>").replace("\n##", "</h3><h3 style='color:#2e7d32; margin:16px 0 8px 0;'>")
-            html_content = html_content.replace("**", "<strong>").replace("**", "</strong>")
-            html_content = html_content.replace("- ", "✅ ").replace("• ", "✅ ")
-            html_content = html_content.replace("\n", "<br>")
-            integrated_response = html_content
+        if local:
+            integrated_response = assemble_report(individual_answers, labels)
+        else:
+            with usage_context(label=INTEGRATION_LABEL):
+                integrated_response = PROVIDER_POOL.run(call_moonshot, integration_prompt).strip()
+
+            # 如果返回的是 Markdown，转换为 HTML（兜底）
+            if integrated_response.startswith("#") or "**" in integrated_response:
+                integrated_response = render_markdown(integrated_response)
 
         # 最终封装为美观卡片
         result_html = f"""
@@ -106,7 +206,7 @@ def integrate_answers(question: str, individual_answers: dict, labels: list, mod
             </div>
             <div style="padding:20px; line-height:1.6; color:#333; font-size:14px;">
                 <div style="font-size:0.9em; color:#666; margin-bottom:16px; padding-bottom:12px; border-bottom:1px dashed #eee;">
-                    🔍 模型协作路径：{models_used_html}
+                    🔍 模型协作路径：{models_used_html}（{integration_mode}）
                 </div>
 
                 {integrated_response}
@@ -119,6 +219,11 @@ def integrate_answers(question: str, individual_answers: dict, labels: list, mod
         """
         return result_html
 
+    except PoolSaturated:
+        # 大模型线程池已满：不排队等整合，改为各标签的回答分节列出
+        return (render_busy_notice("本次未做多模型整合，各标签的回答分节列出")
+                + render_separate_answers(labels, individual_answers, model_usage_info))
+
     except Exception as e:
         # 兜底：即使失败也尽量美化
         model_calls_html = "<br>".join([
@@ -143,39 +248,78 @@ def integrate_answers(question: str, individual_answers: dict, labels: list, mod
         </div>
         """
 
-def get_combined_answer(question: str, labels: list) -> str:
+def call_label_model(label: str, question: str) -> tuple:
+    """
+    为单个标签调用对应的大模型，返回 (模型名, 回答)；目标模型不可用时回答为 None
+    """
+    target_model = LABEL_TO_MODEL.get(label, "Moonshot 大模型")  # 默认改为Moonshot
+    prompt = f"关于问题：'{question}'，请从{label}的角度详细回答："
+    
+    with usage_context(label=label):
+        if target_model == "Qwen 大模型" and os.getenv("DASHSCOPE_API_KEY"):
+            return target_model, call_qwen(prompt)
+        elif target_model == "GLM 大模型" and os.getenv("ZHIPUAI_API_KEY"):
+            return target_model, call_glm(prompt)
+        elif target_model == "DeepSeek 大模型" and os.getenv("DEEPSEEK_API_KEY"):
+            return target_model, call_deepseek(prompt)
+        elif target_model == "Moonshot 大模型" and os.getenv("MOONSHOT_API_KEY"):
+            return target_model, call_moonshot(prompt)
+    return target_model, None
+
+def get_combined_answer(question: str, labels: list, integration_mode: str = DEFAULT_INTEGRATION_MODE,
+                        prefetched: Optional[Dict[str, Future]] = None,
+                        record: Optional[Dict[str, Any]] = None, integrate: bool = True) -> str:
     """
     根据多个标签，调用不同模型，然后整合回答
+    prefetched 中已投机发起的标签调用直接取结果，不再重复调用
+    record 不为 None 时写入各标签的回答与不可用模型，供重试时只重做整合
+    integrate 为 False 时（降级）不整合，各标签的回答分节列出
     """
     individual_answers = {}
     unavailable_models = []
     model_usage_info = {}  # 记录模型使用信息
+    calls = dict(prefetched or {})
+    
+    # 为每个标签找到对应的模型，并发调用（大模型 I/O 线程池）
+    for label in labels:
+        if label not in calls:
+            try:
+                calls[label] = PROVIDER_POOL.submit(call_label_model, label, question)
+            except PoolSaturated:
+                unavailable_models.append(f"{label}(大模型调用繁忙)")
     
-    # 为每个标签找到对应的模型并调用
     for label in labels:
-        target_model = LABEL_TO_MODEL.get(label, "Moonshot 大模型")  # 默认改为Moonshot
+        if label not in calls:
+            continue
+        target_model, answer = calls[label].result()
         
-        # 调用对应模型
-        if target_model == "Qwen 大模型" and os.getenv("DASHSCOPE_API_KEY"):
-            individual_answers[label] = call_qwen(f"关于问题：'{question}'，请从{label}的角度详细回答：")
-            model_usage_info[label] = (target_model, MODEL_EXPERTISE[target_model])
-        elif target_model == "GLM 大模型" and os.getenv("ZHIPUAI_API_KEY"):
-            individual_answers[label] = call_glm(f"关于问题：'{question}'，请从{label}的角度详细回答：")
-            model_usage_info[label] = (target_model, MODEL_EXPERTISE[target_model])
-        elif target_model == "DeepSeek 大模型" and os.getenv("DEEPSEEK_API_KEY"):
-            individual_answers[label] = call_deepseek(f"关于问题：'{question}'，请从{label}的角度详细回答：")
-            model_usage_info[label] = (target_model, MODEL_EXPERTISE[target_model])
-        elif target_model == "Moonshot 大模型" and os.getenv("MOONSHOT_API_KEY"):
-            individual_answers[label] = call_moonshot(f"关于问题：'{question}'，请从{label}的角度详细回答：")
+        if answer is not None:
+            individual_answers[label] = answer
             model_usage_info[label] = (target_model, MODEL_EXPERTISE[target_model])
         else:
             # 如果目标模型不可用，记录下来
             unavailable_models.append(f"{label}({target_model})")
     
+    if record is not None:
+        record.update(individual_answers=dict(individual_answers), model_usage_info=dict(model_usage_info),
+                      unavailable_models=list(unavailable_models))
+    return compose_combined_answer(question, individual_answers, labels, model_usage_info, unavailable_models,
+                                   integration_mode, integrate)
+
+def compose_combined_answer(question: str, individual_answers: dict, labels: list, model_usage_info: dict,
+                            unavailable_models: list, integration_mode: str = DEFAULT_INTEGRATION_MODE,
+                            integrate: bool = True) -> str:
+    """
+    由各标签的回答生成最终回答：整合（integrate 为 False 时分节列出），并附上不可用模型的提示
+    """
     # 如果有回答，进行整合
     if individual_answers:
         # 调用整合函数
-        integrated_result = integrate_answers(question, individual_answers, labels, model_usage_info)
+        if integrate:
+            integrated_result = integrate_answers(question, individual_answers, labels, model_usage_info,
+                                                  integration_mode)
+        else:
+            integrated_result = render_separate_answers(labels, individual_answers, model_usage_info)
         
         # 添加不可用模型的提示
         if unavailable_models:
@@ -196,34 +340,246 @@ def get_combined_answer(question: str, labels: list) -> str:
                 <p>可能的原因是本地模型未匹配到任何预设类别，且未配置大模型 API Key。</p>
             </div>"""
 
-def route_answer_with_context(history: List[Dict[str, str]], new_question: str, model_choice: str) -> tuple:
+def render_separate_answers(labels: list, individual_answers: dict, model_usage_info: dict) -> str:
+    """
+    不整合时的回答：各标签的回答按标签分节列出
+    """
+    sections = "".join(
+        f"<div style='margin:8px 0; padding:10px; background:#f8f9fa; border-left:3px solid #4caf50;'>"
+        f"<strong>📌 {label}视角</strong>（{model_usage_info[label][0]}）：<br>{render_markdown(answer)}</div>"
+        for label, answer in individual_answers.items()
+    )
+    return f"""<div style="background:#ffffff; border-radius:10px; box-shadow:0 4px 12px rgba(0,0,0,0.05); overflow:hidden; margin:12px 0;">
+            <div style="background:linear-gradient(135deg, #2e7d32, #1b5e20); color:white; padding:14px 20px; font-weight:bold;">
+                🌾 【分标签回答】—— {', '.join(labels)}
+            </div>
+            <div style="padding:20px; line-height:1.6; color:#333; font-size:14px;">{sections}</div>
+        </div>"""
+
+def render_degrade_notice(level: int, detail: str) -> str:
+    """
+    降级提示条：降级等级与本次省掉了哪些调用
+    """
+    return (f"<div style='background:#fff3e0; border-left:4px solid #ff9800; padding:10px; border-radius:6px; margin:10px 0; font-size:0.9em;'>"
+            f"⚡ <strong>【降级 {level} 级 · {DEGRADE_LEVELS[level]}】</strong>系统繁忙，{detail}；稍后可点击「重试」获取完整回答。</div>")
+
+def render_busy_notice(detail: str) -> str:
+    """
+    大模型线程池已满（PoolSaturated）时的提示条
+    """
+    return (f"<div style='background:#fff3e0; border-left:4px solid #ff9800; padding:10px; border-radius:6px; margin:10px 0; font-size:0.9em;'>"
+            f"⏳ <strong>【大模型调用繁忙】</strong>{detail}；请稍后点击「重试」。</div>")
+
+FALLBACK_KEY = "__moonshot_fallback__"
+
+def start_speculative_calls(context: str) -> Dict[str, Future]:
+    """
+    在本地分类进行时提前发起大模型调用：Moonshot 兜底回答，以及历史最常见标签对应的模型
+    返回 {标签或 FALLBACK_KEY: Future}
+    """
+    speculative = {}
+    if should_speculate_fallback() and os.getenv("MOONSHOT_API_KEY"):
+        speculative[FALLBACK_KEY] = _speculate(call_moonshot, context, label=FALLBACK_LABEL)
+    if SPECULATIVE_TOP_LABELS > 0:
+        with _LABEL_FREQUENCY_LOCK:
+            likely_labels = [label for label, _ in LABEL_FREQUENCY.most_common(SPECULATIVE_TOP_LABELS)]
+        for label in likely_labels:
+            speculative[label] = _speculate(call_label_model, label, context)
+    return {key: future for key, future in speculative.items() if future is not None}
+
+def should_speculate_fallback() -> bool:
+    """
+    按 SPECULATIVE_FALLBACK 判断是否提前发起兜底调用；auto 模式按已观测到的未匹配比例决定
+    """
+    if SPECULATIVE_FALLBACK != "auto":
+        return SPECULATIVE_FALLBACK == "1"
+    with _LABEL_FREQUENCY_LOCK:
+        total, unmatched = CLASSIFY_OUTCOMES["total"], CLASSIFY_OUTCOMES["unmatched"]
+    return total >= SPECULATIVE_FALLBACK_MIN_SAMPLES and unmatched / total >= SPECULATIVE_FALLBACK_MIN_RATE
+
+def _speculate(fn, *args, **fields) -> Optional[Future]:
+    """
+    投机调用只在大模型线程池有空位时发起，不排队等待，池满则放弃
+    """
+    with usage_context(speculative=True, **fields):
+        try:
+            return PROVIDER_POOL.submit(fn, *args, timeout=0)
+        except PoolSaturated:
+            return None
+
+def discard_unneeded_calls(speculative: Dict[str, Future], labels: list) -> None:
+    """
+    取消分类结果用不到的投机调用（尚未开始的直接取消，已在进行的结果被丢弃）
+    """
+    needed = set(labels) if labels else {FALLBACK_KEY}
+    for key, future in speculative.items():
+        if key not in needed:
+            future.cancel()
+
+def classify(question: str) -> tuple:
+    """
+    本地分类；启用问答库时在同一次前向中顺带取句向量，返回 (类别列表, 句向量或 None, 模型指纹或 None)
+    """
+    if FAQ_INDEX is None:
+        return predict(question), None, None
+    return predict_with_embedding(question)
+
+def render_faq_answer(similarity: float, entry: Dict[str, Any]) -> str:
+    """
+    问答库命中时的回答：提示复用了已有报告及相似度，后接原报告
+    问答库由所有会话共享，不展示原问题的文字，避免把其他用户的提问暴露给当前用户
+    """
+    return f"""<div style='background:#f1f8e9; border-left:4px solid #689f38; padding:10px; border-radius:6px; margin:10px 0; font-size:0.9em;'>📚 <strong>【问答库】</strong>与一个已回答的问题相似（相似度 {similarity:.3f}），直接复用已有报告；如需重新生成请点击「重试」。</div>""" + entry["answer"]
+
+def route_answer_with_context(session_id: str, new_question: str, model_choice: str,
+                              integration_mode: str = DEFAULT_INTEGRATION_MODE) -> tuple:
     """
     支持上下文历史的问答函数
+    对话历史保存在服务端会话存储中，浏览器端状态只保存会话 ID
     """
-    # 获取当前对话历史
-    conversation_history = history.copy()
+    if not session_id:
+        session_id = SESSION_STORE.new_session()
     
-    # 如果新问题为空，返回当前历史
+    # 如果新问题为空，直接返回
     if not new_question or not new_question.strip():
-        return conversation_history, ""
+        return session_id, ""
+    
+    # 获取当前对话历史
+    conversation_history = SESSION_STORE.get(session_id)
     
     question = new_question.strip()
+    context = build_context(conversation_history, question)
     
-    # 构建包含历史对话的上下文
-    context = ""
-    if len(conversation_history) > 0:
-        context += "以下是之前的对话历史，本次回答请参考这些信息：\n"
-        for i, item in enumerate(conversation_history[-3:], 1):  # 只取最近3轮对话
-            context += f"Q{i}: {item['question']}\nA{i}: {item['answer']}\n\n"
-        context += f"当前问题：{question}\n"
-    else:
-        context = question
+    # 本轮的大模型调用都按回答模式记入用量统计；record 记录分类结果和各标签回答，供重试复用
+    # 准入控制按当前排队深度与最近延迟给出降级等级
+    with ADMISSION.admit() as degrade_level, usage_context(mode=model_choice, degrade_level=degrade_level):
+        record = {"model_choice": model_choice, "integration_mode": integration_mode, "degrade_level": degrade_level}
+        response = answer_question(question, context, model_choice, integration_mode, record,
+                                   degrade_level=degrade_level)
+    
+    # 更新对话历史（同时缓存本轮的渲染结果，避免每次提交重新拼接整段历史）
+    turn = {
+        "question": question,
+        "answer": response,
+        "record": record
+    }
+    turn["html"] = render_turn(turn)
+    SESSION_STORE.append(session_id, turn)
+    
+    # 清空输入框
+    return session_id, ""
+
+def build_context(conversation_history: List[Dict[str, Any]], question: str) -> str:
+    """
+    构建包含历史对话的上下文（只取最近3轮对话）
+    """
+    if not conversation_history:
+        return question
+    context = "以下是之前的对话历史，本次回答请参考这些信息：\n"
+    for i, item in enumerate(conversation_history[-3:], 1):
+        context += f"Q{i}: {item['question']}\nA{i}: {item['answer']}\n\n"
+    context += f"当前问题：{question}\n"
+    return context
+
+RETRY_INTEGRATION = "整合报告"
+
+def retry_last_turn(session_id: str, retry_target: str = RETRY_INTEGRATION,
+                    integration_mode: str = DEFAULT_INTEGRATION_MODE) -> None:
+    """
+    重新生成最后一轮回答
+    智能路由模式下沿用缓存的分类结果和各标签回答：默认只重做整合；选择某个标签时只重新调用该标签的大模型，再整合；
+    上一轮因 2 级降级未调用的标签（record["skipped_labels"]）在当前降级等级低于 2 时补调
+    其他回答模式没有可复用的中间结果，按原回答模式整轮重新生成（智能路由未匹配类别时仍沿用分类结果）
+    """
+    history = SESSION_STORE.get(session_id) if session_id else []
+    if not history or not history[-1].get("record"):
+        return
+    last = history[-1]
+    previous = last["record"]
+    model_choice = previous["model_choice"]
+    context = build_context(history[:-1], last["question"])
+    
+    with ADMISSION.admit() as degrade_level, usage_context(mode=model_choice, degrade_level=degrade_level):
+        if previous.get("individual_answers") is not None:
+            record = dict(previous, integration_mode=integration_mode, degrade_level=degrade_level)
+            answers = dict(previous["individual_answers"])
+            usage_info = {label: tuple(info) for label, info in previous["model_usage_info"].items()}
+            unavailable = list(previous["unavailable_models"])
+            skipped = list(previous.get("skipped_labels") or [])
+            targets = skipped if degrade_level < 2 else []
+            if retry_target in previous["labels"] and retry_target not in targets:
+                targets.append(retry_target)
+            calls = {}
+            for label in targets:
+                try:
+                    calls[label] = PROVIDER_POOL.submit(call_label_model, label, context)
+                except PoolSaturated:
+                    # 线程池已满：没有缓存回答的标签留待下次重试，有缓存的沿用旧回答
+                    if label not in answers and label not in skipped:
+                        skipped.append(label)
+            for label, call in calls.items():
+                target_model, answer = call.result()
+                if answer is not None:
+                    answers[label] = answer
+                    usage_info[label] = (target_model, MODEL_EXPERTISE[target_model])
+                    unavailable = [item for item in unavailable if not item.startswith(f"{label}(")]
+                    if label in skipped:
+                        skipped.remove(label)
+            record.update(individual_answers=answers, model_usage_info=usage_info, unavailable_models=unavailable,
+                          skipped_labels=skipped)
+            response = compose_combined_answer(context, answers, previous["labels"], usage_info, unavailable,
+                                               integration_mode, integrate=degrade_level == 0)
+            if skipped:
+                detail = f"仍未调用 {'、'.join(skipped)}" + ("，且未做整合" if degrade_level else "")
+                if degrade_level >= 2:
+                    response = render_degrade_notice(degrade_level, detail) + response
+                else:
+                    response = render_busy_notice(detail) + response
+            elif degrade_level:
+                response = render_degrade_notice(degrade_level, "本次沿用各标签的回答，未做整合") + response
+        else:
+            record = {"model_choice": model_choice, "integration_mode": integration_mode,
+                      "degrade_level": degrade_level}
+            response = answer_question(last["question"], context, model_choice, integration_mode, record,
+                                       labels=previous.get("labels"), degrade_level=degrade_level)
     
+    turn = {
+        "question": last["question"],
+        "answer": response,
+        "record": record
+    }
+    turn["html"] = render_turn(turn)
+    SESSION_STORE.replace_last(session_id, turn)
+
+def undo_last_turn(session_id: str) -> str:
+    """
+    撤销最后一轮对话（不重新计算），把该轮问题放回输入框
+    """
+    turn = SESSION_STORE.pop(session_id) if session_id else None
+    return turn["question"] if turn else ""
+
+def retry_choices(session_id: str):
+    """
+    重试范围：整合报告，或最后一轮分类得到的某个标签
+    """
+    history = SESSION_STORE.get(session_id) if session_id else []
+    labels = (history[-1].get("record") or {}).get("labels") or [] if history else []
+    return gr.update(choices=[RETRY_INTEGRATION] + list(labels), value=RETRY_INTEGRATION)
+
+def answer_question(question: str, context: str, model_choice: str,
+                    integration_mode: str = DEFAULT_INTEGRATION_MODE,
+                    record: Optional[Dict[str, Any]] = None, labels: Optional[list] = None,
+                    degrade_level: int = 0) -> str:
+    """
+    按回答模式生成本轮回答的 HTML；question 为本轮问题（用于本地分类），context 为带历史的提问
+    record 不为 None 时写入分类结果与各标签回答；labels 为已缓存的分类结果时（重试）不再分类
+    degrade_level 为准入控制给出的降级等级（见 admission.py），只作用于智能路由
+    """
     response = ""
     
     if model_choice == "本地农业分类模型":
         try:
-            labels = predict(question)
+            labels = CLASSIFIER_POOL.run(predict, question)
             if labels:
                 response = f"""<div style="background:#e8f5e8; border-left:4px solid #4caf50; padding:16px; border-radius:8px; margin:12px 0;">
                     <h3 style="color:#2e7d32; margin-top:0;">### 【分类结果】这个问题属于：{', '.join(labels)}</h3>
@@ -241,41 +597,110 @@ def route_answer_with_context(history: List[Dict[str, str]], new_question: str,
             </div>"""
 
     elif model_choice == "智能路由模式":
-        # 智能路由：先分类，再调用多个模型，最后整合回答
-        labels = predict(question)
-        if not labels:
-            moonshot_resp = call_moonshot(context)
+        # 智能路由：分类的同时投机发起可能用到的大模型调用，再调用其余模型，最后整合回答
+        # 没有对话历史的问题先查问答库，与已回答问题足够相似时直接复用其报告（重试时 labels 已给出，不查库）
+        speculative = {}
+        embedding = embedding_model = None
+        faq_hit = None
+        standalone = context == question
+        if labels is None:
+            # 降级时不再投机调用，避免给已经过载的大模型线程池增加负担；
+            # 会查问答库的问题也不投机调用：命中时投机结果全部作废，未命中时分类已经结束，投机不再有收益
+            faq_first = FAQ_INDEX is not None and standalone
+            speculative = start_speculative_calls(context) if degrade_level == 0 and not faq_first else {}
+            labels = []
+            try:
+                labels, embedding, embedding_model = CLASSIFIER_POOL.run(classify, question)
+                if embedding is not None and standalone:
+                    faq_hit = FAQ_INDEX.lookup(embedding, embedding_model)
+            finally:
+                discard_unneeded_calls(speculative, labels)
+            with _LABEL_FREQUENCY_LOCK:
+                LABEL_FREQUENCY.update(labels)
+                CLASSIFY_OUTCOMES.update(total=1, unmatched=int(not labels))
+        if record is not None:
+            record["labels"] = list(labels)
+        if faq_hit is not None:
+            similarity, entry = faq_hit
+            for future in speculative.values():
+                future.cancel()
+            if record is not None:
+                record["faq"] = {"id": entry["id"], "similarity": similarity}
+            response = render_faq_answer(similarity, entry)
+        elif degrade_level >= 3:
+            found = f"这个问题属于：{', '.join(labels)}" if labels else "未匹配到任何预设类别"
+            response = render_degrade_notice(degrade_level, "本次只返回本地分类结果，未调用大模型") + f"""<div style="background:#e8f5e8; border-left:4px solid #4caf50; padding:16px; border-radius:8px; margin:12px 0;">
+                <h3 style="color:#2e7d32; margin-top:0;">### 【分类结果】{found}</h3>
+            </div>"""
+        elif not labels:
+            if FALLBACK_KEY in speculative:
+                moonshot_resp = speculative[FALLBACK_KEY].result()
+            else:
+                try:
+                    with usage_context(label=FALLBACK_LABEL):
+                        moonshot_resp = PROVIDER_POOL.run(call_moonshot, context)
+                except PoolSaturated:
+                    return render_busy_notice("未匹配到明确类别，本次未能调用 Moonshot 兜底回答")
             response = f"""<div style="background:#e3f2fd; border-left:4px solid #2196f3; padding:16px; border-radius:8px; margin:12px 0;">
                 <h3 style="color:#1565c0; margin-top:0;">💡 【智能路由】未匹配到明确类别，已使用 Moonshot 回答</h3>
                 <div>{moonshot_resp}</div>
             </div>"""
         else:
             # 获取整合后的回答
-            response = get_combined_answer(context, labels)
+            # 2 级降级只为正类信念最高的几个标签调用大模型（labels 已按信念从高到低排列）
+            dispatched = labels[:DEGRADE_TOP_LABELS] if degrade_level >= 2 else labels
+            if record is not None:
+                # 记下未调用的标签，重试时补调
+                record["skipped_labels"] = list(labels[len(dispatched):])
+            prefetched = {label: f for label, f in speculative.items() if label in dispatched}
+            response = get_combined_answer(context, dispatched, integration_mode, prefetched, record,
+                                           integrate=degrade_level == 0)
+            if degrade_level == 1:
+                response = render_degrade_notice(degrade_level, "本次跳过了多模型整合，各标签的回答分节列出") + response
+            elif degrade_level == 2:
+                skipped = "、".join(labels[len(dispatched):])
+                detail = f"本次只调用了把握最大的 {', '.join(dispatched)}" + (f"，未调用 {skipped}" if skipped else "")
+                response = render_degrade_notice(degrade_level, detail + "，且未做整合") + response
+            # 所有标签都拿到回答、完整整合过的独立问题写入问答库
+            if (embedding is not None and standalone and degrade_level == 0 and record is not None
+                    and record.get("individual_answers") and not record.get("unavailable_models")):
+                FAQ_INDEX.add(embedding, question, response, labels, embedding_model)
 
     elif model_choice == "Qwen 大模型":
-        qwen_response = call_qwen(context)
+        try:
+            qwen_response = PROVIDER_POOL.run(call_qwen, context)
+        except PoolSaturated:
+            return render_busy_notice("本次未能调用 Qwen 大模型")
         response = f"""<div style="background:#e0f2f1; border-left:4px solid #00bcd4; padding:16px; border-radius:8px; margin:12px 0;">
             <h3 style="color:#006064; margin-top:0;">### 【Qwen 回答】</h3>
             <div>{qwen_response}</div>
         </div>"""
 
     elif model_choice == "GLM 大模型":
-        glm_response = call_glm(context)
+        try:
+            glm_response = PROVIDER_POOL.run(call_glm, context)
+        except PoolSaturated:
+            return render_busy_notice("本次未能调用 GLM 大模型")
         response = f"""<div style="background:#f3e5f5; border-left:4px solid #9c27b0; padding:16px; border-radius:8px; margin:12px 0;">
             <h3 style="color:#4a148c; margin-top:0;">### 【GLM 回答】</h3>
             <div>{glm_response}</div>
         </div>"""
     
     elif model_choice == "DeepSeek 大模型":
-        deepseek_response = call_deepseek(context)
+        try:
+            deepseek_response = PROVIDER_POOL.run(call_deepseek, context)
+        except PoolSaturated:
+            return render_busy_notice("本次未能调用 DeepSeek 大模型")
         response = f"""<div style="background:#f1f8e9; border-left:4px solid #8bc34a; padding:16px; border-radius:8px; margin:12px 0;">
             <h3 style="color:#33691e; margin-top:0;">### 【DeepSeek 回答】</h3>
             <div>{deepseek_response}</div>
         </div>"""
     
     elif model_choice == "Moonshot 大模型":
-        moonshot_response = call_moonshot(context)
+        try:
+            moonshot_response = PROVIDER_POOL.run(call_moonshot, context)
+        except PoolSaturated:
+            return render_busy_notice("本次未能调用 Moonshot 大模型")
         response = f"""<div style="background:#e8eaf6; border-left:4px solid #3f51b5; padding:16px; border-radius:8px; margin:12px 0;">
             <h3 style="color:#283593; margin-top:0;">### 【Moonshot 回答】</h3>
             <div>{moonshot_response}</div>
@@ -286,44 +711,122 @@ def route_answer_with_context(history: List[Dict[str, str]], new_question: str,
             <h3 style="color:#c62828; margin-top:0;">❌ 未知模型选项</h3>
         </div>"""
     
-    # 更新对话历史
-    conversation_history.append({
-        "question": question,
-        "answer": response
-    })
-    
-    # 清空输入框
-    return conversation_history, ""
+    return response
 
-def format_chat_history(history: List[Dict[str, str]]) -> str:
+def render_turn(item: Dict[str, str]) -> str:
     """
-    格式化聊天历史为显示字符串
+    渲染单轮对话的 HTML 片段（每轮只在产生时渲染一次，结果缓存在 item["html"] 中）
     """
-    if not history:
-        return "<div style='text-align: center; color: #888; padding: 20px;'>暂无对话历史</div>"
-    
-    formatted = "<div class='chat-container'>"
-    for i, item in enumerate(history, 1):
-        # 用户消息
-        formatted += f"""
+    # 用户消息 + 助手消息
+    return f"""
         <div class='message user-message'>
             <div class='message-content'><strong>用户:</strong> {item['question']}</div>
         </div>
-        """
-        # 助手消息
-        formatted += f"""
         <div class='message assistant-message'>
             <div class='message-content'>{item['answer']}</div>
         </div>
         """
-    formatted += "</div>"
-    return formatted
 
-def clear_history() -> tuple:
+def format_chat_history(session_id: str, visible_turns: int = CHAT_PAGE_SIZE) -> str:
+    """
+    格式化聊天历史为显示字符串
+    只拼接最近 visible_turns 轮的缓存片段，更早的轮次折叠，每次提交的渲染量和传输量不随对话长度增长
+    """
+    history = SESSION_STORE.get(session_id) if session_id else []
+    if not history:
+        return "<div style='text-align: center; color: #888; padding: 20px;'>暂无对话历史</div>"
+    
+    visible = history[-visible_turns:] if visible_turns > 0 else history
+    hidden = len(history) - len(visible)
+    
+    parts = ["<div class='chat-container'>"]
+    if hidden:
+        parts.append(f"<div class='history-fold'>⬆️ 已折叠较早的 {hidden} 轮对话，点击「加载更早对话」查看</div>")
+    for item in visible:
+        parts.append(item.get("html") or render_turn(item))
+    parts.append("</div>")
+    return "".join(parts)
+
+def show_latest_turns(session_id: str) -> tuple:
+    """
+    提交或重试后回到最近一页：展开的页数恢复为 CHAT_PAGE_SIZE，避免之前展开的较早对话在之后每次提交时都重新渲染
+    """
+    return CHAT_PAGE_SIZE, format_chat_history(session_id, CHAT_PAGE_SIZE)
+
+def show_earlier_turns(session_id: str, visible_turns: int) -> tuple:
+    """
+    向前多展开一页较早的对话
+    """
+    total_turns = len(SESSION_STORE.get(session_id)) if session_id else 0
+    visible_turns = min(visible_turns + CHAT_PAGE_SIZE, max(total_turns, CHAT_PAGE_SIZE))
+    return visible_turns, format_chat_history(session_id, visible_turns)
+
+def format_pool_status() -> str:
+    """
+    各执行池的并发上限、执行中 / 排队任务数与排队等待时间
+    """
+    rows = "".join(
+        f"<tr><td>{st['name']}</td><td>{st['running']}/{st['max_workers']}</td><td>{st['queued']}/{st['max_queue']}</td>"
+        f"<td>{st['completed']}</td><td>{st['rejected']}</td><td>{st['wait_mean']:.3f}s</td><td>{st['wait_max']:.3f}s</td></tr>"
+        for st in (CLASSIFIER_POOL.stats(), PROVIDER_POOL.stats())
+    )
+    return ("<h4>执行池</h4><table class='example-table'><thead><tr><th>执行池</th><th>执行中</th><th>排队</th>"
+            "<th>已完成</th><th>拒绝</th><th>平均排队</th><th>最长排队</th></tr></thead>"
+            f"<tbody>{rows}</tbody></table>")
+
+def format_usage_report() -> str:
+    """
+    大模型调用统计：按服务商、标签、回答模式汇总 tokens、费用与延迟
+    """
+    def table(title: str, dim: str) -> str:
+        rows = USAGE.summary((dim,))
+        if not rows:
+            return ""
+        body = "".join(
+            f"<tr><td>{r[dim]}</td><td>{r['calls']}</td><td>{r['errors']}</td><td>{r['speculative_calls']}</td>"
+            f"<td>{r['prompt_tokens']:,}</td><td>{r['completion_tokens']:,}</td><td>¥{r['cost']:.4f}</td>"
+            f"<td>{r['latency_mean']:.2f}s</td><td>{r['latency_max']:.2f}s</td></tr>"
+            for r in rows
+        )
+        return (f"<h4>{title}</h4><table class='example-table'><thead><tr><th>{title}</th><th>调用</th><th>失败</th>"
+                "<th>投机</th><th>输入 tokens</th><th>输出 tokens</th><th>费用</th><th>平均延迟</th><th>最大延迟</th>"
+                f"</tr></thead><tbody>{body}</tbody></table>")
+
+    sections = [table("服务商", "provider"), table("标签", "label"), table("回答模式", "mode")]
+    if not any(sections):
+        sections = ["<div style='color:#888; padding:8px;'>暂无大模型调用记录</div>"]
+    return format_pool_status() + format_admission_status() + format_faq_status() + "".join(sections)
+
+def format_admission_status() -> str:
+    """
+    准入控制：当前降级等级、在途请求、大模型排队数、最近 p90 延迟与各等级的请求数
+    """
+    st = ADMISSION.stats()
+    admitted = "，".join(f"{name} {count}" for name, count in st["admitted"].items())
+    return (f"<h4>准入控制</h4><div style='padding:4px 0;'>⚡ 当前降级 {st['level']} 级（{DEGRADE_LEVELS[st['level']]}），"
+            f"在途请求 {st['in_flight']}，大模型排队 {st['backlog']}，最近 p90 延迟 {st['p90_latency']:.1f}s；"
+            f"已接入：{admitted}</div>")
+
+def format_faq_status() -> str:
+    """
+    问答库条数与命中情况
+    """
+    if FAQ_INDEX is None:
+        return ""
+    st = FAQ_INDEX.stats()
+    lookups = st["hits"] + st["misses"]
+    rate = f"{st['hits'] / lookups:.1%}" if lookups else "-"
+    stale = f"，{st['stale']} 次因模型已替换、问答库待重建而跳过" if st["stale"] else ""
+    return (f"<h4>问答库</h4><div style='padding:4px 0;'>📚 {st['size']} 条（{st['kind']} 检索，阈值 {st['threshold']}），"
+            f"命中 {st['hits']} / 查询 {lookups}（命中率 {rate}）{stale}</div>")
+
+def clear_history(session_id: str) -> tuple:
     """
     清空对话历史
     """
-    return [], "", "对话历史已清空"
+    if session_id:
+        SESSION_STORE.clear(session_id)
+    return None, "", "对话历史已清空", CHAT_PAGE_SIZE
 
 # 更新可用模型选项
 ENHANCED_MODELS = ["本地农业分类模型", "智能路由模式"] + [m for m in AVAILABLE_MODELS if m != "本地农业分类模型"]
@@ -707,6 +1210,14 @@ li::before {
 .chat-placeholder {
     width: 100%;
 }
+.history-fold {
+    text-align: center;
+    color: #888;
+    font-size: 0.85em;
+    padding: 6px 0 12px 0;
+    border-bottom: 1px dashed #e0e0e0;
+    margin-bottom: 12px;
+}
 /* 重要：为聊天容器添加调整手柄 */
 
 """
@@ -737,6 +1248,13 @@ with gr.Blocks(theme=gr.themes.Soft(primary_hue="green"), css=custom_css) as dem
             retry_btn = gr.Button("🔄 Retry", variant="secondary", elem_classes="action-button")
             undo_btn = gr.Button("↩️ Undo", variant="secondary", elem_classes="action-button")
             clear_btn = gr.Button("🗑️ Clear", variant="secondary", elem_classes="action-button")
+            earlier_btn = gr.Button("⬆️ 加载更早对话", variant="secondary", elem_classes="action-button")
+            retry_target = gr.Dropdown(
+                choices=[RETRY_INTEGRATION],
+                value=RETRY_INTEGRATION,
+                label="重试范围",
+                interactive=True
+            )
         
         # 输入提示
         gr.Markdown(
@@ -799,29 +1317,104 @@ with gr.Blocks(theme=gr.themes.Soft(primary_hue="green"), css=custom_css) as dem
                 interactive=True,
                 elem_classes="model-options"
             )
+            gr.Markdown("#### 整合方式（智能路由模式）", elem_classes="model-selector-title")
+            integration_mode = gr.Radio(
+                choices=INTEGRATION_MODES,
+                label="",
+                value=DEFAULT_INTEGRATION_MODE,
+                interactive=True,
+                elem_classes="model-options"
+            )
+        
+        # 调用统计
+        with gr.Accordion("📊 运行统计（执行池 / tokens / 费用 / 延迟）", open=False):
+            usage_display = gr.HTML(format_usage_report())
+            usage_refresh_btn = gr.Button("刷新统计", variant="secondary")
     
-    # 状态变量
-    chat_history = gr.State([])
+    # 状态变量（只保存会话 ID，对话内容由 SESSION_STORE 管理）
+    chat_history = gr.State(None)
+    visible_turns = gr.State(CHAT_PAGE_SIZE)
     
     # 绑定事件
     submit_btn.click(
         fn=route_answer_with_context,
-        inputs=[chat_history, input_box, model_choice],
-        outputs=[chat_history, input_box]
+        inputs=[chat_history, input_box, model_choice, integration_mode],
+        outputs=[chat_history, input_box],
+        concurrency_limit=QUEUE_CONCURRENCY
     ).then(
-        fn=format_chat_history,
+        fn=show_latest_turns,
         inputs=[chat_history],
+        outputs=[visible_turns, chat_display]
+    ).then(
+        fn=format_usage_report,
+        inputs=[],
+        outputs=[usage_display]
+    ).then(
+        fn=retry_choices,
+        inputs=[chat_history],
+        outputs=[retry_target]
+    )
+    
+    # Retry：沿用缓存的分类结果与各标签回答，默认只重做整合
+    retry_btn.click(
+        fn=retry_last_turn,
+        inputs=[chat_history, retry_target, integration_mode],
+        outputs=None,
+        concurrency_limit=QUEUE_CONCURRENCY
+    ).then(
+        fn=show_latest_turns,
+        inputs=[chat_history],
+        outputs=[visible_turns, chat_display]
+    )
+    
+    # Undo：移除最后一轮，不重新计算
+    undo_btn.click(
+        fn=undo_last_turn,
+        inputs=[chat_history],
+        outputs=[input_box]
+    ).then(
+        fn=format_chat_history,
+        inputs=[chat_history, visible_turns],
         outputs=[chat_display]
+    ).then(
+        fn=retry_choices,
+        inputs=[chat_history],
+        outputs=[retry_target]
+    )
+    
+    usage_refresh_btn.click(
+        fn=format_usage_report,
+        inputs=[],
+        outputs=[usage_display]
+    )
+    
+    earlier_btn.click(
+        fn=show_earlier_turns,
+        inputs=[chat_history, visible_turns],
+        outputs=[visible_turns, chat_display]
     )
     
     clear_btn.click(
         fn=clear_history,
-        inputs=None,
-        outputs=[chat_history, input_box, chat_display]
+        inputs=[chat_history],
+        outputs=[chat_history, input_box, chat_display, visible_turns]
+    ).then(
+        fn=retry_choices,
+        inputs=[chat_history],
+        outputs=[retry_target]
     )
 
 if __name__ == "__main__":
     print("🚀 启动农业智能体 Web 界面...")
     print(f"可用模型: {AVAILABLE_MODELS}")
     print(f"标签到模型映射: {LABEL_TO_MODEL}")
+    print(f"请求队列: 最多排队 {QUEUE_MAX_SIZE}，并发 {QUEUE_CONCURRENCY}；"
+          f"分类池 {CLASSIFIER_POOL.max_workers} 线程，大模型池 {PROVIDER_POOL.max_workers} 线程")
+    demo.queue(max_size=QUEUE_MAX_SIZE, default_concurrency_limit=QUEUE_CONCURRENCY)
+    if not CLASSIFIER_SERVICE_URL and os.getenv("INFERENCE_MODE") == "compiled":
+        # 编译模式的首次前向要编译全部输入形状：在界面可访问之前完成加载和预热，首个请求不承担编译开销
+        print("⏳ 编译模式：加载并预热本地分类模型后再启动界面...")
+        preload_classifier()
+    elif CLASSIFIER_PRELOAD and not CLASSIFIER_SERVICE_URL:
+        threading.Thread(target=preload_classifier, name="classifier-preload", daemon=True).start()
     demo.launch(server_name="0.0.0.0", server_port=7860, show_api=False)
\ No newline at end of file
@@ -0,0 +1,156 @@
+# calibrate_early_exit.py
+"""
+从现有 checkpoint 拟合早退用的中间层证据头，并报告不同不确定度阈值下的速度 / 一致性
+
+用法:
+    python calibrate_early_exit.py questions.txt --layers 3,6,9 --thresholds 0.1,0.2,0.3,0.4
+questions.txt 每行一个问题（也可以是 JSONL，读取每行的 "text" 字段）
+
+证据头以原模型最后一层的证据为目标做蒸馏，不需要人工标注；问题的编码与线上 predict 相同（inference.encode_windows），
+长文本模式下每个窗口作为一个拟合样本，评估时按窗口合并证据后再判定；
+拟合结果保存到 EARLY_EXIT_HEADS_PATH，设置 EARLY_EXIT_THRESHOLD 后 inference.py 自动加载
+"""
+import argparse
+import json
+import time
+
+import torch
+import torch.nn.functional as F
+
+from inference import DEVICE, EARLY_EXIT_HEADS_PATH, ID2LABEL, LOADED_MODELS, combine_window_evidence, encode_windows
+
+
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["text"]
+            questions.append(line)
+    return questions
+
+
+def collect_features(model, questions, layers, batch_size):
+    """
+    一次前向取出各中间层的 pooler 输出，以及最后一层的证据（蒸馏目标）
+    """
+    pooled = {layer: [] for layer in layers}
+    teacher = []
+    with torch.no_grad():
+        for start in range(0, len(questions), batch_size):
+            encoding, _ = encode_windows(questions[start:start + batch_size])
+            outputs = model.bert(input_ids=encoding["input_ids"], attention_mask=encoding["attention_mask"],
+                                 output_hidden_states=True)
+            # 与 inference.predict 一样转为 float32：bf16 模式下目标和特征也与 float32 的证据头一致
+            teacher.append(F.softplus(model.evidence_layer(outputs.pooler_output)).float())
+            for layer in layers:
+                pooled[layer].append(model.bert.pooler(outputs.hidden_states[layer]).float())
+    return {layer: torch.cat(v) for layer, v in pooled.items()}, torch.cat(teacher)
+
+
+def fit_heads(model, layers, features, teacher, epochs, lr):
+    """
+    以 log(1 + evidence) 的均方误差拟合每个中间层的证据头
+    """
+    heads = model.attach_exit_heads(layers).to(DEVICE)
+    target = torch.log1p(teacher)
+    optimizer = torch.optim.Adam(heads.parameters(), lr=lr)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = sum(F.mse_loss(torch.log1p(F.softplus(heads[str(layer)](features[layer]))), target)
+                   for layer in layers)
+        loss.backward()
+        optimizer.step()
+    heads.eval()
+    return float(loss)
+
+
+def evaluate(models, questions, thresholds):
+    """
+    逐条（batch=1，与线上 predict 一致）比较全量前向与各阈值下的早退：平均计算层数、判定一致率、延迟
+    """
+    encodings = [encode_windows(q) for q in questions]
+    num_layers = models[0].bert.config.num_hidden_layers
+
+    def run(threshold):
+        decisions, layers_used = [], []
+        start = time.perf_counter()
+        with torch.no_grad():
+            for encoding, owners in encodings:
+                row = []
+                for model in models:
+                    model.exit_threshold = threshold
+                    evidence = combine_window_evidence(model(encoding["input_ids"], encoding["attention_mask"]),
+                                                       owners, 1)
+                    row.append(bool(evidence[0, 1] > evidence[0, 0]))
+                    layers_used.append(model.last_exit_layer if threshold > 0 else num_layers)
+                decisions.append(row)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(encodings)
+        return decisions, sum(layers_used) / len(layers_used), latency_ms
+
+    reference, _, full_latency = run(0.0)
+    report = [{"threshold": 0.0, "avg_layers": float(num_layers), "agreement": 1.0,
+               "per_label_agreement": {ID2LABEL[i]: 1.0 for i in range(len(models))},
+               "latency_ms": full_latency, "speedup": 1.0}]
+    for threshold in thresholds:
+        decisions, avg_layers, latency = run(threshold)
+        per_label = {
+            ID2LABEL[i]: sum(d[i] == r[i] for d, r in zip(decisions, reference)) / len(reference)
+            for i in range(len(models))
+        }
+        report.append({
+            "threshold": threshold,
+            "avg_layers": avg_layers,
+            "agreement": sum(d == r for d, r in zip(decisions, reference)) / len(reference),
+            "per_label_agreement": per_label,
+            "latency_ms": latency,
+            "speedup": full_latency / latency if latency else 0.0,
+        })
+    for model in models:
+        model.exit_threshold = 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="拟合早退证据头并评估速度/一致性")
+    parser.add_argument("questions", help="校准问题集（每行一个问题或 JSONL）")
+    parser.add_argument("--layers", default="3,6,9", help="挂载证据头的中间层，逗号分隔（1 起计）")
+    parser.add_argument("--thresholds", default="0.1,0.2,0.3,0.4", help="评估的不确定度阈值，逗号分隔")
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--eval-limit", type=int, default=200, help="评估时最多使用的问题数")
+    parser.add_argument("--output", default=EARLY_EXIT_HEADS_PATH)
+    args = parser.parse_args()
+
+    layers = [int(x) for x in args.layers.split(",")]
+    thresholds = [float(x) for x in args.thresholds.split(",")]
+    questions = load_questions(args.questions)
+    print(f"📚 校准问题数: {len(questions)}，证据头所在层: {layers}")
+
+    for i, model in enumerate(LOADED_MODELS):
+        features, teacher = collect_features(model, questions, layers, args.batch_size)
+        loss = fit_heads(model, layers, features, teacher, args.epochs, args.lr)
+        print(f"  ✅ {ID2LABEL[i]} 证据头拟合完成，loss={loss:.4f}")
+
+    report = evaluate(LOADED_MODELS, questions[:args.eval_limit], thresholds)
+    print("\n阈值      平均层数   整体一致率   单条延迟(ms)   加速比")
+    for row in report:
+        print(f"{row['threshold']:<9.2f} {row['avg_layers']:<10.2f} {row['agreement']:<12.2%} "
+              f"{row['latency_ms']:<14.1f} {row['speedup']:.2f}x")
+        if row["threshold"] > 0:
+            print("          " + "  ".join(f"{k}:{v:.0%}" for k, v in row["per_label_agreement"].items()))
+
+    torch.save({
+        "layers": layers,
+        "head_states": [model.exit_heads.state_dict() for model in LOADED_MODELS],
+        "report": report,
+    }, args.output)
+    print(f"\n💾 证据头已保存到 {args.output}，设置 EARLY_EXIT_THRESHOLD=<阈值> 后启用早退")
+
+
+if __name__ == "__main__":
+    main()
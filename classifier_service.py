@@ -0,0 +1,272 @@
+# classifier_service.py
+"""
+独立的本地分类服务：一个进程加载 6 个 BERT 模型，多个 Web worker 通过 HTTP 共享
+
+启动服务：
+    python classifier_service.py --host 127.0.0.1 --port 8600
+Web 端使用：
+    设置环境变量 CLASSIFIER_SERVICE_URL=http://127.0.0.1:8600 后，app.py 不再在本进程加载模型
+
+接口：
+    GET  /healthz  进程存活即返回 200，附带队列深度等状态
+    GET  /readyz   模型加载完成返回 200，否则 503
+    POST /predict  {"text": "..."} → {"labels": [...]}
+                   {"texts": [...]} → {"labels": [[...], ...]}
+                   排队请求超过上限时返回 503 + Retry-After（背压）
+    POST /reload   {} 或 {"checkpoint": "路径"} → 后台加载新 checkpoint，冒烟测试通过后不停服切换；
+                   切换期间 /predict 照常由旧模型服务（设置 CHECKPOINT_WATCH_SECONDS 时也会在文件更新后自动切换）
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# 单批最多合并的问题数
+CLASSIFIER_MAX_BATCH = int(os.getenv("CLASSIFIER_MAX_BATCH", "16"))
+# 凑批时最多等待的毫秒数
+CLASSIFIER_BATCH_WAIT_MS = float(os.getenv("CLASSIFIER_BATCH_WAIT_MS", "5"))
+# 最多排队的请求数，超出后直接拒绝
+CLASSIFIER_MAX_PENDING = int(os.getenv("CLASSIFIER_MAX_PENDING", "64"))
+# 单个请求等待结果的超时秒数
+CLASSIFIER_REQUEST_TIMEOUT = float(os.getenv("CLASSIFIER_REQUEST_TIMEOUT", "30"))
+
+
+class ClassifierUnavailable(RuntimeError):
+    """
+    分类服务未就绪、过载或无法连接
+    """
+
+
+class BatchWorker:
+    """
+    后台凑批线程：从队列中取出请求，合并成一批调用 predict_batch，再把结果分发回各请求
+    """
+
+    def __init__(self, max_batch: int = CLASSIFIER_MAX_BATCH, batch_wait_ms: float = CLASSIFIER_BATCH_WAIT_MS,
+                 max_pending: int = CLASSIFIER_MAX_PENDING):
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait_ms / 1000
+        self.pending: "queue.Queue[tuple]" = queue.Queue(maxsize=max_pending)
+        self.ready = threading.Event()
+        self.load_error: Optional[str] = None
+        self.batches_served = 0
+        self.texts_served = 0
+        self.rejected = 0
+        self._predict_batch = None
+        self._model_status = None
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="classifier-batch", daemon=True).start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """
+        提交一组问题，队列已满时抛出 queue.Full
+        """
+        future: Future = Future()
+        try:
+            self.pending.put_nowait((texts, future))
+        except queue.Full:
+            self.rejected += 1
+            raise
+        return future
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready.is_set(),
+            "load_error": self.load_error,
+            "queue_depth": self.pending.qsize(),
+            "max_pending": self.pending.maxsize,
+            "batches_served": self.batches_served,
+            "texts_served": self.texts_served,
+            "rejected": self.rejected,
+            "model": self._model_status() if self._model_status else None,
+        }
+
+    def _run(self) -> None:
+        try:
+            # 在后台线程中导入并加载模型，加载期间 /healthz 仍可响应
+            from inference import CHECKPOINT_WATCH_SECONDS, get_models, model_status, predict_batch, watch_checkpoint
+            get_models()
+            self._predict_batch = predict_batch
+            self._model_status = model_status
+            if CHECKPOINT_WATCH_SECONDS > 0:
+                watch_checkpoint()
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"❌ 分类模型加载失败: {e}")
+            return
+        self.ready.set()
+
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while sum(len(texts) for texts, _ in batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._serve(batch)
+
+    def _serve(self, batch: List[tuple]) -> None:
+        all_texts = [text for texts, _ in batch for text in texts]
+        try:
+            results = self._predict_batch(all_texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches_served += 1
+        self.texts_served += len(all_texts)
+        offset = 0
+        for texts, future in batch:
+            future.set_result(results[offset:offset + len(texts)])
+            offset += len(texts)
+
+
+def _make_handler(worker: BatchWorker):
+    class ClassifierHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-Queue-Depth", str(worker.pending.qsize()))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                self._send_json(200, worker.status())
+            elif self.path == "/readyz":
+                self._send_json(200 if worker.ready.is_set() else 503, worker.status())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path == "/reload":
+                self._reload()
+                return
+            if self.path != "/predict":
+                self._send_json(404, {"error": "not found"})
+                return
+            if not worker.ready.is_set():
+                self._send_json(503, {"error": "模型尚未就绪"}, {"Retry-After": "5"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                single = "text" in payload
+                texts = [payload["text"]] if single else list(payload["texts"])
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {"error": "请求体应为 {\"text\": ...} 或 {\"texts\": [...]}"})
+                return
+            try:
+                future = worker.submit(texts)
+            except queue.Full:
+                self._send_json(503, {"error": "分类服务繁忙，请稍后重试"}, {"Retry-After": "1"})
+                return
+            try:
+                labels = future.result(timeout=CLASSIFIER_REQUEST_TIMEOUT)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {"labels": labels[0] if single else labels})
+
+        def _reload(self):
+            # 在本请求的线程中加载新模型，其他请求的线程照常由旧模型服务
+            if not worker.ready.is_set():
+                self._send_json(503, {"error": "模型尚未就绪"}, {"Retry-After": "5"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                checkpoint = json.loads(self.rfile.read(length) or b"{}").get("checkpoint")
+            except (ValueError, AttributeError):
+                self._send_json(400, {"error": "请求体应为 {} 或 {\"checkpoint\": ...}"})
+                return
+            from inference import reload_models
+            try:
+                result = reload_models(checkpoint)
+            except Exception as e:
+                self._send_json(500, {"error": f"热替换失败，继续使用当前模型: {e}"})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            pass  # 不逐条打印访问日志
+
+    return ClassifierHandler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8600) -> None:
+    worker = BatchWorker()
+    worker.start()
+    server = ThreadingHTTPServer((host, port), _make_handler(worker))
+    print(f"🚀 分类服务已启动: http://{host}:{port}（模型加载完成前 /readyz 返回 503）")
+    server.serve_forever()
+
+
+class ClassifierClient:
+    """
+    分类服务的客户端，接口与 inference.predict / predict_batch 一致
+    """
+
+    def __init__(self, base_url: str, timeout: float = CLASSIFIER_REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path: str, payload: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data,
+            headers={"Content-Type": "application/json; charset=utf-8"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            raise ClassifierUnavailable(f"分类服务返回 {e.code}: {detail}") from e
+        except urllib.error.URLError as e:
+            raise ClassifierUnavailable(f"无法连接分类服务 {self.base_url}: {e.reason}") from e
+
+    def predict(self, text: str) -> List[str]:
+        return self._request("/predict", {"text": text})["labels"]
+
+    def predict_batch(self, texts: List[str]) -> List[List[str]]:
+        return self._request("/predict", {"texts": texts})["labels"]
+
+    def reload(self, checkpoint: Optional[str] = None, timeout: float = 600) -> Dict[str, Any]:
+        """
+        让服务热替换 checkpoint（等待加载与冒烟测试完成），返回新模型的版本信息
+        """
+        return self._request("/reload", {"checkpoint": checkpoint} if checkpoint else {}, timeout)
+
+    def health(self) -> Dict[str, Any]:
+        return self._request("/healthz")
+
+    def is_ready(self) -> bool:
+        try:
+            return bool(self._request("/readyz").get("ready"))
+        except ClassifierUnavailable:
+            return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 BERT-EDL 分类服务")
+    parser.add_argument("--host", default=os.getenv("CLASSIFIER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CLASSIFIER_PORT", "8600")))
+    args = parser.parse_args()
+    serve(args.host, args.port)
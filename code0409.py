@@ -68,76 +68,74 @@
 #     summary_to_df(model_trend).to_excel(writer, sheet_name="Trend")
 #     summary_to_df(model_robust).to_excel(writer, sheet_name="Robust")
 #     summary_to_df(model_fe).to_excel(writer, sheet_name="Fixed Effects")
+"""
+DID 分析流水线（命令行、无界面）
+
+阶段: load → features → fit:<模型> / bootstrap / placebo → plot:<图> → export
+每个阶段的输出按输入缓存在 .did_cache/stages，图写入 --out-dir；只改作图参数时不会重新回归。
+
+用法:
+    python code0409.py                       # 运行全部阶段（命中缓存的跳过）
+    python code0409.py --dpi 200             # 只重画图
+    python code0409.py --stages fit:did      # 只算指定阶段
+    python code0409.py --force fit:trend     # 忽略缓存重算指定阶段（all 表示全部）
+    python code0409.py --list                # 列出阶段及缓存状态
+"""
 # 1. 导入库
+import argparse
+import os
+
+import matplotlib
+matplotlib.use("Agg")  # 无界面后端：图写入文件，不阻塞在 plt.show()
 import pandas as pd
-import numpy as np
-import statsmodels.formula.api as smf
-import matplotlib.pyplot as plt
 import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib
+import statsmodels.formula.api as smf
+from matplotlib.figure import Figure
+
+from did_data import file_sha256, load_panel
+from did_fe import fit_absorbed
+from did_inference import (BOOTSTRAP_WORKERS, POLICY_DATE, pairs_cluster_bootstrap, placebo_grid, prepare_design,
+                           wild_cluster_bootstrap)
+from did_pipeline import Pipeline
+from did_stream import fit_streamed, stream_group_means
 
 # 设置字体为支持中文的字体
 matplotlib.rcParams['font.sans-serif'] = ['SimHei']  # 设置中文显示为黑体
 matplotlib.rcParams['axes.unicode_minus'] = False  # 正常显示负号
-# 2. 读取数据
-df = pd.read_excel("did_tourism_stock_large_dataset.xlsx")
-
-# 3. 可选：时间格式转换
-df["date"] = pd.to_datetime(df["date"])
-
-# 4. 平行趋势图
-df_plot = df.groupby(["date", "treat"])["return"].mean().reset_index()
-df_plot["group"] = df_plot["treat"].map({1: "旅游行业", 0: "非旅游行业"})
-
-plt.figure(figsize=(12, 6))
-sns.lineplot(data=df_plot, x="date", y="return", hue="group", marker="o")
-plt.axvline(pd.to_datetime("2023-07-01"), color="gray", linestyle="--", label="政策拐点")
-plt.title("平行趋势图：旅游 vs 非旅游行业")
-plt.xlabel("时间")
-plt.ylabel("平均收益率")
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-plt.show()
-
-# 5. 构建DID变量（如未存在）
-df["did"] = df["treat"] * df["post"]
-df["time_index"] = (df["date"] - df["date"].min()).dt.days
-
-# 6. 回归模型
-# 标准DID模型
-model_did = smf.ols("return ~ treat + post + did", data=df).fit()
+DATA_FILE = "did_tourism_stock_large_dataset.xlsx"
+EXCEL_FILE = "did_results_summary.xlsx"
+OUTPUT_DIR = os.getenv("DID_OUTPUT_DIR", "did_output")
+# DID_ENGINE=stream 时分块流式估计，面板数据不必整表放入内存
+ENGINE = "stream" if os.getenv("DID_ENGINE") == "stream" else "memory"
+# 自助法重复次数（0 表示跳过自助法与安慰剂检验）
+BOOTSTRAP_REPS = int(os.getenv("DID_BOOTSTRAP_REPS", "999"))
+
+# 回归阶段: 名称 → (Excel 工作表名, 打印标题)；工作表名与 did_stream.SPECS 一致
+MODELS = {
+    "did": ("Standard DID", "DID标准模型"),
+    "trend": ("Trend", "加入趋势项模型"),
+    "robust": ("Robust", "异方差稳健模型"),
+    "fe": ("Fixed Effects", "固定效应模型"),
+    "fe_cluster": ("FE Clustered", "固定效应模型（聚类标准误）"),
+}
+
+
+# 2. 读取数据（Parquet 缓存已按源文件哈希命名，这一阶段不另存；sha256 只参与缓存键）
+def load_data(source, sha256):
+    return load_panel(source)
+
+
+def locate_data(source, sha256):
+    return source
+
+
+# 3. 构建DID变量（如未存在）；之后各阶段只读这张表
+def build_features(df):
+    df["did"] = df["treat"] * df["post"]
+    df["time_index"] = (df["date"] - df["date"].min()).dt.days
+    return df
 
-# 加入趋势项模型
-model_trend = smf.ols("return ~ treat + post + did + time_index + treat:time_index", data=df).fit()
 
-# 异方差稳健模型
-model_robust = smf.ols("return ~ treat + post + did", data=df).fit(cov_type="HC3")
-
-# 固定效应模型
-model_fe = smf.ols("return ~ treat + post + did + C(stock_id)", data=df).fit()
-
-# 打印回归结果
-print("DID标准模型：\n", model_did.summary())
-print("加入趋势项模型：\n", model_trend.summary())
-print("异方差稳健模型：\n", model_robust.summary())
-print("固定效应模型：\n", model_fe.summary())
-
-# 7. 可视化：DID主效应置信区间图
-ci = model_did.conf_int()
-ci.columns = ["lower", "upper"]
-ci["coef"] = model_did.params
-ci = ci.loc[["treat", "post", "did"]]
-
-ci.plot(kind="barh", xerr=(ci["upper"] - ci["lower"]) / 2, figsize=(8, 4), legend=False)
-plt.axvline(0, color="black", linestyle="--")
-plt.title("DID主效应置信区间")
-plt.xlabel("系数")
-plt.tight_layout()
-plt.show()
-
-# 8. 导出结果为Excel
 def summary_to_df(model):
     return pd.DataFrame({
         "coef": model.params,
@@ -146,8 +144,230 @@ def summary_to_df(model):
         "P>|t|": model.pvalues
     })
 
-with pd.ExcelWriter("did_results_summary.xlsx") as writer:
-    summary_to_df(model_did).to_excel(writer, sheet_name="Standard DID")
-    summary_to_df(model_trend).to_excel(writer, sheet_name="Trend")
-    summary_to_df(model_robust).to_excel(writer, sheet_name="Robust")
-    summary_to_df(model_fe).to_excel(writer, sheet_name="Fixed Effects")
+
+def summarize_model(model):
+    """
+    只保留打印、作图和导出需要的部分，缓存大小与观测数无关
+    """
+    ci = model.conf_int()
+    ci.columns = ["lower", "upper"]
+    return {"table": summary_to_df(model), "conf_int": ci, "params": model.params, "summary": str(model.summary())}
+
+
+# 4. 回归模型
+# 标准DID模型
+def fit_did(df):
+    return summarize_model(smf.ols("return ~ treat + post + did", data=df).fit())
+
+
+# 加入趋势项模型
+def fit_trend(df):
+    return summarize_model(smf.ols("return ~ treat + post + did + time_index + treat:time_index", data=df).fit())
+
+
+# 异方差稳健模型
+def fit_robust(df):
+    return summarize_model(smf.ols("return ~ treat + post + did", data=df).fit(cov_type="HC3"))
+
+
+# 固定效应模型（组内去均值吸收个股固定效应，不生成 C(stock_id) 哑变量；treat 与个股效应共线，被吸收）
+def fit_fe(df):
+    return summarize_model(fit_absorbed(df, "return", ["treat", "post", "did"], absorb=["stock_id"]))
+
+
+# 固定效应模型 + 按个股聚类的稳健标准误
+def fit_fe_cluster(df):
+    return summarize_model(fit_absorbed(df, "return", ["treat", "post", "did"], absorb=["stock_id"],
+                                        cluster="stock_id"))
+
+
+# 分块累加充分统计量，一次遍历估计全部模型（第二遍累加稳健 / 聚类标准误所需的残差项）
+def fit_all_streamed(source):
+    streamed = fit_streamed(source)
+    return {name: summarize_model(streamed[sheet]) for name, (sheet, _) in MODELS.items()}
+
+
+def select_model(fits, name):
+    return fits[name]
+
+
+# 5. did 的聚类自助法置信区间与安慰剂检验（复用同一份设计矩阵，随机种子固定）
+def bootstrap_did(df, reps, workers=BOOTSTRAP_WORKERS):
+    design = prepare_design(df)
+    wild = wild_cluster_bootstrap(design, reps=reps)
+    # 该阶段以 main_thread=True 注册，在流水线线程池关闭后于主线程执行，可以安全地 fork 进程池
+    pairs = pairs_cluster_bootstrap(design, reps=reps, workers=workers)
+    return pd.DataFrame([wild, pairs]).set_index("method")
+
+
+def placebo_did(df, policy_date):
+    return placebo_grid(df, policy_date)
+
+
+# 6. 作图（每个图用独立的 Figure 对象，可在线程中并行渲染）
+def trend_data(df):
+    return df.groupby(["date", "treat"])["return"].mean().reset_index()
+
+
+def trend_data_streamed(source):
+    return stream_group_means(source)
+
+
+def plot_trend(df_plot, path, dpi, policy_date):
+    df_plot = df_plot.assign(group=df_plot["treat"].map({1: "旅游行业", 0: "非旅游行业"}))
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    sns.lineplot(data=df_plot, x="date", y="return", hue="group", marker="o", ax=ax)
+    ax.axvline(pd.to_datetime(policy_date), color="gray", linestyle="--", label="政策拐点")
+    ax.set_title("平行趋势图：旅游 vs 非旅游行业")
+    ax.set_xlabel("时间")
+    ax.set_ylabel("平均收益率")
+    ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+# DID主效应置信区间图
+def plot_ci(fit, path, dpi):
+    ci = fit["conf_int"].copy()
+    ci["coef"] = fit["params"]
+    ci = ci.loc[["treat", "post", "did"]]
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    ci.plot(kind="barh", xerr=(ci["upper"] - ci["lower"]) / 2, legend=False, ax=ax)
+    ax.axvline(0, color="black", linestyle="--")
+    ax.set_title("DID主效应置信区间")
+    ax.set_xlabel("系数")
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def plot_placebo(placebo, path, dpi):
+    placebo_df, placebo_summary = placebo
+    fig = Figure(figsize=(12, 4))
+    ax = fig.subplots()
+    ax.plot(placebo_df["placebo_date"], placebo_df["coef"], label="安慰剂 did 系数")
+    ax.axhline(placebo_summary["true_coef"], color="red", linestyle="--", label="真实 did 系数")
+    ax.axhline(0, color="black", linewidth=0.8)
+    ax.set_title("安慰剂检验：政策日前的假想政策拐点")
+    ax.set_xlabel("假想政策日")
+    ax.set_ylabel("系数")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+# 7. 导出结果为Excel（输入不变时命中缓存，不重写文件）
+def export_excel(*inputs, path):
+    fits, extras = inputs[:len(MODELS)], inputs[len(MODELS):]
+    with pd.ExcelWriter(path) as writer:
+        for (sheet, _), fit in zip(MODELS.values(), fits):
+            fit["table"].to_excel(writer, sheet_name=sheet)
+        if extras:
+            bootstrap, (placebo_df, _) = extras
+            bootstrap.to_excel(writer, sheet_name="Bootstrap")
+            placebo_df.to_excel(writer, sheet_name="Placebo", index=False)
+    return path
+
+
+def build_pipeline(args):
+    """
+    按命令行参数组装阶段；返回 (流水线, 默认目标阶段)
+    """
+    pipeline = Pipeline(jobs=args.jobs)
+    data_params = {"source": args.source, "sha256": file_sha256(args.source)}
+    streaming = args.engine == "stream"
+    inference = args.bootstrap_reps > 0 and not streaming
+    if args.bootstrap_reps > 0 and streaming:
+        print("⚠️ 流式模式下不做自助法与安慰剂检验（需要整表数据）")
+
+    if streaming:
+        pipeline.add("load", locate_data, params=data_params, persist=False)
+        pipeline.add("fit:streamed", fit_all_streamed, ["load"])
+        for name in MODELS:
+            pipeline.add(f"fit:{name}", select_model, ["fit:streamed"], {"name": name}, persist=False)
+        pipeline.add("trend_data", trend_data_streamed, ["load"])
+    else:
+        pipeline.add("load", load_data, params=data_params, persist=False)
+        pipeline.add("features", build_features, ["load"], persist=False)
+        for name in MODELS:
+            pipeline.add(f"fit:{name}", globals()[f"fit_{name}"], ["features"])
+        pipeline.add("trend_data", trend_data, ["features"])
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    plot_params = {"dpi": args.dpi}
+
+    def figure(stem):
+        return os.path.join(args.out_dir, f"{stem}.{args.format}")
+
+    pipeline.add("plot:trend", plot_trend, ["trend_data"],
+                 {"path": figure("parallel_trend"), "policy_date": POLICY_DATE, **plot_params}, artifact=True)
+    pipeline.add("plot:ci", plot_ci, ["fit:did"], {"path": figure("did_confidence_interval"), **plot_params},
+                 artifact=True)
+
+    export_deps = [f"fit:{name}" for name in MODELS]
+    if inference:
+        # 进程数不影响结果（每批的随机种子固定），不计入缓存键
+        pipeline.add("bootstrap", bootstrap_did, ["features"], {"reps": args.bootstrap_reps}, main_thread=True,
+                     options={"workers": args.bootstrap_workers})
+        pipeline.add("placebo", placebo_did, ["features"], {"policy_date": POLICY_DATE})
+        pipeline.add("plot:placebo", plot_placebo, ["placebo"], {"path": figure("placebo"), **plot_params},
+                     artifact=True)
+        export_deps += ["bootstrap", "placebo"]
+    pipeline.add("export", export_excel, export_deps, {"path": args.excel}, artifact=True)
+
+    intermediate = {"load", "features", "trend_data", "fit:streamed"}
+    return pipeline, [name for name in pipeline.stages if name not in intermediate]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DID 分析流水线")
+    parser.add_argument("--source", default=DATA_FILE, help="面板数据（Excel 或 Parquet）")
+    parser.add_argument("--engine", choices=["memory", "stream"], default=ENGINE)
+    parser.add_argument("--out-dir", default=OUTPUT_DIR, help="图的输出目录")
+    parser.add_argument("--excel", default=EXCEL_FILE, help="回归结果 Excel 路径")
+    parser.add_argument("--format", default="png", help="图的文件格式（png / svg / pdf）")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--bootstrap-reps", type=int, default=BOOTSTRAP_REPS)
+    parser.add_argument("--bootstrap-workers", type=int, default=BOOTSTRAP_WORKERS, help="配对自助法的进程数")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="并行执行的阶段数")
+    parser.add_argument("--stages", nargs="+", help="只计算这些阶段（及其未命中缓存的上游）")
+    parser.add_argument("--force", nargs="+", default=[], help="忽略缓存重算的阶段，all 表示全部")
+    parser.add_argument("--list", action="store_true", help="列出阶段及缓存状态")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pipeline, targets = build_pipeline(args)
+    if args.list:
+        for name, stage in pipeline.stages.items():
+            state = "缓存" if pipeline.is_cached(name) else ("每次计算" if not stage.persist else "待计算")
+            print(f"{name:<16} {pipeline.key(name)[:12]}  依赖: {', '.join(stage.deps) or '-'}  [{state}]")
+        return
+
+    force = list(pipeline.stages) if args.force == ["all"] else args.force
+    results = pipeline.run(args.stages or targets, force)
+
+    # 打印回归结果
+    for name, (_, title) in MODELS.items():
+        if f"fit:{name}" in results:
+            print(f"{title}：\n", results[f"fit:{name}"]["summary"])
+    if "bootstrap" in results:
+        print("did 自助法置信区间：\n", results["bootstrap"])
+    if "placebo" in results:
+        placebo_summary = results["placebo"][1]
+        print(f"安慰剂检验：{placebo_summary['placebo_count']} 个假想政策日，"
+              f"|系数| 不小于真实 did 的比例 {placebo_summary['placebo_p']:.3f}，"
+              f"5% 水平显著的比例 {placebo_summary['share_significant_5pct']:.3f}")
+    for name in sorted(results):
+        if pipeline.stages[name].artifact:
+            print(f"📄 {name}: {results[name]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# compress_ensemble.py
+"""
+把 6 个微调自同一 bert-base-chinese 的分类器压缩为「共享基座 + 每个标签的低秩增量」
+
+用法:
+    python compress_ensemble.py --energy 0.9 --max-rank 64 --questions questions.txt
+每个权重矩阵的增量 W_i - W_base 做 SVD，保留累计能量达到 --energy 的最小秩（不超过 --max-rank）；
+低秩不比稠密更省时直接存稠密增量，与基座完全相同的参数不存。
+输出文件设置 INFERENCE_MODE=lowrank 后由 inference.py 加载；指定 --questions 时输出与原模型证据的对比报告
+"""
+import argparse
+import os
+
+import torch
+from transformers import BertModel
+
+import inference
+from inference import (CHECKPOINT_PATH, ID2LABEL, LOWRANK_CHECKPOINT_PATH, build_lowrank_models, combine_window_evidence,
+                       encode_windows)
+
+# 小于该维度的矩阵不做 SVD
+MIN_MATRIX_DIM = 64
+
+
+def factor_delta(delta, energy, max_rank):
+    """
+    返回 ("lowrank", U·S, Vᵀ) / ("dense", delta) / None（与基座相同）
+    """
+    if not torch.any(delta):
+        return None
+    if delta.dim() != 2 or min(delta.shape) < MIN_MATRIX_DIM:
+        return ("dense", delta.clone())
+    u, s, vh = torch.linalg.svd(delta, full_matrices=False)
+    energy_ratio = torch.cumsum(s ** 2, 0) / (s ** 2).sum()
+    rank = min(int(torch.searchsorted(energy_ratio, torch.tensor(energy)).item()) + 1, max_rank, len(s))
+    rows, cols = delta.shape
+    if rank * (rows + cols) >= rows * cols:
+        return ("dense", delta.clone())
+    return ("lowrank", (u[:, :rank] * s[:rank]).contiguous(), vh[:rank].contiguous())
+
+
+def _tensor_bytes(entry):
+    if entry is None:
+        return 0
+    return sum(t.numel() * t.element_size() for t in entry[1:])
+
+
+def compress(model_states, base_state, energy, max_rank, half):
+    """
+    model_states: checkpoint 中每个标签的 state_dict（键以 "bert." / "evidence_layer." 开头）
+    base_state: 基座 bert 的 state_dict（键不带 "bert." 前缀）
+    """
+    deltas, evidence_states = [], []
+    for i, state in enumerate(model_states):
+        label_deltas, label_ranks = {}, []
+        for key, value in state.items():
+            if not key.startswith("bert.") or not value.is_floating_point():
+                continue
+            name = key[len("bert."):]
+            if name not in base_state:
+                continue
+            entry = factor_delta(value.float() - base_state[name].float(), energy, max_rank)
+            if entry is None:
+                continue
+            if half:
+                entry = (entry[0],) + tuple(t.half() for t in entry[1:])
+            label_deltas[name] = entry
+            if entry[0] == "lowrank":
+                label_ranks.append(entry[1].shape[1])
+        deltas.append(label_deltas)
+        evidence_states.append({
+            "weight": state["evidence_layer.weight"].clone(),
+            "bias": state["evidence_layer.bias"].clone(),
+        })
+        avg_rank = sum(label_ranks) / len(label_ranks) if label_ranks else 0
+        print(f"  ✅ {ID2LABEL[i]}：{len(label_deltas)} 个参数有增量，低秩矩阵 {len(label_ranks)} 个，平均秩 {avg_rank:.1f}")
+    return deltas, evidence_states
+
+
+def fidelity_report(reference_models, compressed_models, questions):
+    """
+    逐条比较原模型与压缩模型的证据、不确定度和判定；编码与证据合并同线上 predict（encode_windows + combine_window_evidence）
+    """
+    max_abs, rel_sum, unc_sum, agree, total = 0.0, 0.0, 0.0, 0, 0
+    per_label = [0] * len(reference_models)
+    with torch.no_grad():
+        for question in questions:
+            encoding, owners = encode_windows(question)
+            for i, (ref, comp) in enumerate(zip(reference_models, compressed_models)):
+                e_ref = combine_window_evidence(ref(encoding["input_ids"], encoding["attention_mask"]), owners, 1).float()
+                e_comp = combine_window_evidence(comp(encoding["input_ids"], encoding["attention_mask"]), owners, 1).float()
+                diff = (e_ref - e_comp).abs()
+                max_abs = max(max_abs, float(diff.max()))
+                rel_sum += float((diff / (e_ref.abs() + 1e-6)).mean())
+                unc_sum += float((inference.dirichlet_uncertainty(e_ref) - inference.dirichlet_uncertainty(e_comp)).abs().mean())
+                same = bool(e_ref[0, 1] > e_ref[0, 0]) == bool(e_comp[0, 1] > e_comp[0, 0])
+                agree += same
+                per_label[i] += same
+                total += 1
+    print("\n📊 与原模型的一致性：")
+    print(f"   证据最大绝对误差: {max_abs:.4f}")
+    print(f"   证据平均相对误差: {rel_sum / total:.2%}")
+    print(f"   不确定度平均偏差: {unc_sum / total:.4f}")
+    print(f"   判定一致率: {agree / total:.2%}")
+    for i, count in enumerate(per_label):
+        print(f"     {ID2LABEL[i]}: {count / len(questions):.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="低秩增量压缩 6 个微调分类器")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--output", default=LOWRANK_CHECKPOINT_PATH)
+    parser.add_argument("--base-model", default="bert-base-chinese")
+    parser.add_argument("--base", choices=["pretrained", "mean"], default="pretrained",
+                        help="增量的基座：预训练权重，或 6 个模型权重的均值（均值基座会一并写入输出文件）")
+    parser.add_argument("--energy", type=float, default=0.9, help="每个增量矩阵保留的奇异值能量比例")
+    parser.add_argument("--max-rank", type=int, default=64)
+    parser.add_argument("--half", action="store_true", help="增量以 float16 存储")
+    parser.add_argument("--questions", help="用于对比证据的问题集（每行一个问题）")
+    args = parser.parse_args()
+
+    print(f"📦 读取 {args.checkpoint}")
+    checkpoint = torch.load(args.checkpoint, map_location="cpu", weights_only=False)
+    model_states = checkpoint["model_states"]
+
+    base_state = BertModel.from_pretrained(args.base_model).state_dict()
+    stored_base = None
+    if args.base == "mean":
+        for name in base_state:
+            key = f"bert.{name}"
+            if key in model_states[0] and model_states[0][key].is_floating_point():
+                base_state[name] = torch.stack([s[key].float() for s in model_states]).mean(0)
+        stored_base = base_state
+
+    deltas, evidence_states = compress(model_states, base_state, args.energy, args.max_rank, args.half)
+    compressed = {
+        "format": "lowrank-delta-v1",
+        "base_model": args.base_model,
+        "base_state": stored_base,
+        "num_classes": checkpoint["num_classes"],
+        "energy": args.energy,
+        "max_rank": args.max_rank,
+        "deltas": deltas,
+        "evidence_states": evidence_states,
+    }
+    torch.save(compressed, args.output)
+
+    original_bytes = sum(t.numel() * t.element_size() for s in model_states for t in s.values() if torch.is_tensor(t))
+    base_bytes = sum(t.numel() * t.element_size() for t in base_state.values())
+    delta_bytes = sum(_tensor_bytes(e) for d in deltas for e in d.values())
+    print(f"\n💾 已保存到 {args.output}（文件 {os.path.getsize(args.output) / 2**20:.1f} MB）")
+    print(f"   原始 6 份权重: {original_bytes / 2**20:.1f} MB")
+    print(f"   共享基座 {base_bytes / 2**20:.1f} MB + 增量 {delta_bytes / 2**20:.1f} MB"
+          f" ≈ {original_bytes / (base_bytes + delta_bytes):.2f}× 压缩")
+
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        reference = inference.LOADED_MODELS if inference.INFERENCE_MODE == "fp32" else inference.load_ensemble("fp32")
+        fidelity_report(reference, build_lowrank_models(compressed), questions)
+
+
+if __name__ == "__main__":
+    main()
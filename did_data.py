@@ -0,0 +1,85 @@
+# did_data.py
+"""
+DID 面板数据读取：Excel 只在首次（或源文件变化后）解析一次，转存为 Parquet 列式缓存
+
+缓存文件名带源文件的 SHA-256 前缀，源文件内容不变就一直复用；date 列在缓存中已是日期类型，
+读取时只加载回归和作图需要的列
+"""
+import glob
+import hashlib
+import os
+
+import pandas as pd
+
+DATA_PATH = "did_tourism_stock_large_dataset.xlsx"
+CACHE_DIR = os.getenv("DID_CACHE_DIR", ".did_cache")
+
+# 回归与作图用到的列
+PANEL_COLUMNS = ["stock_id", "date", "treat", "post", "return"]
+# 缓存中使用的紧凑类型
+COLUMN_DTYPES = {"treat": "int8", "post": "int8", "return": "float64"}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path_for(source):
+    """
+    源文件对应的 Parquet 缓存路径（按内容哈希命名）
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(CACHE_DIR, f"{stem}-{file_sha256(source)[:16]}.parquet")
+
+
+def build_cache(source, cache_path):
+    """
+    解析 Excel，转换类型后写入 Parquet，并清理同一源文件的旧缓存
+    """
+    print(f"📥 首次读取 {source}，转换为列式缓存（之后源文件不变时直接读缓存）...")
+    df = pd.read_excel(source)
+    df["date"] = pd.to_datetime(df["date"])
+    for column, dtype in COLUMN_DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    for old in glob.glob(os.path.join(CACHE_DIR, f"{stem}-*.parquet")):
+        os.remove(old)
+    tmp_path = cache_path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+
+def ensure_cache(source):
+    """
+    返回可直接读取的 Parquet 路径：源文件本身是 Parquet 时直接使用，否则按需生成缓存
+    """
+    if source.endswith(".parquet"):
+        return source
+    cache_path = cache_path_for(source)
+    if not os.path.exists(cache_path):
+        build_cache(source, cache_path)
+    return cache_path
+
+
+def load_panel(source=DATA_PATH, columns=PANEL_COLUMNS):
+    """
+    读取 DID 面板数据，返回只含 columns 的 DataFrame（date 已解析为日期类型）
+    """
+    return pd.read_parquet(ensure_cache(source), columns=columns)
+
+
+def iter_panel_chunks(source=DATA_PATH, columns=PANEL_COLUMNS, chunk_rows=500_000):
+    """
+    按块流式读取面板数据，每块最多 chunk_rows 行，整张表不必同时放进内存
+    """
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(ensure_cache(source))
+    for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pandas()
@@ -0,0 +1,217 @@
+# did_inference.py
+"""
+DID 系数 did 的自助法置信区间与安慰剂检验
+
+- 野聚类自助法（wild cluster bootstrap，Rademacher 权重）：设计矩阵固定，每次重复只是对各聚类得分加权，
+  β* = β̂ + (X'X)⁻¹ Σ_g w_g X_g'ê_g，可对成批的重复一次矩阵乘完成
+- 聚类配对自助法（pairs cluster bootstrap）：预先算好每个聚类的 X_g'X_g 与 X_g'y_g，
+  重复抽样只需按抽中次数加权求和再解方程；重复按批分给进程池并行，随机种子按批派生，结果与进程数无关。
+  抽中的聚类全是处理组（或全是对照组）时 X'X 奇异、did 不可识别，这类重复按条件数识别后丢弃，丢弃数随结果报告
+- 安慰剂检验：在政策日前的样本中，把每个候选日期当作假想的政策拐点估计标准 DID。
+  标准 DID 是 2×2 饱和模型，系数和标准误只依赖各 (treat, post) 单元的计数、和与平方和，
+  对按日期排序的累计和做差即可一次算出全部候选日期，无需逐个重新回归
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+POLICY_DATE = "2023-07-01"
+DEFAULT_SEED = 20230701
+BOOTSTRAP_BATCH = 1000
+BOOTSTRAP_WORKERS = int(os.getenv("DID_BOOTSTRAP_WORKERS", str(os.cpu_count() or 1)))
+# 配对自助法中 X'X 的条件数超过该值视为奇异，丢弃该次重复
+PAIRS_MAX_CONDITION = 1e12
+
+DESIGN_COLUMNS = ["Intercept", "treat", "post", "did"]
+
+
+def prepare_design(df, cluster="stock_id"):
+    """
+    标准 DID 的设计矩阵、因变量与聚类编号，供多次重复共用
+    """
+    treat = df["treat"].to_numpy(dtype=np.float64)
+    post = df["post"].to_numpy(dtype=np.float64)
+    x = np.column_stack([np.ones(len(df)), treat, post, treat * post])
+    y = df["return"].to_numpy(dtype=np.float64)
+    clusters = pd.factorize(df[cluster])[0]
+    xtx_inv = np.linalg.inv(x.T @ x)
+    beta = xtx_inv @ (x.T @ y)
+    resid = y - x @ beta
+    n_clusters = int(clusters.max()) + 1
+    k = x.shape[1]
+    # 每个聚类的得分 X_g'ê_g、X_g'X_g 与 X_g'y_g
+    scores = np.column_stack([np.bincount(clusters, weights=x[:, j] * resid, minlength=n_clusters) for j in range(k)])
+    outer = np.einsum("ij,ik->ijk", x, x).reshape(len(y), k * k)
+    xtx_g = np.column_stack([np.bincount(clusters, weights=outer[:, j], minlength=n_clusters) for j in range(k * k)])
+    xty_g = np.column_stack([np.bincount(clusters, weights=x[:, j] * y, minlength=n_clusters) for j in range(k)])
+    return {
+        "beta": beta,
+        "xtx_inv": xtx_inv,
+        "scores": scores,
+        "xtx_g": xtx_g.reshape(n_clusters, k, k),
+        "xty_g": xty_g,
+        "n_clusters": n_clusters,
+        "coef_index": DESIGN_COLUMNS.index("did"),
+    }
+
+
+def _summarize(estimate, draws, alpha, method, reps, seed, dropped=0):
+    low, high = np.quantile(draws, [alpha / 2, 1 - alpha / 2])
+    return {
+        "method": method,
+        "coef": float(estimate),
+        "bootstrap_se": float(draws.std(ddof=1)),
+        "ci_lower": float(low),
+        "ci_upper": float(high),
+        "reps": reps,
+        "dropped": dropped,
+        "seed": seed,
+    }
+
+
+def wild_cluster_bootstrap(design, reps=9999, seed=DEFAULT_SEED, alpha=0.05, batch_size=BOOTSTRAP_BATCH):
+    """
+    野聚类自助法：按批生成 Rademacher 权重矩阵（批大小 × 聚类数），一次矩阵乘得到整批 did 系数
+    """
+    rng = np.random.default_rng(seed)
+    idx = design["coef_index"]
+    # did 系数对各聚类得分的线性组合系数：e_didᵀ (X'X)⁻¹ S_gᵀ
+    loading = design["scores"] @ design["xtx_inv"][idx]
+    draws = []
+    for start in range(0, reps, batch_size):
+        size = min(batch_size, reps - start)
+        weights = rng.choice([-1.0, 1.0], size=(size, design["n_clusters"]))
+        draws.append(design["beta"][idx] + weights @ loading)
+    return _summarize(design["beta"][idx], np.concatenate(draws), alpha, "wild cluster (Rademacher)", reps, seed)
+
+
+def _pairs_batch(xtx_g, xty_g, coef_index, size, seed_seq):
+    rng = np.random.default_rng(seed_seq)
+    n_clusters = len(xtx_g)
+    counts = rng.multinomial(n_clusters, np.full(n_clusters, 1 / n_clusters), size=size).astype(np.float64)
+    xtx = np.tensordot(counts, xtx_g, axes=(1, 0))
+    xty = counts @ xty_g
+    # 奇异的重复记为 NaN，由调用方统计并丢弃；批的长度不变，结果仍与分批方式无关
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cond = np.linalg.cond(xtx)
+    ok = np.isfinite(cond) & (cond < PAIRS_MAX_CONDITION)
+    draws = np.full(size, np.nan)
+    if ok.any():
+        draws[ok] = np.linalg.solve(xtx[ok], xty[ok][:, :, None])[:, coef_index, 0]
+    return draws
+
+
+def pairs_cluster_bootstrap(design, reps=999, seed=DEFAULT_SEED, alpha=0.05, workers=BOOTSTRAP_WORKERS,
+                            batch_size=BOOTSTRAP_BATCH, progress=True):
+    """
+    聚类配对自助法：按批抽取聚类的多项式计数，用预先算好的聚类矩阵加权求和后解方程；批在进程池中并行
+    X'X 奇异的重复被丢弃，置信区间按其余重复计算，丢弃数记在结果的 dropped 中
+    """
+    batches = [min(batch_size, reps - start) for start in range(0, reps, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    args = (design["xtx_g"], design["xty_g"], design["coef_index"])
+    draws = [None] * len(batches)
+    # 进程池使用 fork 启动，子进程直接继承已准备好的数据；不支持 fork 的平台（Windows）用 spawn 会重新执行调用脚本，改为串行
+    if workers <= 1 or len(batches) == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        for i, (size, seed_seq) in enumerate(zip(batches, seeds)):
+            draws[i] = _pairs_batch(*args, size, seed_seq)
+            if progress:
+                print(f"   配对自助法进度: {sum(batches[:i + 1])}/{reps}")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            futures = {pool.submit(_pairs_batch, *args, size, seed_seq): i
+                       for i, (size, seed_seq) in enumerate(zip(batches, seeds))}
+            done = 0
+            for future in as_completed(futures):
+                i = futures[future]
+                draws[i] = future.result()
+                done += batches[i]
+                if progress:
+                    print(f"   配对自助法进度: {done}/{reps}")
+    estimate = design["beta"][design["coef_index"]]
+    draws = np.concatenate(draws)
+    valid = draws[np.isfinite(draws)]
+    dropped = len(draws) - len(valid)
+    if len(valid) < 2:
+        raise ValueError(f"配对自助法的 {reps} 次重复中 {dropped} 次 X'X 奇异，无法估计置信区间")
+    if dropped:
+        print(f"   ⚠️ 配对自助法：{dropped}/{reps} 次重复抽中的聚类使 X'X 奇异，已丢弃")
+    return _summarize(estimate, valid, alpha, "pairs cluster", reps, seed, dropped)
+
+
+def _cell_moments(df):
+    """
+    按 (date, treat) 汇总计数、和与平方和，按日期排序
+    """
+    y = df["return"].astype(np.float64)
+    frame = pd.DataFrame({"date": df["date"], "treat": df["treat"], "n": 1.0, "s": y, "q": y * y})
+    cells = frame.groupby(["date", "treat"])[["n", "s", "q"]].sum().unstack("treat", fill_value=0.0)
+    return cells.sort_index()
+
+
+def placebo_grid(df, policy_date=POLICY_DATE, dates=None, trim=0.1, pre_period_only=True):
+    """
+    安慰剂检验：把候选日期当作政策拐点估计标准 DID 的 did 系数与标准误
+
+    dates 未给出时，取（政策日前）样本中位于 trim ~ 1-trim 分位之间的全部交易日；
+    返回 (每个候选日期的结果表, 汇总)，汇总中的 placebo_p 为安慰剂系数绝对值不小于真实系数的比例
+    """
+    policy = pd.to_datetime(policy_date)
+    true_cells = _cell_moments(df)
+    true_est = _did_from_cells(true_cells, np.array([true_cells.index.searchsorted(policy)]))
+    sample = df[df["date"] < policy] if pre_period_only else df
+    cells = _cell_moments(sample)
+
+    if dates is None:
+        low, high = cells.index[int(len(cells) * trim)], cells.index[int(len(cells) * (1 - trim)) - 1]
+        dates = cells.index[(cells.index >= low) & (cells.index <= high)]
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    if not pre_period_only:
+        dates = dates[dates != policy]
+    results = _did_from_cells(cells, cells.index.searchsorted(dates))
+    results.insert(0, "placebo_date", dates)
+
+    valid = results["coef"].notna()
+    summary = {
+        "true_coef": float(true_est["coef"].iloc[0]),
+        "true_se": float(true_est["std err"].iloc[0]),
+        "placebo_count": int(valid.sum()),
+        "placebo_p": float((results.loc[valid, "coef"].abs() >= abs(true_est["coef"].iloc[0])).mean()),
+        "share_significant_5pct": float((results.loc[valid, "P>|t|"] < 0.05).mean()),
+    }
+    return results, summary
+
+
+def _did_from_cells(cells, cut_positions):
+    """
+    由按日期累计的单元矩，计算每个切分点（cut_positions 之后为 post）的 DID 系数与普通标准误
+    """
+    cum = cells.cumsum().to_numpy()
+    total = cum[-1]
+    columns = list(cells.columns)
+
+    def pick(moment, treat, values):
+        return values[:, columns.index((moment, treat))] if (moment, treat) in columns else np.zeros(len(values))
+
+    before = np.vstack([np.zeros_like(total), cum])[cut_positions]
+    after = total - before
+    n = {(t, p): pick("n", t, arr) for t in (0, 1) for p, arr in ((0, before), (1, after))}
+    s = {(t, p): pick("s", t, arr) for t in (0, 1) for p, arr in ((0, before), (1, after))}
+    q = {(t, p): pick("q", t, arr) for t in (0, 1) for p, arr in ((0, before), (1, after))}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = {key: s[key] / n[key] for key in n}
+        coef = mean[(1, 1)] - mean[(1, 0)] - mean[(0, 1)] + mean[(0, 0)]
+        rss = sum(q[key] - s[key] ** 2 / n[key] for key in n)
+        nobs = sum(n.values())
+        df_resid = nobs - 4
+        se = np.sqrt(rss / df_resid * sum(1 / n[key] for key in n))
+        t = coef / se
+    valid = np.all([n[key] > 0 for key in n], axis=0)
+    coef, se, t = np.where(valid, coef, np.nan), np.where(valid, se, np.nan), np.where(valid, t, np.nan)
+    p = 2 * stats.t.sf(np.abs(t), np.maximum(df_resid, 1))
+    return pd.DataFrame({"coef": coef, "std err": se, "t": t, "P>|t|": p})
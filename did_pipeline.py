@@ -0,0 +1,225 @@
+# did_pipeline.py
+"""
+带磁盘缓存的阶段流水线：每个阶段的输出按“阶段代码 + 参数 + 上游阶段的键 + 运行环境”做哈希，
+键不变就直接读缓存，只重跑真正受影响的阶段
+
+- 阶段代码取阶段函数所在模块的整份源码：阶段函数会用到同模块的辅助函数和常量（如 code0409 的 summarize_model、MODELS），
+  只看函数自身的源码会漏掉这些改动
+- 运行环境包括 PIPELINE_VERSION、全部 did_*.py 模块的源码以及数值库版本：阶段函数只是对这些模块的薄封装，
+  只看阶段函数自身的源码会漏掉 did_fe / did_inference 中的改动，升级 numpy / pandas 也可能改变结果
+
+- 先从目标阶段往上游推导：命中缓存的阶段不再需要它的上游，只有未命中的阶段才会执行
+- 可执行的阶段（上游都已就绪）提交到线程池并行；回归和作图主要耗时在 numpy / BLAS 与 Agg 渲染，
+  线程之间不互相阻塞，且各阶段只通过返回值传递数据，不共享可变状态
+- persist=False 的阶段（如读取已缓存的 Parquet）每次重新计算，但仍参与键的推导；
+  artifact=True 的阶段返回输出文件路径，文件被删除时视为未命中
+- main_thread=True 的阶段（如内部 fork 进程池的自助法）不进线程池：等线程池中的阶段全部结束、线程池关闭后，
+  在调用 run 的线程中串行执行，避免在多线程进程里 fork
+- options 是只影响执行方式、不影响输出的参数（如进程数），传给阶段函数但不计入缓存键
+"""
+import functools
+import glob
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import pickle
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from did_data import CACHE_DIR
+
+STAGE_CACHE_DIR = os.path.join(CACHE_DIR, "stages")
+# 缓存格式或估计方法有不体现在源码中的变化时递增，使全部阶段缓存失效
+PIPELINE_VERSION = 1
+# 版本纳入缓存键的第三方库
+_VERSIONED_PACKAGES = ("numpy", "pandas", "scipy", "statsmodels", "pyarrow", "matplotlib", "seaborn")
+
+
+class Stage:
+    """
+    一个流水线阶段：func(*上游输出, **params) 的返回值即阶段输出
+    """
+
+    def __init__(self, name, func, deps=(), params=None, persist=True, artifact=False, main_thread=False,
+                 options=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.persist = persist
+        self.artifact = artifact
+        self.main_thread = main_thread
+        self.options = options or {}
+
+
+def _code_fingerprint(func):
+    """
+    阶段函数的限定名 + 所在模块的整份源码（取不到模块源码时退回函数自身的源码）
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    for source_of in (sys.modules.get(func.__module__), func):
+        try:
+            return name + "\n" + inspect.getsource(source_of)
+        except (OSError, TypeError):
+            continue
+    return name
+
+
+@functools.lru_cache(maxsize=1)
+def _environment_fingerprint():
+    """
+    PIPELINE_VERSION、did_*.py 源码与第三方库版本的 SHA-256（进程内只计算一次）
+    """
+    digest = hashlib.sha256(f"pipeline={PIPELINE_VERSION}".encode("utf-8"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(here, "did_*.py"))):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode("utf-8") + b"\0" + f.read())
+    for package in _VERSIONED_PACKAGES:
+        try:
+            version = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            version = "-"
+        digest.update(f"{package}={version}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, cache_dir=STAGE_CACHE_DIR, jobs=os.cpu_count() or 1):
+        self.cache_dir = cache_dir
+        self.jobs = max(1, jobs)
+        self.stages = {}
+        self._keys = {}
+
+    def add(self, name, func, deps=(), params=None, persist=True, artifact=False, main_thread=False, options=None):
+        self.stages[name] = Stage(name, func, deps, params, persist, artifact, main_thread, options)
+        self._keys.clear()
+        return name
+
+    def key(self, name):
+        """
+        阶段的缓存键：代码、参数、运行环境与全部上游键的 SHA-256
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            payload = json.dumps({
+                "name": name,
+                "code": _code_fingerprint(stage.func),
+                "env": _environment_fingerprint(),
+                "params": stage.params,
+                "deps": [self.key(dep) for dep in stage.deps],
+            }, sort_keys=True, default=str)
+            self._keys[name] = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return self._keys[name]
+
+    def _cache_file(self, name):
+        slug = re.sub(r"[^0-9A-Za-z_-]+", "_", name)
+        return os.path.join(self.cache_dir, f"{slug}-{self.key(name)[:16]}.pkl")
+
+    def is_cached(self, name):
+        stage = self.stages[name]
+        path = self._cache_file(name)
+        if not stage.persist or not os.path.exists(path):
+            return False
+        if stage.artifact:
+            with open(path, "rb") as f:
+                return os.path.exists(pickle.load(f))
+        return True
+
+    def _store(self, name, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_file(name)
+        slug = os.path.basename(path).rsplit("-", 1)[0]
+        for old in glob.glob(os.path.join(self.cache_dir, f"{slug}-*.pkl")):
+            if old != path:
+                os.remove(old)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _load(self, name):
+        with open(self._cache_file(name), "rb") as f:
+            return pickle.load(f)
+
+    def plan(self, targets, force=()):
+        """
+        返回 (需要执行的阶段, 直接读缓存的阶段)
+        """
+        to_run, to_load = set(), set()
+
+        def visit(name):
+            if name in to_run or name in to_load:
+                return
+            if name not in force and self.is_cached(name):
+                to_load.add(name)
+                return
+            to_run.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+
+        for target in targets:
+            visit(target)
+        return to_run, to_load
+
+    def run(self, targets=None, force=()):
+        """
+        计算 targets（默认全部阶段），返回 {阶段名: 输出}
+        """
+        targets = list(targets or self.stages)
+        unknown = [name for name in list(targets) + list(force) if name not in self.stages]
+        if unknown:
+            raise KeyError(f"未知阶段: {', '.join(unknown)}")
+        # 强制重算的阶段即使下游命中缓存也要执行
+        targets += [name for name in force if name not in targets]
+        to_run, to_load = self.plan(targets, set(force))
+        results = {name: self._load(name) for name in to_load}
+        for name in sorted(to_load):
+            print(f"   ♻️ {name}: 使用缓存")
+
+        pending = set(to_run)
+        while pending:
+            self._run_threaded(pending, results)
+            if not pending:
+                break
+            # 线程池已关闭，此时串行执行上游已就绪的 main_thread 阶段
+            ready = [name for name in sorted(pending)
+                     if all(dep in results for dep in self.stages[name].deps)]
+            if not ready:
+                raise RuntimeError(f"阶段依赖无法满足: {', '.join(sorted(pending))}")
+            for name in ready:
+                stage = self.stages[name]
+                pending.discard(name)
+                results[name] = self._execute(stage, [results[dep] for dep in stage.deps])
+        return results
+
+    def _run_threaded(self, pending, results):
+        """
+        在线程池中执行 pending 里可执行的非 main_thread 阶段，直到没有可提交的阶段为止
+        """
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while True:
+                for name in sorted(pending):
+                    stage = self.stages[name]
+                    if not stage.main_thread and all(dep in results for dep in stage.deps):
+                        pending.discard(name)
+                        running[pool.submit(self._execute, stage, [results[dep] for dep in stage.deps])] = name
+                if not running:
+                    return
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+
+    def _execute(self, stage, inputs):
+        start = time.perf_counter()
+        value = stage.func(*inputs, **stage.params, **stage.options)
+        if stage.persist:
+            self._store(stage.name, value)
+        print(f"   ✅ {stage.name}: {time.perf_counter() - start:.2f} 秒")
+        return value
@@ -0,0 +1,177 @@
+# did_stream.py
+"""
+分块流式估计 DID：逐块累加 X'X、X'y、y'y 等充分统计量，一次遍历同时得到标准 / 趋势 / 稳健 / 固定效应模型
+
+- 所有模型的设计矩阵都是同一组列（Intercept, treat, post, did, time_index, treat:time_index）的子集，
+  X'X 只需对完整设计累加一次，各模型取对应的子矩阵
+- 固定效应（一组，如 stock_id）通过按组累加的计数与列和做组内变换：X̃'X̃ = X'X - Σ_g s_g s_gᵀ / n_g
+- HC3 稳健标准误和聚类标准误需要残差，在得到系数后再遍历一次数据累加
+
+结果对象与 did_fe.AbsorbedOLSResult 相同，可直接传给 summary_to_df；内存只与块大小和组数有关
+"""
+import numpy as np
+import pandas as pd
+
+from did_data import DATA_PATH, PANEL_COLUMNS, iter_panel_chunks
+from did_fe import AbsorbedOLSResult
+
+CHUNK_ROWS = 500_000
+
+DESIGN_COLUMNS = ["Intercept", "treat", "post", "did", "time_index", "treat:time_index"]
+
+# 与 code0409.py 中各回归一一对应
+SPECS = {
+    "Standard DID": {"columns": ["Intercept", "treat", "post", "did"], "cov": "nonrobust"},
+    "Trend": {"columns": DESIGN_COLUMNS, "cov": "nonrobust"},
+    "Robust": {"columns": ["Intercept", "treat", "post", "did"], "cov": "HC3"},
+    "Fixed Effects": {"columns": ["treat", "post", "did"], "cov": "nonrobust", "absorb": "stock_id"},
+    "FE Clustered": {"columns": ["treat", "post", "did"], "cov": "cluster", "absorb": "stock_id",
+                     "cluster": "stock_id"},
+}
+
+
+def design_chunk(chunk, date_min):
+    """
+    由一块原始数据构造完整设计矩阵（列顺序同 DESIGN_COLUMNS）与因变量
+    """
+    treat = chunk["treat"].to_numpy(dtype=np.float64)
+    post = chunk["post"].to_numpy(dtype=np.float64)
+    time_index = (pd.to_datetime(chunk["date"]) - date_min).dt.days.to_numpy(dtype=np.float64)
+    x = np.column_stack([np.ones(len(chunk)), treat, post, treat * post, time_index, treat * time_index])
+    return x, chunk["return"].to_numpy(dtype=np.float64)
+
+
+def _group_sums(chunk, x, y, column):
+    frame = pd.DataFrame(np.column_stack([np.ones(len(y)), y, x]), columns=["n", "y"] + DESIGN_COLUMNS)
+    frame[column] = chunk[column].to_numpy()
+    return frame.groupby(column).sum()
+
+
+def _add(total, part):
+    return part if total is None else total.add(part, fill_value=0)
+
+
+def fit_streamed(source=DATA_PATH, specs=SPECS, chunk_rows=CHUNK_ROWS):
+    """
+    分块估计 specs 中的全部模型，返回 {模型名: 结果对象}
+    """
+    # 第 0 遍：只读 date 列，得到 time_index 的起点
+    date_min = min(pd.to_datetime(chunk["date"]).min()
+                   for chunk in iter_panel_chunks(source, ["date"], chunk_rows))
+
+    # 第 1 遍：充分统计量与各固定效应组的列和
+    absorb_columns = {spec["absorb"] for spec in specs.values() if spec.get("absorb")}
+    k = len(DESIGN_COLUMNS)
+    n, xtx, xty, yty = 0, np.zeros((k, k)), np.zeros(k), 0.0
+    group_sums = {column: None for column in absorb_columns}
+    for chunk in iter_panel_chunks(source, PANEL_COLUMNS, chunk_rows):
+        x, y = design_chunk(chunk, date_min)
+        n += len(y)
+        xtx += x.T @ x
+        xty += x.T @ y
+        yty += float(y @ y)
+        for column in absorb_columns:
+            group_sums[column] = _add(group_sums[column], _group_sums(chunk, x, y, column))
+
+    fits = {name: _solve(spec, n, xtx, xty, yty, group_sums) for name, spec in specs.items()}
+
+    # 第 2 遍：需要残差的协方差（HC3、聚类）
+    needs_residuals = [name for name, spec in specs.items() if spec["cov"] != "nonrobust"]
+    if needs_residuals:
+        meats = {name: None for name in needs_residuals}
+        for chunk in iter_panel_chunks(source, PANEL_COLUMNS, chunk_rows):
+            x, y = design_chunk(chunk, date_min)
+            for name in needs_residuals:
+                meats[name] = _accumulate_meat(specs[name], fits[name], chunk, x, y, group_sums, meats[name])
+        for name in needs_residuals:
+            _apply_meat(specs[name], fits[name], meats[name], n)
+
+    return {name: _to_result(spec, fits[name], n) for name, spec in specs.items()}
+
+
+def _solve(spec, n, xtx, xty, yty, group_sums):
+    idx = [DESIGN_COLUMNS.index(c) for c in spec["columns"]]
+    a, b, c = xtx[np.ix_(idx, idx)], xty[idx], yty
+    absorbed = 0
+    means = None
+    if spec.get("absorb"):
+        sums = group_sums[spec["absorb"]]
+        counts = sums["n"].to_numpy()
+        sx = sums[spec["columns"]].to_numpy()
+        sy = sums["y"].to_numpy()
+        a = a - sx.T @ (sx / counts[:, None])
+        b = b - sx.T @ (sy / counts)
+        c = c - float(sy @ (sy / counts))
+        absorbed = len(counts)
+        means = pd.DataFrame(np.column_stack([sy, sx]) / counts[:, None], index=sums.index,
+                             columns=["y"] + spec["columns"])
+
+    # 组内变换后方差为零的列与固定效应共线，剔除
+    kept = np.diag(a) > 1e-8 * np.maximum(np.diag(xtx[np.ix_(idx, idx)]), 1.0)
+    a, b = a[np.ix_(kept, kept)], b[kept]
+    xtx_inv = np.linalg.inv(a)
+    beta = xtx_inv @ b
+    df_resid = n - int(kept.sum()) - absorbed
+    rss = c - float(beta @ b)
+    return {"idx": np.array(idx)[kept], "kept": kept, "beta": beta, "xtx_inv": xtx_inv,
+            "df_resid": df_resid, "cov": xtx_inv * (rss / df_resid), "means": means}
+
+
+def _within(spec, fit, chunk, x, y):
+    """
+    当前块的（组内变换后的）设计矩阵与残差
+    """
+    xs = x[:, fit["idx"]]
+    ys = y
+    if fit["means"] is not None:
+        group_means = fit["means"].reindex(chunk[spec["absorb"]].to_numpy())
+        kept_columns = [c for c, keep in zip(spec["columns"], fit["kept"]) if keep]
+        xs = xs - group_means[kept_columns].to_numpy()
+        ys = y - group_means["y"].to_numpy()
+    return xs, ys - xs @ fit["beta"]
+
+
+def _accumulate_meat(spec, fit, chunk, x, y, group_sums, meat):
+    xs, resid = _within(spec, fit, chunk, x, y)
+    if spec["cov"] == "HC3":
+        leverage = np.einsum("ij,jk,ik->i", xs, fit["xtx_inv"], xs)
+        weights = (resid / (1 - leverage)) ** 2
+        part = (xs * weights[:, None]).T @ xs
+        return part if meat is None else meat + part
+    # 聚类：按聚类变量累加得分 x̃ᵢ·ẽᵢ，最后再做外积
+    scores = pd.DataFrame(xs * resid[:, None])
+    scores["cluster"] = chunk[spec["cluster"]].to_numpy()
+    return _add(meat, scores.groupby("cluster").sum())
+
+
+def _apply_meat(spec, fit, meat, n):
+    xtx_inv = fit["xtx_inv"]
+    if spec["cov"] == "HC3":
+        fit["cov"] = xtx_inv @ meat @ xtx_inv
+        return
+    scores = meat.to_numpy()
+    n_clusters = len(scores)
+    correction = n_clusters / (n_clusters - 1) * (n - 1) / fit["df_resid"]
+    fit["cov"] = correction * xtx_inv @ (scores.T @ scores) @ xtx_inv
+
+
+def _to_result(spec, fit, n):
+    params = pd.Series(np.nan, index=spec["columns"])
+    bse = pd.Series(np.nan, index=spec["columns"])
+    params[fit["kept"]] = fit["beta"]
+    bse[fit["kept"]] = np.sqrt(np.diag(fit["cov"]))
+    cov_type = f"cluster({spec['cluster']})" if spec["cov"] == "cluster" else spec["cov"]
+    absorb = [spec["absorb"]] if spec.get("absorb") else []
+    # 与 statsmodels 一致：普通标准误用 t 分布，稳健 / 聚类标准误用正态分布
+    return AbsorbedOLSResult(params, bse, fit["df_resid"], n, cov_type, absorb, use_t=spec["cov"] == "nonrobust")
+
+
+def stream_group_means(source=DATA_PATH, by=("date", "treat"), value="return", chunk_rows=CHUNK_ROWS):
+    """
+    分块计算分组均值（平行趋势图用），返回与 df.groupby(by)[value].mean().reset_index() 相同的表
+    """
+    total = None
+    for chunk in iter_panel_chunks(source, list(by) + [value], chunk_rows):
+        part = chunk.groupby(list(by))[value].agg(["sum", "count"])
+        total = _add(total, part)
+    return (total["sum"] / total["count"]).rename(value).reset_index()
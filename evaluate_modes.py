@@ -0,0 +1,159 @@
+# evaluate_modes.py
+"""
+推理模式一致性门禁：在带标注的问题集上运行所有可用推理模式，与 fp32 参考集成对比
+
+用法:
+    python evaluate_modes.py labeled.jsonl --min-agreement 0.99 --report parity.json
+labeled.jsonl 每行 {"text": "...", "labels": ["建议类", "解决类"]}
+
+对每个模式输出：各标签 precision / recall / F1、与 fp32 的判定一致率、证据与不确定度漂移、单条延迟；
+任一模式与 fp32 的一致率低于 --min-agreement 时以退出码 1 结束
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+import inference
+from inference import EARLY_EXIT_HEADS_PATH, ID2LABEL, combine_window_evidence, encode_windows
+
+
+def load_labeled(path):
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item["text"], set(item.get("labels", []))))
+    return samples
+
+
+def run_mode(models, texts, pad_to_bucket=False):
+    """
+    逐条（batch=1，与线上 predict 一致）运行，返回每条的证据 [标签数, 2] 与耗时（毫秒）
+    与 predict 一样经 encode_windows 编码：开启长文本模式时超长问题按窗口计算后合并证据
+    """
+    evidences, latencies = [], []
+    with torch.no_grad():
+        for text in texts:
+            start = time.perf_counter()
+            encoding, owners = encode_windows(text, pad_to_bucket=pad_to_bucket)
+            evidence = torch.stack([
+                combine_window_evidence(model(encoding["input_ids"], encoding["attention_mask"]), owners, 1)[0].float()
+                for model in models
+            ])
+            latencies.append((time.perf_counter() - start) * 1000)
+            evidences.append(evidence)
+    return evidences, latencies
+
+
+def decisions_of(evidences):
+    return [{ID2LABEL[i] for i in range(len(e)) if e[i, 1] > e[i, 0]} for e in evidences]
+
+
+def score(name, evidences, latencies, gold, reference):
+    predicted = decisions_of(evidences)
+    ref_predicted = decisions_of(reference)
+    per_label = {}
+    for label in ID2LABEL.values():
+        tp = sum(label in p and label in g for p, g in zip(predicted, gold))
+        fp = sum(label in p and label not in g for p, g in zip(predicted, gold))
+        fn = sum(label not in p and label in g for p, g in zip(predicted, gold))
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        agreement = sum((label in p) == (label in r) for p, r in zip(predicted, ref_predicted)) / len(predicted)
+        per_label[label] = {"precision": precision, "recall": recall, "f1": f1, "agreement": agreement}
+
+    evidence_drift = statistics.mean(float((e - r).abs().mean()) for e, r in zip(evidences, reference))
+    uncertainty_drift = statistics.mean(
+        float((inference.dirichlet_uncertainty(e) - inference.dirichlet_uncertainty(r)).abs().mean())
+        for e, r in zip(evidences, reference)
+    )
+    ordered = sorted(latencies)
+    return {
+        "mode": name,
+        "agreement": sum(p == r for p, r in zip(predicted, ref_predicted)) / len(predicted),
+        "macro_f1": statistics.mean(v["f1"] for v in per_label.values()),
+        "evidence_drift": evidence_drift,
+        "uncertainty_drift": uncertainty_drift,
+        "latency_ms_mean": statistics.mean(latencies),
+        "latency_ms_p50": ordered[len(ordered) // 2],
+        "latency_ms_p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "per_label": per_label,
+    }
+
+
+def print_report(results):
+    print(f"\n{'模式':<18}{'一致率':>8}{'宏F1':>8}{'证据漂移':>10}{'不确定度漂移':>12}{'均值ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(f"{r['mode']:<20}{r['agreement']:>8.2%}{r['macro_f1']:>8.3f}{r['evidence_drift']:>12.4f}"
+              f"{r['uncertainty_drift']:>14.4f}{r['latency_ms_mean']:>9.1f}{r['latency_ms_p95']:>9.1f}")
+        print("    " + "  ".join(
+            f"{label}: P={v['precision']:.2f} R={v['recall']:.2f} F1={v['f1']:.2f} 一致={v['agreement']:.0%}"
+            for label, v in r["per_label"].items()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理模式精度 / 速度一致性门禁")
+    parser.add_argument("labeled", help="带标注的问题集（JSONL：text, labels）")
+    parser.add_argument("--modes", help="要评估的模式，逗号分隔，默认全部可用模式")
+    parser.add_argument("--early-exit-thresholds", default="",
+                        help="额外评估的早退不确定度阈值，逗号分隔（需已生成早退证据头）")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="与 fp32 的最低判定一致率")
+    parser.add_argument("--report", help="把完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    samples = load_labeled(args.labeled)
+    texts = [text for text, _ in samples]
+    gold = [labels for _, labels in samples]
+    modes = args.modes.split(",") if args.modes else inference.available_modes()
+    print(f"📚 样本数: {len(samples)}，评估模式: {modes}")
+
+    reference_models = (inference.LOADED_MODELS if inference.INFERENCE_MODE == "fp32"
+                        else inference.load_ensemble("fp32"))
+    for model in reference_models:
+        model.exit_threshold = 0.0  # 参考结果始终跑满全部编码层
+    reference, ref_latencies = run_mode(reference_models, texts)
+    results = [score("fp32", reference, ref_latencies, gold, reference)]
+
+    for mode in modes:
+        if mode == "fp32":
+            continue
+        models = inference.load_ensemble(mode)
+        evidences, latencies = run_mode(models, texts, pad_to_bucket=mode == "compiled")
+        results.append(score(mode, evidences, latencies, gold, reference))
+        del models
+
+    thresholds = [float(t) for t in args.early_exit_thresholds.split(",") if t]
+    if thresholds:
+        inference._attach_early_exit(reference_models, EARLY_EXIT_HEADS_PATH, 0.0)
+        if reference_models[0].exit_heads is not None:
+            for threshold in thresholds:
+                for model in reference_models:
+                    model.exit_threshold = threshold
+                evidences, latencies = run_mode(reference_models, texts)
+                results.append(score(f"early_exit@{threshold}", evidences, latencies, gold, reference))
+            for model in reference_models:
+                model.exit_threshold = 0.0
+
+    print_report(results)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 结果已写入 {os.path.abspath(args.report)}")
+
+    failed = [r["mode"] for r in results if r["agreement"] < args.min_agreement]
+    if failed:
+        print(f"\n❌ 以下模式与 fp32 的一致率低于 {args.min_agreement:.2%}: {failed}")
+        sys.exit(1)
+    print(f"\n✅ 所有模式与 fp32 的一致率均不低于 {args.min_agreement:.2%}")
+
+
+if __name__ == "__main__":
+    main()
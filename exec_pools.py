@@ -0,0 +1,111 @@
+# exec_pools.py
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# 本地分类（CPU 密集）：少量线程，避免与 torch 自身的算子并行线程争抢 CPU
+CLASSIFIER_POOL_WORKERS = int(os.getenv("CLASSIFIER_POOL_WORKERS", "2"))
+CLASSIFIER_POOL_QUEUE = int(os.getenv("CLASSIFIER_POOL_QUEUE", "32"))
+# 大模型调用（网络 I/O）：线程多，大部分时间在等待远端响应
+PROVIDER_POOL_WORKERS = int(os.getenv("PROVIDER_POOL_WORKERS", "16"))
+PROVIDER_POOL_QUEUE = int(os.getenv("PROVIDER_POOL_QUEUE", "256"))
+# 池满时提交方最多等待的秒数，超时即拒绝
+POOL_SUBMIT_TIMEOUT = float(os.getenv("POOL_SUBMIT_TIMEOUT", "30"))
+
+
+class PoolSaturated(RuntimeError):
+    """
+    线程池的执行中 + 排队任务数已达上限
+    """
+
+
+class BoundedPool:
+    """
+    限制并发数与排队长度的线程池：最多 max_workers 个任务同时执行，另有 max_queue 个排队，
+    超出时提交方等待至多 timeout 秒后抛出 PoolSaturated；任务在提交方的 contextvars 上下文中执行
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, submit_timeout: float = POOL_SUBMIT_TIMEOUT):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, fn: Callable, *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Future:
+        """
+        提交任务；timeout 为池满时的最长等待秒数（默认 submit_timeout，0 表示不等待）
+        """
+        timeout = self.submit_timeout if timeout is None else timeout
+        acquired = self._slots.acquire(blocking=False) if timeout == 0 else self._slots.acquire(timeout=timeout)
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturated(f"{self.name} 线程池已满（执行中 {self.max_workers} + 排队 {self.max_queue}）")
+
+        enqueued = time.perf_counter()
+        ctx = contextvars.copy_context()
+        with self._lock:
+            self._queued += 1
+
+        def run():
+            waited = time.perf_counter() - enqueued
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            try:
+                return ctx.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                self._slots.release()
+
+        future = self._executor.submit(run)
+        future.add_done_callback(self._on_cancelled)
+        return future
+
+    def _on_cancelled(self, future: Future) -> None:
+        # 排队中被取消的任务不会执行 run，在这里归还名额
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+
+    def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        在池中执行并等待结果
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "wait_mean": self._wait_total / started if started else 0.0,
+                "wait_max": self._wait_max,
+            }
+
+
+CLASSIFIER_POOL = BoundedPool("classifier", CLASSIFIER_POOL_WORKERS, CLASSIFIER_POOL_QUEUE)
+PROVIDER_POOL = BoundedPool("provider-io", PROVIDER_POOL_WORKERS, PROVIDER_POOL_QUEUE)
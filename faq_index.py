@@ -0,0 +1,230 @@
+# faq_index.py
+"""
+语义问答库：保存已回答问题的句向量（本地分类模型的 pooler 输出）和整合报告，
+新问题与库中最相似问题的余弦相似度不低于阈值时直接复用已有报告，不再分发给各个大模型
+
+- 精确检索：全部向量放在一个 numpy 矩阵中，一次矩阵乘法求出与所有问题的相似度（向量已 L2 归一化，内积即余弦相似度）
+- 近似检索（FAQ_INDEX_KIND=hnsw，需要安装 hnswlib）：先从 HNSW 图中取候选，再按精确相似度复核；
+  未安装 hnswlib 时退回精确检索
+- 问答库以 JSONL 追加写入（每行一个问题，句向量为 float32 的 base64），启动时读回并重建索引
+- 每个条目记录算出句向量的模型指纹（inference.model_fingerprint）；不同模型的句向量不在同一个空间，
+  查询或写入时指纹与问答库不一致（模型已热替换、问答库尚未重建）则跳过，查询按未命中处理
+"""
+import base64
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 是否启用问答库
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "1") == "1"
+# 问答库文件；留空则只保存在内存中
+FAQ_INDEX_PATH = os.getenv("FAQ_INDEX_PATH", "faq_index.jsonl")
+# 余弦相似度不低于该值时视为同一问题
+FAQ_SIMILARITY_THRESHOLD = float(os.getenv("FAQ_SIMILARITY_THRESHOLD", "0.97"))
+# 检索方式：exact（numpy 暴力检索）或 hnsw（近似检索）
+FAQ_INDEX_KIND = os.getenv("FAQ_INDEX_KIND", "exact")
+# 近似检索取回、再做精确复核的候选数
+FAQ_ANN_CANDIDATES = int(os.getenv("FAQ_ANN_CANDIDATES", "8"))
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_vector(text: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+class _HNSWIndex:
+    """
+    hnswlib 近似检索（内积空间），容量不足时按倍数扩容
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        import hnswlib
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=capacity, ef_construction=200, M=16)
+        self.index.set_ef(64)
+        self.capacity = capacity
+        self.size = 0
+
+    def add(self, vector: np.ndarray, item_id: int) -> None:
+        if self.size == self.capacity:
+            self.capacity *= 2
+            self.index.resize_index(self.capacity)
+        self.index.add_items(vector[None, :], [item_id])
+        self.size += 1
+
+    def candidates(self, query: np.ndarray, k: int) -> np.ndarray:
+        ids, _ = self.index.knn_query(query[None, :], k=min(k, self.size))
+        return ids[0].astype(np.int64)
+
+
+class FAQIndex:
+    """
+    已回答问题的句向量索引：add 写入问题与报告，lookup 返回相似度达到阈值的最相似问题
+    """
+
+    def __init__(self, path: Optional[str] = FAQ_INDEX_PATH or None, threshold: float = FAQ_SIMILARITY_THRESHOLD,
+                 kind: str = FAQ_INDEX_KIND):
+        self.path = path
+        self.threshold = threshold
+        self.kind = kind
+        self.entries: List[Dict[str, Any]] = []
+        self.model: Optional[str] = None  # 库中句向量所属模型的指纹
+        self._vectors: Optional[np.ndarray] = None  # 预分配的 (容量, 维度) 矩阵，前 len(entries) 行有效
+        self._ann: Optional[_HNSWIndex] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # 因模型指纹不一致而跳过的查询数
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _make_ann(self, dim: int) -> Optional[_HNSWIndex]:
+        if self.kind != "hnsw":
+            return None
+        try:
+            return _HNSWIndex(dim)
+        except ImportError:
+            print("⚠️ 未安装 hnswlib，问答库改用精确检索")
+            self.kind = "exact"
+            return None
+
+    def _append(self, vector: np.ndarray, entry: Dict[str, Any]) -> None:
+        # 调用方已持有锁（或仍在构造中）
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        size = len(self.entries)
+        if self._vectors is None:
+            self._vectors = np.empty((64, vector.size), dtype=np.float32)
+            self._ann = self._make_ann(vector.size)
+        elif vector.size != self._vectors.shape[1]:
+            raise ValueError(f"句向量维度 {vector.size} 与问答库的 {self._vectors.shape[1]} 不一致")
+        if size == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.empty_like(self._vectors)])
+        self._vectors[size] = vector
+        if self._ann is not None:
+            self._ann.add(vector, size)
+        self.entries.append(entry)
+
+    def _load(self) -> None:
+        skipped = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    self._append(_decode_vector(item.pop("embedding")), item)
+                except (ValueError, KeyError):
+                    skipped += 1
+        if self.entries:
+            self.model = self.entries[-1].get("model")
+        note = f"，跳过 {skipped} 条无法解析的记录" if skipped else ""
+        print(f"📚 已加载问答库 {self.path}：{len(self.entries)} 条{note}")
+
+    def add(self, embedding: np.ndarray, question: str, answer: str, labels: List[str] = (),
+            model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        写入一个已回答的问题（embedding 须已 L2 归一化，model 为算出它的模型指纹），返回新条目；
+        指纹与问答库不一致时不写入，返回 None
+        """
+        with self._lock:
+            if not self.entries:
+                self.model = model
+            elif model != self.model:
+                return None
+            entry = {"id": len(self.entries), "ts": time.time(), "question": question, "answer": answer,
+                     "labels": list(labels), "model": model}
+            self._append(embedding, entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({**entry, "embedding": _encode_vector(embedding)}, ensure_ascii=False) + "\n")
+        return entry
+
+    def rebuild(self, embed_fn: Callable[[List[str]], Tuple[np.ndarray, str]], batch_size: int = 32) -> int:
+        """
+        分类模型替换后，用 embed_fn（新模型，返回 (句向量, 模型指纹)）重新计算全部问题的句向量并重写问答库文件；
+        新旧模型的句向量不在同一个空间，不重建就无法相互比较。返回重建的条数
+        重建途中模型再次替换（各批指纹不一致）时放弃本次重建，由下一次替换后的重建接手
+        """
+        with self._lock:
+            entries = list(self.entries)
+        # 大部分向量在锁外计算，只有重建期间新加入的问题在锁内补算
+        chunks = [embed_fn([e["question"] for e in entries[i:i + batch_size]])
+                  for i in range(0, len(entries), batch_size)]
+        with self._lock:
+            added = self.entries[len(entries):]
+            if added:
+                chunks.append(embed_fn([e["question"] for e in added]))
+            entries = list(self.entries)
+            if not entries:
+                return 0
+            models = {model for _, model in chunks}
+            if len(models) != 1:
+                print("⚠️ 重建问答库期间模型再次替换，放弃本次重建")
+                return 0
+            self.model = models.pop()
+            vectors = np.concatenate([chunk for chunk, _ in chunks]).astype(np.float32)
+            entries = [{**entry, "model": self.model} for entry in entries]
+            self.entries, self._vectors, self._ann = [], None, None
+            for vector, entry in zip(vectors, entries):
+                self._append(vector, entry)
+            if self.path:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for vector, entry in zip(vectors, entries):
+                        f.write(json.dumps({**entry, "embedding": _encode_vector(vector)}, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.path)
+        print(f"📚 问答库已按新模型重建句向量：{len(entries)} 条")
+        return len(entries)
+
+    def search(self, embedding: np.ndarray, k: int = 1) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        返回最相似的 k 个问题 [(余弦相似度, 条目)]，按相似度降序
+        """
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self._lock:
+            size = len(self.entries)
+            if not size:
+                return []
+            if self._ann is not None:
+                ids = self._ann.candidates(query, max(k, FAQ_ANN_CANDIDATES))
+                scores = self._vectors[ids] @ query
+            else:
+                ids = None
+                scores = self._vectors[:size] @ query
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.entries[i if ids is None else int(ids[i])]) for i in top]
+
+    def lookup(self, embedding: np.ndarray, model: Optional[str] = None) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """
+        最相似问题的相似度不低于阈值时返回 (相似度, 条目)，否则返回 None
+        model（算出 embedding 的模型指纹）与问答库不一致时不检索，直接返回 None
+        """
+        with self._lock:
+            if self.entries and model != self.model:
+                self.stale += 1
+                return None
+        best = self.search(embedding, k=1)
+        hit = best[0] if best and best[0][0] >= self.threshold else None
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return hit
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self.entries), "kind": self.kind, "threshold": self.threshold,
+                    "hits": self.hits, "misses": self.misses, "stale": self.stale, "model": self.model}
@@ -1,26 +1,101 @@
 # inference.py
+import atexit
+import contextlib
+import functools
+import gc
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import List
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from transformers import BertTokenizer, BertModel
+from torch.autograd.profiler import record_function
+from transformers import BertConfig, BertTokenizer, BertModel
 
 class BERTEDLBinaryClassifier(nn.Module):
-    def __init__(self, pretrained_model='bert-base-chinese'):
+    def __init__(self, pretrained_model='bert-base-chinese', config=None):
         super().__init__()
-        self.bert = BertModel.from_pretrained(pretrained_model)
+        # 给出 config 时只按结构建模型、不读预训练权重（权重随后由 checkpoint 整体替换）
+        self.bert = BertModel(config) if config is not None else BertModel.from_pretrained(pretrained_model)
         self.dropout = nn.Dropout(0.5)
         self.evidence_layer = nn.Linear(self.bert.config.hidden_size, 2)
 
-    def forward(self, input_ids, attention_mask):
+        # 早退：挂在中间层上的轻量证据头（{层号: Linear}），未挂载时始终跑满全部编码层
+        self.exit_heads = None
+        self.exit_threshold = 0.0
+        self.last_exit_layer = self.bert.config.num_hidden_layers
+
+    def attach_exit_heads(self, layers, threshold=0.0):
+        """
+        在指定的中间层（1 起计）挂载证据头；threshold > 0 时 forward 启用早退
+        """
+        hidden_size = self.bert.config.hidden_size
+        self.exit_heads = nn.ModuleDict({str(layer): nn.Linear(hidden_size, 2) for layer in layers})
+        self.exit_threshold = threshold
+        return self.exit_heads
+
+    def forward(self, input_ids, attention_mask, return_pooled=False):
+        """
+        返回 evidence；return_pooled 为 True 时返回 (evidence, pooler 输出)
+        """
+        # 需要句向量时不早退：不同层的 pooler 输出不在同一个空间，无法相互比较
+        if self.exit_heads is not None and self.exit_threshold > 0 and not return_pooled:
+            evidence, self.last_exit_layer = self.forward_early_exit(input_ids, attention_mask, self.exit_threshold)
+            return evidence
         outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
-        pooled = self.dropout(outputs.pooler_output)
-        evidence = F.softplus(self.evidence_layer(pooled))
+        # 编码器可能以 bf16 运行，证据层与 softplus 始终用 fp32 计算
+        pooled = outputs.pooler_output.float()
+        with _phase("softplus"):
+            evidence = F.softplus(self.evidence_layer(self.dropout(pooled)))
+        if return_pooled:
+            return evidence, pooled
         return evidence
 
+    def forward_early_exit(self, input_ids, attention_mask, threshold):
+        """
+        逐层计算编码器；每经过一个挂了证据头的中间层，就用该层的 Dirichlet 证据计算不确定度 u = K / S，
+        整批样本都低于 threshold 时直接返回该层的证据，不再计算后续层
+        返回 (evidence, 实际计算到的层号)
+        """
+        hidden = self.bert.embeddings(input_ids=input_ids)
+        extended_mask = self.bert.get_extended_attention_mask(attention_mask, input_ids.shape)
+        for layer_idx, layer in enumerate(self.bert.encoder.layer, 1):
+            outputs = layer(hidden, attention_mask=extended_mask)
+            hidden = outputs[0] if isinstance(outputs, tuple) else outputs
+            head = self.exit_heads[str(layer_idx)] if str(layer_idx) in self.exit_heads else None
+            if head is not None and layer_idx < len(self.bert.encoder.layer):
+                evidence = F.softplus(head(self.bert.pooler(hidden).float()))
+                if bool((dirichlet_uncertainty(evidence) < threshold).all()):
+                    return evidence, layer_idx
+        pooled = self.dropout(self.bert.pooler(hidden)).float()
+        with _phase("softplus"):
+            return F.softplus(self.evidence_layer(pooled)), len(self.bert.encoder.layer)
+
+def positive_belief(evidence):
+    """
+    二分类 EDL 的正类信念 b = e₊ / S（S = sum(evidence + 1)），用来按把握程度给命中的类别排序
+    """
+    return evidence[..., 1] / (evidence + 1).sum(dim=-1)
+
+def _by_belief(scored):
+    # [(信念, 类别)] → 按信念从高到低排列的类别
+    return [label for _, label in sorted(scored, key=lambda item: item[0], reverse=True)]
+
+def dirichlet_uncertainty(evidence):
+    """
+    EDL 不确定度：alpha = evidence + 1，u = K / sum(alpha)，K 为类别数
+    """
+    alpha = evidence + 1
+    return evidence.shape[-1] / alpha.sum(dim=-1)
+
 # 全局配置
 DEVICE = "cpu"
 # DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-TOKENIZER = BertTokenizer.from_pretrained("bert-base-chinese")
 ID2LABEL = {
     0: "原因类",
     1: "定义类",
@@ -30,42 +105,917 @@ ID2LABEL = {
     5: "解决类"
 }
 
+# 早退配置：证据头由 calibrate_early_exit.py 从现有 checkpoint 拟合得到
+# EARLY_EXIT_THRESHOLD 为不确定度阈值，0 表示关闭早退
+EARLY_EXIT_HEADS_PATH = os.getenv("EARLY_EXIT_HEADS_PATH", "early_exit_heads.pth")
+EARLY_EXIT_THRESHOLD = float(os.getenv("EARLY_EXIT_THRESHOLD", "0"))
+
+# 推理模式：fp32 为原始 checkpoint；bf16 为编码器权重以 bfloat16 存储和计算（证据层保持 fp32）；
+# lowrank 为共享基座 + 每个标签的低秩增量（由 compress_ensemble.py 生成）；
+# compiled 为 torch.compile 编译版，输入长度补齐到固定分桶，启动时预热全部分桶
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "fp32")
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "final_multilabel_edl.pth")
+LOWRANK_CHECKPOINT_PATH = os.getenv("LOWRANK_CHECKPOINT_PATH", "final_multilabel_edl_lowrank.pth")
+MAX_LENGTH = 128
+# 编译模式下的序列长度分桶（最后一档等于 MAX_LENGTH）
+SEQUENCE_BUCKETS = (16, 32, 64, MAX_LENGTH)
+COMPILE_BACKEND = os.getenv("COMPILE_BACKEND", "inductor")
+# 预热的 batch 大小（使用分类服务批量推理时可加上常见的批大小，如 "1,4,8,16"）
+WARMUP_BATCH_SIZES = tuple(int(x) for x in os.getenv("WARMUP_BATCH_SIZES", "1").split(","))
+# 长文本：超过 MAX_LENGTH 的问题切成有重叠的窗口，所有窗口组成一批前向，再按标签合并各窗口的 Dirichlet 证据
+# LONG_INPUT_COMBINE：off（默认）为照旧截断到 MAX_LENGTH；sum 为证据相加，certain 为取不确定度最小的窗口
+# 开启后超长问题的判定会与截断时不同，早退阈值（calibrate_early_exit.py）也是按单窗口校准的，需重新评估
+LONG_INPUT_COMBINE = os.getenv("LONG_INPUT_COMBINE", "off")
+# 相邻窗口起点相隔的 token 数（窗口正文长 MAX_LENGTH - 2，二者之差即重叠长度）
+LONG_INPUT_STRIDE = int(os.getenv("LONG_INPUT_STRIDE", "96"))
+# 单个问题最多切出的窗口数，超出时在全文范围内均匀取窗口（保留首尾）
+LONG_INPUT_MAX_WINDOWS = int(os.getenv("LONG_INPUT_MAX_WINDOWS", "8"))
+# 句向量取自哪个标签模型的 pooler 输出（语义问答库 faq_index.py 使用）
+EMBEDDING_MODEL_INDEX = int(os.getenv("EMBEDDING_MODEL_INDEX", "0"))
+
+# 热替换：CHECKPOINT_WATCH_SECONDS > 0 时后台轮询 checkpoint 文件，变化后自动重新加载
+# 新模型先在冒烟问题上测试：输出证据须为有限非负值，且与旧模型的分类一致率不低于 RELOAD_MIN_AGREEMENT
+CHECKPOINT_WATCH_SECONDS = float(os.getenv("CHECKPOINT_WATCH_SECONDS", "0"))
+RELOAD_MIN_AGREEMENT = float(os.getenv("RELOAD_MIN_AGREEMENT", "0.5"))
+# 切换后等待仍在使用旧模型的请求结束的最长秒数
+RELOAD_DRAIN_TIMEOUT = float(os.getenv("RELOAD_DRAIN_TIMEOUT", "60"))
+# 剖析模式：按 PROFILE_SAMPLE_RATE 的比例抽取推理调用，在 torch.profiler 下运行（0 表示关闭），
+# 每次抽中的调用写一份 Chrome trace 到 PROFILE_DIR，最多保留 PROFILE_MAX_TRACES 份；汇总表跨调用累计
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "inference_profiles")
+PROFILE_MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "20"))
+# 汇总表中列出的算子数（按自身 CPU 时间排序）
+PROFILE_TOP_OPS = int(os.getenv("PROFILE_TOP_OPS", "30"))
+# 汇总表最多每隔多少秒重写一次（进程退出时再写一次最终结果）
+PROFILE_SUMMARY_SECONDS = float(os.getenv("PROFILE_SUMMARY_SECONDS", "60"))
+# 冒烟问题文件（每行一个问题），留空则使用 SMOKE_TEXTS
+RELOAD_SMOKE_PATH = os.getenv("RELOAD_SMOKE_PATH", "")
+SMOKE_TEXTS = (
+    "桃树先开花还是先长叶？",
+    "如何防治病虫害？",
+    "小麦叶片发黄是什么原因？",
+    "什么是轮作？",
+    "氮肥施用过量会有什么后果？",
+    "玉米螟用什么药效果好？",
+)
+
+def _load_checkpoint(checkpoint_path):
+    """
+    读取 checkpoint；torch 支持时以 mmap 方式映射文件，权重按需读入，热替换时不会再整份读入内存
+    只有以 assign=True 载入（_assign_state）的权重才会一直直接使用映射的文件页；
+    按 load_state_dict 默认方式复制进已有参数、或转换 dtype 后，仍会各占一份内存
+    """
+    try:
+        return torch.load(checkpoint_path, map_location=DEVICE, weights_only=False, mmap=True)
+    except (TypeError, RuntimeError):
+        # 旧版 torch 没有 mmap 参数，或文件是旧的非 zip 格式
+        return torch.load(checkpoint_path, map_location=DEVICE, weights_only=False)
+
+def _assign_state(model, state):
+    """
+    让模型参数直接使用 state 中的张量（mmap 载入时即映射的文件页），不再复制一份；旧版 torch 不支持 assign 时退回复制
+    """
+    try:
+        model.load_state_dict(state, assign=True)
+    except TypeError:
+        model.load_state_dict(state)
+
 # 加载模型（只执行一次）
-def _load_models():
+def _load_models(checkpoint_path=CHECKPOINT_PATH, dtype=torch.float32):
     print("正在加载6个二分类模型...")
-    checkpoint = torch.load("final_multilabel_edl.pth", map_location=DEVICE, weights_only=False)
+    checkpoint = _load_checkpoint(checkpoint_path)
+    # 只按结构建模型，不再为每个标签各读一遍预训练权重；随机初始化的参数在 assign 后即被释放
+    config = BertConfig.from_pretrained("bert-base-chinese")
     models = []
     for i in range(checkpoint["num_classes"]):
-        model = BERTEDLBinaryClassifier().to(DEVICE)
-        model.load_state_dict(checkpoint["model_states"][i])
+        model = BERTEDLBinaryClassifier(config=config)
+        _assign_state(model, checkpoint["model_states"][i])
+        model.to(DEVICE)
+        # bf16 转换会生成新的张量，这一部分不再由映射的文件提供
+        if dtype != torch.float32:
+            model.bert.to(dtype)
         model.eval()
         models.append(model)
+    if EARLY_EXIT_THRESHOLD > 0:
+        _attach_early_exit(models, EARLY_EXIT_HEADS_PATH, EARLY_EXIT_THRESHOLD)
     print("✅ 模型加载成功！")
     return models
 
-LOADED_MODELS = _load_models()
+def _attach_early_exit(models, heads_path, threshold):
+    if not os.path.exists(heads_path):
+        print(f"⚠️ 未找到早退证据头 {heads_path}，早退未启用（可先运行 calibrate_early_exit.py）")
+        return
+    heads = torch.load(heads_path, map_location=DEVICE, weights_only=False)
+    for model, head_state in zip(models, heads["head_states"]):
+        model.attach_exit_heads(heads["layers"], threshold).load_state_dict(head_state)
+        model.exit_heads.to(DEVICE).eval()
+    print(f"⚡ 已启用早退：中间层 {heads['layers']}，不确定度阈值 {threshold}")
+
+class LowRankDeltaLinear(nn.Module):
+    """
+    共享基座权重的 Linear：输出 = 基座 Linear(x) + 当前标签的权重增量作用于 x
+    增量为 (U, V) 时按 (x·Vᵀ)·Uᵀ 计算，为单个张量时按稠密矩阵计算，为 None 时与基座相同
+    """
+    def __init__(self, base, deltas):
+        super().__init__()
+        self.base = base
+        self.deltas = deltas
+        self.active = 0
+
+    def forward(self, x):
+        out = self.base(x)
+        delta = self.deltas[self.active]
+        if delta is None:
+            return out
+        if isinstance(delta, tuple):
+            u, v = delta
+            return out + F.linear(F.linear(x, v), u)
+        return out + F.linear(x, delta)
+
+class LowRankDeltaEmbedding(nn.Module):
+    """
+    共享基座词表的 Embedding：查表结果叠加当前标签的低秩（或稠密）增量
+    """
+    def __init__(self, base, deltas):
+        super().__init__()
+        self.base = base
+        self.deltas = deltas
+        self.active = 0
+
+    def forward(self, input_ids):
+        out = self.base(input_ids)
+        delta = self.deltas[self.active]
+        if delta is None:
+            return out
+        if isinstance(delta, tuple):
+            u, v = delta
+            return out + F.embedding(input_ids, u) @ v
+        return out + F.embedding(input_ids, delta)
+
+def _decode_delta(entry):
+    if entry is None:
+        return None
+    if entry[0] == "lowrank":
+        return entry[1].float().to(DEVICE), entry[2].float().to(DEVICE)
+    return entry[1].float().to(DEVICE)
+
+def _dense_delta(entry):
+    delta = _decode_delta(entry)
+    return delta[0] @ delta[1] if isinstance(delta, tuple) else delta
+
+class SharedBaseEnsemble:
+    """
+    6 个标签共用一个 bert 编码器：大矩阵（各 Linear 权重、词表）按标签叠加低秩增量，
+    偏置、LayerNorm 等小参数为每个标签各存一份，切换标签时只替换张量引用
+    """
+    def __init__(self, compressed):
+        self.bert = BertModel.from_pretrained(compressed["base_model"]).to(DEVICE)
+        if compressed.get("base_state") is not None:
+            self.bert.load_state_dict(compressed["base_state"], strict=False)
+        self.bert.eval()
+        deltas = compressed["deltas"]
+        self.num_labels = compressed["num_classes"]
+
+        wrapped = {}
+        for name, module in self.bert.named_modules():
+            if isinstance(module, nn.Linear) or name == "embeddings.word_embeddings":
+                wrapped[name] = module
+
+        # 不做增量包装的小参数：每个标签各存一份（基座 + 稠密增量），切换标签时替换 .data
+        self.swaps = []
+        wrapped_weights = {f"{name}.weight" for name in wrapped}
+        with torch.no_grad():
+            for name, param in self.bert.named_parameters():
+                if name in wrapped_weights:
+                    continue
+                per_label = [param.data if d.get(name) is None else param.data + _dense_delta(d[name]) for d in deltas]
+                self.swaps.append((param, per_label))
+
+        self.delta_modules = []
+        for name, module in wrapped.items():
+            per_label = [_decode_delta(d.get(f"{name}.weight")) for d in deltas]
+            cls = LowRankDeltaEmbedding if isinstance(module, nn.Embedding) else LowRankDeltaLinear
+            wrapper = cls(module, per_label)
+            parent_name, _, attr = name.rpartition(".")
+            setattr(self.bert.get_submodule(parent_name) if parent_name else self.bert, attr, wrapper)
+            self.delta_modules.append(wrapper)
+
+        self.evidence_layers = []
+        for state in compressed["evidence_states"]:
+            layer = nn.Linear(self.bert.config.hidden_size, 2).to(DEVICE)
+            layer.load_state_dict(state)
+            self.evidence_layers.append(layer.eval())
+        self._lock = threading.Lock()
+
+    def select(self, index):
+        for module in self.delta_modules:
+            module.active = index
+        for param, per_label in self.swaps:
+            param.data = per_label[index]
+
+    def forward_label(self, index, input_ids, attention_mask, return_pooled=False):
+        with self._lock:
+            self.select(index)
+            outputs = self.bert(input_ids=input_ids, attention_mask=attention_mask)
+            with _phase("softplus"):
+                evidence = F.softplus(self.evidence_layers[index](outputs.pooler_output))
+            if return_pooled:
+                return evidence, outputs.pooler_output.float()
+            return evidence
+
+class LowRankLabelView:
+    """
+    SharedBaseEnsemble 中单个标签的视图，调用方式与 BERTEDLBinaryClassifier 相同
+    """
+    def __init__(self, ensemble, index):
+        self.ensemble = ensemble
+        self.index = index
+
+    def __call__(self, input_ids, attention_mask, return_pooled=False):
+        return self.ensemble.forward_label(self.index, input_ids, attention_mask, return_pooled)
+
+def build_lowrank_models(compressed):
+    ensemble = SharedBaseEnsemble(compressed)
+    return [LowRankLabelView(ensemble, i) for i in range(ensemble.num_labels)]
+
+def _load_lowrank_models(checkpoint_path=LOWRANK_CHECKPOINT_PATH):
+    print(f"正在加载低秩增量压缩模型 {checkpoint_path}...")
+    compressed = _load_checkpoint(checkpoint_path)
+    models = build_lowrank_models(compressed)
+    print("✅ 模型加载成功！（共享基座编码器）")
+    return models
+
+def checkpoint_for(mode=INFERENCE_MODE):
+    """
+    推理模式对应的 checkpoint 文件
+    """
+    return LOWRANK_CHECKPOINT_PATH if mode == "lowrank" else CHECKPOINT_PATH
+
+def load_ensemble(mode=INFERENCE_MODE, checkpoint_path=None):
+    """
+    按推理模式加载 6 个分类器，返回的每一项都可按 model(input_ids, attention_mask) → evidence 调用
+    checkpoint_path 为空时使用该模式的默认文件
+    """
+    checkpoint_path = checkpoint_path or checkpoint_for(mode)
+    if mode == "fp32":
+        return _load_models(checkpoint_path)
+    if mode == "bf16":
+        if not _cpu_supports_bf16():
+            print("⚠️ 当前 CPU 不支持原生 bf16 矩阵运算，bf16 模式只节省内存，计算可能变慢")
+        return _load_models(checkpoint_path, dtype=torch.bfloat16)
+    if mode == "lowrank":
+        return _load_lowrank_models(checkpoint_path)
+    if mode == "compiled":
+        return _compile_models(_load_models(checkpoint_path))
+    raise ValueError(f"未知推理模式: {mode}")
+
+def bucket_length(length):
+    """
+    不小于 length 的最小分桶长度
+    """
+    for bucket in SEQUENCE_BUCKETS:
+        if length <= bucket:
+            return bucket
+    return SEQUENCE_BUCKETS[-1]
+
+def encode(texts, pad_to_bucket=False):
+    """
+    分词并转为张量；pad_to_bucket 为 True 时把长度补齐到分桶长度，使编译后的模型只会遇到预热过的形状
+    """
+    if not pad_to_bucket:
+        return get_tokenizer()(texts, return_tensors="pt", padding=True, truncation=True,
+                               max_length=MAX_LENGTH).to(DEVICE)
+    batch = [texts] if isinstance(texts, str) else list(texts)
+    encoding = get_tokenizer()(batch, truncation=True, max_length=MAX_LENGTH)
+    longest = max(len(ids) for ids in encoding["input_ids"])
+    return get_tokenizer().pad(encoding, padding="max_length", max_length=bucket_length(longest),
+                         return_tensors="pt").to(DEVICE)
+
+def _windows(ids):
+    # 窗口正文长 MAX_LENGTH - 2（留出 [CLS] / [SEP]），最后一个窗口与文本末尾对齐
+    size = MAX_LENGTH - 2
+    if len(ids) <= size:
+        return [ids]
+    starts = list(range(0, len(ids) - size, LONG_INPUT_STRIDE)) + [len(ids) - size]
+    if len(starts) > LONG_INPUT_MAX_WINDOWS:
+        picks = torch.linspace(0, len(starts) - 1, LONG_INPUT_MAX_WINDOWS).round().long().tolist()
+        starts = [starts[i] for i in picks]
+    return [ids[start:start + size] for start in starts]
+
+def encode_windows(texts, pad_to_bucket=None):
+    """
+    批量编码；长文本模式下超长的问题切成多个有重叠的窗口（各自带 [CLS] / [SEP]），与其他问题一起组成一批
+    返回 (encoding, owners)，owners[r] 为第 r 行所属问题的下标；关闭长文本模式时与 encode 相同（照旧截断）
+    pad_to_bucket 默认取 PAD_TO_BUCKET（当前推理模式）
+    """
+    texts = [texts] if isinstance(texts, str) else list(texts)
+    pad_to_bucket = PAD_TO_BUCKET if pad_to_bucket is None else pad_to_bucket
+    with _phase("tokenizer"):
+        if LONG_INPUT_COMBINE == "off":
+            return encode(texts, pad_to_bucket=pad_to_bucket), list(range(len(texts)))
+        tokenizer = get_tokenizer()
+        rows, owners = [], []
+        for j, ids in enumerate(tokenizer(texts, add_special_tokens=False)["input_ids"]):
+            for window in _windows(ids):
+                rows.append(tokenizer.build_inputs_with_special_tokens(window))
+                owners.append(j)
+        if pad_to_bucket:
+            padding = {"padding": "max_length", "max_length": bucket_length(max(len(row) for row in rows))}
+        else:
+            padding = {"padding": True}
+        encoding = tokenizer.pad({"input_ids": rows}, return_tensors="pt", **padding).to(DEVICE)
+        return encoding, owners
+
+def combine_window_evidence(evidence, owners, count, how=LONG_INPUT_COMBINE):
+    """
+    把窗口级证据 (窗口数, 2) 合并成问题级证据 (count, 2)
+    sum：同一问题各窗口的证据相加。相邻窗口有重叠，并不是独立观测，重叠部分的证据会被重复计入，
+         合并后的证据偏大、不确定度偏小（窗口越多越明显），不确定度不宜直接与单窗口的阈值比较
+    certain：取不确定度 u = K / S 最小的那个窗口，不会放大证据，但只用到一个窗口的信息
+    """
+    if len(owners) == count:
+        return evidence
+    if how == "certain":
+        uncertainty = dirichlet_uncertainty(evidence).tolist()
+        best = {}
+        for row, owner in enumerate(owners):
+            if owner not in best or uncertainty[row] < uncertainty[best[owner]]:
+                best[owner] = row
+        return evidence[[best[j] for j in range(count)]]
+    index = torch.tensor(owners, device=evidence.device)
+    total = torch.zeros(count, evidence.shape[-1], dtype=evidence.dtype, device=evidence.device)
+    return total.index_add_(0, index, evidence)
+
+def _mean_by_owner(pooled, owners, count):
+    # 同一问题各窗口的 pooler 输出取平均
+    if len(owners) == count:
+        return pooled
+    index = torch.tensor(owners, device=pooled.device)
+    total = torch.zeros(count, pooled.shape[-1], dtype=pooled.dtype, device=pooled.device).index_add_(0, index, pooled)
+    return total / torch.bincount(index, minlength=count).unsqueeze(-1).to(pooled.dtype)
+
+def _compile_models(models):
+    if not hasattr(torch, "compile"):
+        print("⚠️ 当前 torch 版本不支持 torch.compile，compiled 模式退化为普通 fp32 推理")
+        return models
+    print(f"正在编译模型（backend={COMPILE_BACKEND}）...")
+    compiled = [torch.compile(model, backend=COMPILE_BACKEND, dynamic=False) for model in models]
+    warmup(compiled, WARMUP_BATCH_SIZES)
+    return compiled
+
+def warmup_shapes(batch_sizes=(1,)):
+    """
+    需要预热的 (batch 大小, 序列长度)：给定 batch 大小 × 全部分桶；开启长文本模式时，
+    单个长问题会切成 2..LONG_INPUT_MAX_WINDOWS 个窗口，每个窗口都补齐到 MAX_LENGTH，这些形状也一并预热
+    """
+    shapes = {(batch_size, bucket) for batch_size in batch_sizes for bucket in SEQUENCE_BUCKETS}
+    if LONG_INPUT_COMBINE != "off":
+        shapes |= {(windows, MAX_LENGTH) for windows in range(2, LONG_INPUT_MAX_WINDOWS + 1)}
+    return sorted(shapes)
+
+def warmup(models, batch_sizes=(1,)):
+    """
+    按 warmup_shapes 给出的每个输入形状各跑一次前向，提前完成编译，首个真实请求不再承担编译开销
+    取句向量的模型另外预热 return_pooled=True 的调用（编译后是另一份图）
+    """
+    start = time.perf_counter()
+    tokenizer = get_tokenizer()
+    shapes = warmup_shapes(batch_sizes)
+    with torch.no_grad():
+        for batch_size, length in shapes:
+            input_ids = torch.full((batch_size, length), tokenizer.pad_token_id, dtype=torch.long, device=DEVICE)
+            input_ids[:, 0] = tokenizer.cls_token_id
+            attention_mask = torch.ones_like(input_ids)
+            for model in models:
+                model(input_ids, attention_mask)
+            models[EMBEDDING_MODEL_INDEX](input_ids, attention_mask, return_pooled=True)
+    print(f"🔥 已预热 {len(shapes)} 个输入形状，用时 {time.perf_counter() - start:.1f} 秒")
+
+def _cpu_supports_bf16():
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def available_modes():
+    """
+    当前环境下可加载的推理模式（fp32、bf16 始终可用，其余取决于对应文件是否已生成）
+    """
+    modes = ["fp32", "bf16"]
+    if hasattr(torch, "compile"):
+        modes.append("compiled")
+    if os.path.exists(LOWRANK_CHECKPOINT_PATH):
+        modes.append("lowrank")
+    return modes
+
+class ModelGeneration:
+    """
+    一代已加载的分类器：记录正在使用它的请求数，被新的一代替换后等这些请求结束再释放
+    """
+    def __init__(self, models, version, source):
+        self.models = models
+        self.version = version
+        self.source = source
+        self.fingerprint = model_fingerprint(source)
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._cond.notify_all()
+
+    def drain(self, timeout):
+        """
+        等待使用中的请求全部结束，返回是否在 timeout 秒内排空
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.in_flight == 0, timeout)
+
+def model_fingerprint(source, mode=INFERENCE_MODE):
+    """
+    推理模式 + checkpoint 文件名、修改时间与大小：同一个文件重启后仍得到相同的值，
+    用来判断句向量是否出自同一个模型（version 是进程内的计数，重启后从 1 重新开始，不能跨进程比较）
+    """
+    try:
+        st = os.stat(source)
+        return f"{mode}:{os.path.basename(source)}:{st.st_mtime_ns}:{st.st_size}"
+    except (OSError, TypeError):
+        return f"{mode}:{source}"
+
+# 分词器和模型在第一次用到时才加载，import 本模块只定义类和函数
+_TOKENIZER = None
+_ACTIVE = None
+_LOAD_LOCK = threading.RLock()
+# 切换当前模型与请求登记使用哪一代模型互斥，保证切换后不会再有请求拿到旧模型
+_SWAP_LOCK = threading.Lock()
+PAD_TO_BUCKET = INFERENCE_MODE == "compiled"
+
+def get_tokenizer():
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        with _LOAD_LOCK:
+            if _TOKENIZER is None:
+                _TOKENIZER = BertTokenizer.from_pretrained("bert-base-chinese")
+    return _TOKENIZER
+
+def _active_generation():
+    global _ACTIVE
+    if _ACTIVE is None:
+        with _LOAD_LOCK:
+            if _ACTIVE is None:
+                _ACTIVE = ModelGeneration(_instrument_models(load_ensemble()), 1, checkpoint_for())
+    return _ACTIVE
+
+def get_models():
+    """
+    按 INFERENCE_MODE 加载的 6 个分类器（第一次调用时加载，之后复用；热替换后返回新模型）
+    """
+    return _active_generation().models
+
+@contextlib.contextmanager
+def using_generation():
+    """
+    取当前这一代模型（ModelGeneration）并登记为使用中，退出时注销；热替换会等登记在旧模型上的请求结束后再释放旧模型
+    """
+    _active_generation()
+    with _SWAP_LOCK:
+        generation = _ACTIVE
+        generation.acquire()
+    try:
+        yield generation
+    finally:
+        generation.release()
+
+@contextlib.contextmanager
+def using_models():
+    """
+    using_generation 的简写，只取这一代的分类器
+    """
+    with using_generation() as generation:
+        yield generation.models
+
+def model_status():
+    """
+    当前模型的版本号、指纹（见 model_fingerprint）、来源文件、加载时间与使用中的请求数（尚未加载时返回 None）
+    """
+    generation = _ACTIVE
+    if generation is None:
+        return None
+    return {"version": generation.version, "fingerprint": generation.fingerprint, "source": generation.source,
+            "loaded_at": generation.loaded_at, "in_flight": generation.in_flight}
+
+def smoke_texts():
+    if RELOAD_SMOKE_PATH and os.path.exists(RELOAD_SMOKE_PATH):
+        with open(RELOAD_SMOKE_PATH, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        if texts:
+            return texts
+    return list(SMOKE_TEXTS)
+
+def validate_models(models, reference=None, min_agreement=RELOAD_MIN_AGREEMENT):
+    """
+    在冒烟问题上运行一组模型：证据须为有限非负值；给出 reference（旧模型在同一批问题上的分类结果）时，
+    逐题分类结果一致的比例须不低于 min_agreement。不通过时抛出 ValueError
+    返回 (分类结果, 一致率或 None)
+    """
+    texts = smoke_texts()
+    labels = _classify_batch(models, texts, check_evidence=True)
+    if reference is None:
+        return labels, None
+    agreement = sum(set(a) == set(b) for a, b in zip(labels, reference)) / len(texts)
+    if agreement < min_agreement:
+        raise ValueError(f"新模型与当前模型在冒烟问题上的一致率 {agreement:.0%} 低于 {min_agreement:.0%}")
+    return labels, agreement
+
+def reload_models(checkpoint_path=None, min_agreement=RELOAD_MIN_AGREEMENT, drain_timeout=RELOAD_DRAIN_TIMEOUT):
+    """
+    不停服替换分类器：在调用线程中加载新 checkpoint 并做冒烟测试，通过后原子地切换给之后的请求，
+    等仍在使用旧模型的请求结束后释放旧模型；加载或测试失败时继续使用旧模型并抛出异常
+    返回 {"version", "fingerprint", "source", "load_seconds", "agreement", "drained"}
+    """
+    global _ACTIVE
+    with _LOAD_LOCK:
+        source = checkpoint_path or checkpoint_for()
+        start = time.perf_counter()
+        models = _instrument_models(load_ensemble(INFERENCE_MODE, source))
+        load_seconds = time.perf_counter() - start
+
+        old = _ACTIVE
+        reference = None
+        if old is not None:
+            with using_models() as old_models:
+                reference = _classify_batch(old_models, smoke_texts())
+        _, agreement = validate_models(models, reference, min_agreement)
+
+        generation = ModelGeneration(models, old.version + 1 if old is not None else 1, source)
+        with _SWAP_LOCK:
+            _ACTIVE = generation
+        drained = True
+        if old is not None:
+            drained = old.drain(drain_timeout)
+            # 超时未排空的请求各自持有模型的引用，结束后旧模型随之回收
+            old.models = None
+            gc.collect()
+    agreement_note = f"，冒烟一致率 {agreement:.0%}" if agreement is not None else ""
+    drain_note = "" if drained else f"（{drain_timeout:.0f} 秒内仍有请求在使用旧模型）"
+    print(f"🔄 已切换到第 {generation.version} 版模型 {source}，加载 {load_seconds:.1f} 秒{agreement_note}{drain_note}")
+    return {"version": generation.version, "fingerprint": generation.fingerprint, "source": source,
+            "load_seconds": load_seconds, "agreement": agreement, "drained": drained}
+
+def watch_checkpoint(interval=CHECKPOINT_WATCH_SECONDS, on_reload=None):
+    """
+    启动后台线程轮询当前模式的 checkpoint 文件：修改时间或大小变化、且连续两次轮询不再变化（写入完成）后热替换
+    on_reload(reload_models 的返回值) 在替换成功后调用
+    """
+    path = checkpoint_for()
+
+    def signature():
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def loop():
+        loaded = seen = signature()
+        while True:
+            time.sleep(interval)
+            current = signature()
+            if current is not None and current != loaded and current == seen:
+                loaded = current
+                try:
+                    result = reload_models(path)
+                except Exception as e:
+                    print(f"❌ 热替换失败，继续使用当前模型: {e}")
+                    continue
+                if on_reload is not None:
+                    on_reload(result)
+            seen = current
+
+    thread = threading.Thread(target=loop, name="checkpoint-watch", daemon=True)
+    thread.start()
+    print(f"👀 正在监视 {path}（每 {interval:g} 秒检查一次），文件更新后自动热替换")
+    return thread
+
+def __getattr__(name):
+    # 兼容 from inference import TOKENIZER / LOADED_MODELS 的写法：访问时才加载
+    if name == "TOKENIZER":
+        return get_tokenizer()
+    if name == "LOADED_MODELS":
+        return get_models()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 汇总表按阶段统计的 record_function 标记：分词、BERT 的嵌入 / 注意力 / 前馈 / pooler，以及证据层 + softplus
+PROFILE_PHASES = ("tokenizer", "embedding", "attention", "ffn", "pooler", "softplus")
+_PHASE_MODULE_RE = re.compile(r"^(embeddings|pooler)$|^encoder\.layer\.\d+\.(attention|intermediate|output)$")
+_PHASE_OF_MODULE = {"embeddings": "embedding", "pooler": "pooler", "attention": "attention",
+                    "intermediate": "ffn", "output": "ffn"}
+# 当前线程是否正在 PROFILER.run 中（active），以及钩子打开、尚未关闭的阶段标记（markers）
+_PROFILING = threading.local()
+
+def _profiling():
+    return getattr(_PROFILING, "active", False)
+
+def _phase(name):
+    # 当前线程正被剖析时标记一个阶段；其余调用（包括剖析模式下未被抽中的）为空操作
+    return record_function(name) if _profiling() else contextlib.nullcontext()
+
+def _enter_phase(phase, module, args):
+    if not _profiling():
+        return
+    marker = record_function(phase)
+    marker.__enter__()
+    _PROFILING.__dict__.setdefault("markers", []).append(marker)
+
+def _exit_phase(module, args, output):
+    markers = _PROFILING.__dict__.get("markers")
+    if markers:
+        markers.pop().__exit__(None, None, None)
+
+def _instrument_models(models):
+    """
+    剖析模式下在 BERT 的嵌入层、各层注意力 / 前馈和 pooler 上挂前向钩子，把它们标记为对应阶段；
+    钩子只在当前线程处于 PROFILER.run 中时打标记，未被抽中的调用只多一次线程局部变量的判断
+    编译模式不挂钩子（会触发重新编译），汇总表只有算子级统计
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or INFERENCE_MODE == "compiled":
+        return models
+    encoders = {}
+    for model in models:
+        bert = model.ensemble.bert if isinstance(model, LowRankLabelView) else model.bert
+        encoders[id(bert)] = bert
+    for bert in encoders.values():
+        for name, module in bert.named_modules():
+            match = _PHASE_MODULE_RE.match(name)
+            if match:
+                phase = _PHASE_OF_MODULE[match.group(1) or match.group(2)]
+                module.register_forward_pre_hook(functools.partial(_enter_phase, phase))
+                module.register_forward_hook(_exit_phase)
+    return models
+
+class _ProfileGate:
+    """
+    剖析期间独占推理：torch.profiler 记录整个进程的活动，被剖析的调用须等进行中的其他推理结束后才开始，
+    剖析期间新的推理调用等待，trace 与汇总里才只有这一次调用
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._exclusive)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
 
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._exclusive)
+            self._exclusive = True
+            self._cond.wait_for(lambda: self._shared == 0)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+class InferenceProfiler:
+    """
+    在 torch.profiler 下运行抽中的推理调用：每次写一份 Chrome trace（chrome://tracing 或 Perfetto 打开），
+    算子与阶段的耗时、内存按名称跨调用累计，写成 PROFILE_DIR 下的 summary.txt / summary.json
+    （最多每 summary_interval 秒重写一次，进程退出时写最终结果）
+    """
+    def __init__(self, out_dir=PROFILE_DIR, max_traces=PROFILE_MAX_TRACES, top_ops=PROFILE_TOP_OPS,
+                 summary_interval=PROFILE_SUMMARY_SECONDS):
+        self.out_dir = out_dir
+        self.max_traces = max_traces
+        self.top_ops = top_ops
+        self.summary_interval = summary_interval
+        self._summary_written = 0.0
+        self._summary_dirty = False
+        self.calls = {}
+        self.wall_us = 0.0
+        self.allocations = 0
+        self.ops = {}
+        self._traces = []
+        # _lock：同一时间只剖析一个调用，并保护累计结果；gate：剖析期间其他推理调用（profiled 装饰的函数）等待，
+        # trace 和汇总不会混入并发的推理（热替换的冒烟测试、预热不经过 gate，剖析期间发生时仍会计入）
+        self._lock = threading.Lock()
+        self.gate = _ProfileGate()
+
+    def run(self, name, fn, *args, **kwargs):
+        from torch.profiler import ProfilerActivity, profile
+        with self._lock:
+            start = time.perf_counter()
+            _PROFILING.active = True
+            try:
+                with self.gate.exclusive(), profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+                    result = fn(*args, **kwargs)
+            finally:
+                # 出错时可能有钩子打开后未关闭的标记，随本次剖析一起丢弃
+                _PROFILING.active = False
+                _PROFILING.markers = []
+            wall_us = (time.perf_counter() - start) * 1e6
+            self._accumulate(name, prof, wall_us)
+            self._write_trace(name, prof)
+            self._summary_dirty = True
+            if time.monotonic() - self._summary_written >= self.summary_interval:
+                self.write_summary()
+        return result
+
+    def flush(self):
+        """
+        有未写出的累计结果时重写汇总表（进程退出时调用）
+        """
+        with self._lock:
+            if self._summary_dirty:
+                self.write_summary()
+
+    def _accumulate(self, name, prof, wall_us):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.wall_us += wall_us
+        for event in prof.key_averages():
+            totals = self.ops.setdefault(event.key, {"count": 0, "cpu_total_us": 0.0, "self_cpu_us": 0.0,
+                                                     "self_cpu_memory": 0})
+            totals["count"] += event.count
+            totals["cpu_total_us"] += event.cpu_time_total
+            totals["self_cpu_us"] += event.self_cpu_time_total
+            totals["self_cpu_memory"] += event.self_cpu_memory_usage
+        self.allocations += sum(1 for event in prof.events() if event.name == "[memory]" and event.cpu_memory_usage > 0)
+
+    def _write_trace(self, name, prof):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{sum(self.calls.values())}.json")
+        prof.export_chrome_trace(path)
+        self._traces.append(path)
+        while len(self._traces) > self.max_traces:
+            old = self._traces.pop(0)
+            if os.path.exists(old):
+                os.remove(old)
+
+    def summary(self):
+        """
+        跨调用累计的汇总：{"calls", "wall_ms", "allocations", "phases": [...], "ops": [...]}
+        """
+        total_calls = sum(self.calls.values()) or 1
+        phases = [{"phase": phase, "count": self.ops[phase]["count"], "total_ms": self.ops[phase]["cpu_total_us"] / 1000,
+                   "per_call_ms": self.ops[phase]["cpu_total_us"] / 1000 / total_calls,
+                   "share": self.ops[phase]["cpu_total_us"] / self.wall_us if self.wall_us else 0.0}
+                  for phase in PROFILE_PHASES if phase in self.ops]
+        ops = sorted(((key, totals) for key, totals in self.ops.items() if key not in PROFILE_PHASES),
+                     key=lambda item: item[1]["self_cpu_us"], reverse=True)[:self.top_ops]
+        return {
+            "calls": dict(self.calls),
+            "wall_ms": self.wall_us / 1000,
+            "allocations": self.allocations,
+            "phases": phases,
+            "ops": [{"op": key, "count": t["count"], "self_cpu_ms": t["self_cpu_us"] / 1000,
+                     "cpu_total_ms": t["cpu_total_us"] / 1000, "self_cpu_ms_per_call": t["self_cpu_us"] / 1000 / total_calls,
+                     "self_cpu_memory_mb": t["self_cpu_memory"] / 2 ** 20} for key, t in ops],
+        }
+
+    def write_summary(self):
+        summary = self.summary()
+        total_calls = sum(summary["calls"].values()) or 1
+        calls = "，".join(f"{name} {count}" for name, count in summary["calls"].items())
+        lines = [
+            f"推理剖析汇总：抽样 {total_calls} 次（{calls}），总用时 {summary['wall_ms']:.1f} ms，"
+            f"平均每次 {summary['wall_ms'] / total_calls:.2f} ms，内存分配 {summary['allocations']} 次",
+            "",
+            f"{'阶段':<12}{'次数':>8}{'总耗时(ms)':>14}{'每次调用(ms)':>14}{'占比':>8}",
+        ]
+        lines += [f"{p['phase']:<12}{p['count']:>8}{p['total_ms']:>14.2f}{p['per_call_ms']:>14.3f}{p['share']:>8.1%}"
+                  for p in summary["phases"]]
+        lines += ["", f"{'算子':<44}{'次数':>8}{'自身CPU(ms)':>14}{'总CPU(ms)':>14}{'每次调用(ms)':>14}{'自身内存(MB)':>14}"]
+        lines += [f"{o['op'][:43]:<44}{o['count']:>8}{o['self_cpu_ms']:>14.2f}{o['cpu_total_ms']:>14.2f}"
+                  f"{o['self_cpu_ms_per_call']:>14.3f}{o['self_cpu_memory_mb']:>14.2f}" for o in summary["ops"]]
+        with open(os.path.join(self.out_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        with open(os.path.join(self.out_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        self._summary_written = time.monotonic()
+        self._summary_dirty = False
+
+PROFILER = InferenceProfiler()
+if PROFILE_SAMPLE_RATE > 0:
+    atexit.register(PROFILER.flush)
+
+def profiled(fn):
+    """
+    剖析模式下按 PROFILE_SAMPLE_RATE 抽样，把被装饰的推理调用交给 PROFILER 运行，未抽中的调用在剖析进行时等待；
+    关闭时直接调用
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if PROFILE_SAMPLE_RATE <= 0:
+            return fn(*args, **kwargs)
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            with PROFILER.gate.shared():
+                return fn(*args, **kwargs)
+        return PROFILER.run(fn.__name__, fn, *args, **kwargs)
+    return wrapper
+
+@profiled
 def predict(text: str):
     """
-    输入农业/通用问题文本，返回预测的类别列表
+    输入农业/通用问题文本，返回预测的类别列表（按正类信念从高到低排列）
     示例:
         predict("桃树先开花还是先长叶？") → ["查询类"]
         predict("如何防治病虫害？") → ["建议类", "解决类"]
+    超过 MAX_LENGTH 的问题按窗口整批计算后合并证据（见 LONG_INPUT_COMBINE）
     """
-    encoding = TOKENIZER(
-        text,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=128
-    ).to(DEVICE)
+    encoding, owners = encode_windows(text)
 
-    predicted_labels = []
-    with torch.no_grad():
-        for i, model in enumerate(LOADED_MODELS):
-            evidence = model(encoding["input_ids"], encoding["attention_mask"])
+    scored = []
+    with torch.no_grad(), using_models() as models:
+        for i, model in enumerate(models):
+            evidence = combine_window_evidence(model(encoding["input_ids"], encoding["attention_mask"]), owners, 1)
             neg_evi = evidence[0, 0].item()
             pos_evi = evidence[0, 1].item()
             if pos_evi > neg_evi:
-                predicted_labels.append(ID2LABEL[i])
-    return predicted_labels
\ No newline at end of file
+                scored.append((positive_belief(evidence)[0].item(), ID2LABEL[i]))
+    return _by_belief(scored)
+
+@profiled
+def predict_with_embedding(text: str):
+    """
+    与 predict 相同，另外返回问题的句向量：EMBEDDING_MODEL_INDEX 号模型的 pooler 输出，
+    在分类的同一次前向中取得，L2 归一化后为 float32 的 numpy 数组
+    长文本的句向量为各窗口 pooler 输出的平均
+    返回 (类别列表, 句向量, 模型指纹)；指纹标明句向量出自哪一代模型，热替换前后的句向量不能相互比较
+    """
+    encoding, owners = encode_windows(text)
+
+    scored = []
+    embedding = None
+    with torch.no_grad(), using_generation() as generation:
+        for i, model in enumerate(generation.models):
+            if i == EMBEDDING_MODEL_INDEX:
+                evidence, pooled = model(encoding["input_ids"], encoding["attention_mask"], return_pooled=True)
+                embedding = F.normalize(_mean_by_owner(pooled, owners, 1), dim=-1)[0].cpu().numpy()
+            else:
+                evidence = model(encoding["input_ids"], encoding["attention_mask"])
+            evidence = combine_window_evidence(evidence, owners, 1)
+            if evidence[0, 1].item() > evidence[0, 0].item():
+                scored.append((positive_belief(evidence)[0].item(), ID2LABEL[i]))
+    return _by_belief(scored), embedding, generation.fingerprint
+
+@profiled
+def embed(texts: List[str], with_fingerprint: bool = False):
+    """
+    批量计算句向量（离线建库用），返回 (len(texts), hidden_size) 的 numpy 数组，每行已 L2 归一化
+    with_fingerprint 为 True 时返回 (句向量, 模型指纹)
+    """
+    encoding, owners = encode_windows(texts)
+    with torch.no_grad(), using_generation() as generation:
+        _, pooled = generation.models[EMBEDDING_MODEL_INDEX](encoding["input_ids"], encoding["attention_mask"],
+                                                             return_pooled=True)
+    vectors = F.normalize(_mean_by_owner(pooled, owners, len(texts)), dim=-1).cpu().numpy()
+    return (vectors, generation.fingerprint) if with_fingerprint else vectors
+
+@profiled
+def predict_batch(texts: List[str]) -> List[List[str]]:
+    """
+    批量版 predict：多个问题（及长问题切出的窗口）一起分词、填充后，每个模型只做一次前向
+    返回与 texts 一一对应的类别列表
+    """
+    if not texts:
+        return []
+    with using_models() as models:
+        return _classify_batch(models, texts)
+
+def _classify_batch(models, texts, check_evidence=False):
+    """
+    用给定的一组模型批量分类；check_evidence 为 True 时检查证据为有限非负值（热替换前的冒烟测试）
+    """
+    encoding, owners = encode_windows(texts)
+
+    scored = [[] for _ in texts]
+    with torch.no_grad():
+        for i, model in enumerate(models):
+            evidence = model(encoding["input_ids"], encoding["attention_mask"])
+            evidence = combine_window_evidence(evidence, owners, len(texts))
+            if check_evidence and not bool((torch.isfinite(evidence) & (evidence >= 0)).all()):
+                raise ValueError(f"{ID2LABEL[i]} 模型输出的证据不是有限非负值")
+            positive = (evidence[:, 1] > evidence[:, 0]).tolist()
+            belief = positive_belief(evidence).tolist()
+            for j, is_positive in enumerate(positive):
+                if is_positive:
+                    scored[j].append((belief[j], ID2LABEL[i]))
+    return [_by_belief(items) for items in scored]
\ No newline at end of file
@@ -1,93 +1,266 @@
 # inspect_model.py
-import torch
+"""
+检查模型 checkpoint 的结构，不把张量数据读入内存
+
+用法:
+    python inspect_model.py [final_multilabel_edl.pth]
+
+torch.save 生成的 .pth 是 zip 归档：data.pkl 只记录结构和每个张量的 dtype / 形状 / 存储位置，
+张量数据单独存放在 data/<key> 条目中。这里只反序列化 data.pkl（张量以元数据占位），
+再用 zip 目录中每个存储条目的大小与 CRC32 判断不同模型之间的张量是否完全相同，全程不读取张量数据。
+"""
+import collections
 import os
+import pickle
+import sys
+import time
+import zipfile
 
-# ====== 请在这里修改你的 .pth 文件名 ======
+# ====== 默认检查的 .pth 文件名 ======
 MODEL_PATH = "final_multilabel_edl.pth"
-# =========================================
+# ====================================
+
+STORAGE_DTYPES = {
+    "FloatStorage": ("float32", 4),
+    "DoubleStorage": ("float64", 8),
+    "HalfStorage": ("float16", 2),
+    "BFloat16Storage": ("bfloat16", 2),
+    "LongStorage": ("int64", 8),
+    "IntStorage": ("int32", 4),
+    "ShortStorage": ("int16", 2),
+    "CharStorage": ("int8", 1),
+    "ByteStorage": ("uint8", 1),
+    "BoolStorage": ("bool", 1),
+}
+
+
+class StorageRef:
+    """
+    张量存储的占位：只记录 zip 条目的 key、dtype 与元素个数
+    """
+    def __init__(self, key, dtype, itemsize, numel):
+        self.key = key
+        self.dtype = dtype
+        self.itemsize = itemsize
+        self.numel = numel
+        self.fingerprint = None  # (条目大小, CRC32)，读取 zip 目录后填充
+
+
+class TensorMeta:
+    """
+    张量的占位：形状、步长、偏移与所在存储
+    """
+    def __init__(self, storage, offset, shape, stride):
+        self.storage = storage
+        self.offset = offset
+        self.shape = tuple(shape)
+        self.stride = tuple(stride)
+
+    @property
+    def dtype(self):
+        return self.storage.dtype
+
+    @property
+    def numel(self):
+        n = 1
+        for dim in self.shape:
+            n *= dim
+        return n
+
+    @property
+    def nbytes(self):
+        return self.numel * self.storage.itemsize
+
+    @property
+    def fingerprint(self):
+        return (self.storage.fingerprint, self.offset, self.shape, self.stride)
+
+
+class _StorageType:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Opaque:
+    """
+    checkpoint 中其他类（例如整个 nn.Module）的占位，只保留状态以便查看
+    """
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+    def __setstate__(self, state):
+        self.state = state
+
+
+def _rebuild_tensor(storage, storage_offset, size, stride, *args, **kwargs):
+    return TensorMeta(storage, storage_offset, size, stride)
+
+
+def _rebuild_parameter(data, *args, **kwargs):
+    return data
+
+
+class _MetadataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "torch._utils" and name in ("_rebuild_tensor", "_rebuild_tensor_v2"):
+            return _rebuild_tensor
+        if module == "torch._utils" and name in ("_rebuild_parameter", "_rebuild_parameter_with_state"):
+            return _rebuild_parameter
+        if module == "torch" and name.endswith("Storage"):
+            return _StorageType(name)
+        if module in ("collections", "builtins", "copyreg", "_codecs"):
+            return super().find_class(module, name)
+        return type(f"{module}.{name}", (_Opaque,), {})
+
+    def persistent_load(self, pid):
+        # ('storage', storage_type, key, location, numel)
+        _, storage_type, key, _, numel = pid
+        name = storage_type.name if isinstance(storage_type, _StorageType) else "UntypedStorage"
+        dtype, itemsize = STORAGE_DTYPES.get(name, ("uint8", 1))
+        return StorageRef(key, dtype, itemsize, numel)
+
+
+def load_metadata(path):
+    """
+    读取 checkpoint 的结构，张量以 TensorMeta 表示；返回 (对象, 存储 key → (大小, CRC32))
+    """
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        pkl_name = next(n for n in names if n.endswith("data.pkl"))
+        prefix = pkl_name[:-len("data.pkl")]
+        fingerprints = {
+            info.filename[len(prefix) + len("data/"):]: (info.file_size, info.CRC)
+            for info in archive.infolist()
+            if info.filename.startswith(prefix + "data/")
+        }
+        with archive.open(pkl_name) as f:
+            data = _MetadataUnpickler(f).load()
+    return data, fingerprints
+
+
+def _iter_tensors(obj):
+    if isinstance(obj, TensorMeta):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from _iter_tensors(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from _iter_tensors(value)
+
+
+def _fill_fingerprints(obj, fingerprints):
+    for tensor in _iter_tensors(obj):
+        tensor.storage.fingerprint = fingerprints.get(tensor.storage.key)
+
+
+def _mb(nbytes):
+    return f"{nbytes / 2**20:.1f} MB"
+
+
+def report_state_dict(state, indent="   "):
+    tensors = {k: v for k, v in state.items() if isinstance(v, TensorMeta)}
+    params = sum(t.numel for t in tensors.values())
+    nbytes = sum(t.nbytes for t in tensors.values())
+    dtypes = collections.Counter(t.dtype for t in tensors.values())
+    print(f"{indent}张量数: {len(tensors)}，参数量: {params:,}，占用: {_mb(nbytes)}，dtype: {dict(dtypes)}")
+    edl_keys = [k for k in tensors if "evidence_layer" in k or "classifier" in k or k.startswith("fc")]
+    for key in edl_keys:
+        print(f"{indent}🎯 {key}: {tensors[key].shape} {tensors[key].dtype}")
+
+
+def report_shared_tensors(model_states):
+    """
+    统计各模型之间完全相同的张量（zip 条目大小与 CRC32 相同，且视图一致）
+    """
+    common_keys = set(model_states[0]).intersection(*model_states[1:])
+    identical_all, identical_bytes = [], 0
+    for key in sorted(common_keys):
+        tensors = [s[key] for s in model_states]
+        if not all(isinstance(t, TensorMeta) for t in tensors):
+            continue
+        if tensors[0].storage.fingerprint is not None and len({t.fingerprint for t in tensors}) == 1:
+            identical_all.append(key)
+            identical_bytes += tensors[0].nbytes
+    print(f"\n🔁 {len(model_states)} 个模型之间完全相同的张量: {len(identical_all)} 个，"
+          f"共 {_mb(identical_bytes)}（可只存一份）")
+    for key in identical_all[:10]:
+        print(f"     {key}")
+    if len(identical_all) > 10:
+        print(f"     ... 其余 {len(identical_all) - 10} 个")
+
+    print("   两两相同的张量数:")
+    for i in range(len(model_states)):
+        row = []
+        for j in range(len(model_states)):
+            same = sum(
+                1 for key in common_keys
+                if isinstance(model_states[i][key], TensorMeta)
+                and model_states[i][key].storage.fingerprint is not None
+                and model_states[i][key].fingerprint == model_states[j][key].fingerprint
+            )
+            row.append(f"{same:>5}")
+        print(f"     模型{i}: " + "".join(row))
+
 
 def main():
-    if not os.path.exists(MODEL_PATH):
-        print(f"❌ 错误: 文件 '{MODEL_PATH}' 不存在，请检查路径！")
+    path = sys.argv[1] if len(sys.argv) > 1 else MODEL_PATH
+    if not os.path.exists(path):
+        print(f"❌ 错误: 文件 '{path}' 不存在，请检查路径！")
         return
 
-    print(f"🔍 正在加载模型文件: {MODEL_PATH}")
+    start = time.perf_counter()
+    print(f"🔍 正在读取模型文件结构: {path}（{_mb(os.path.getsize(path))}）")
+    if not zipfile.is_zipfile(path):
+        print("⚠️ 这是旧版（非 zip）torch.save 格式，无法只读元数据，请用新版 torch 重新保存后再检查")
+        return
     try:
-        # 安全加载（显式关闭 weights_only 警告）
-        data = torch.load(MODEL_PATH, map_location="cpu", weights_only=False)
+        data, fingerprints = load_metadata(path)
     except Exception as e:
-        print(f"❌ 加载失败: {e}")
+        print(f"❌ 读取失败: {e}")
         return
+    _fill_fingerprints(data, fingerprints)
+    print(f"✅ 读取完成！数据类型: {type(data).__name__}\n")
+
+    # 情况 1: 自定义 checkpoint（多二分类器 EDL 结构）
+    if isinstance(data, dict) and "num_classes" in data and "model_states" in data:
+        print("✅ 检测到自定义 checkpoint 格式（多二分类器结构）")
+        print(f"   键名列表: {list(data.keys())}")
+        model_states = data["model_states"]
+        print(f"   - 标签数量: {data['num_classes']}")
+        print(f"   - 模型状态数量: {len(model_states)}")
+        for i, state in enumerate(model_states):
+            print(f"\n📦 模型 {i}")
+            report_state_dict(state)
+        total = sum(t.nbytes for t in _iter_tensors(model_states))
+        print(f"\n📊 全部模型权重合计: {_mb(total)}")
+        if len(model_states) > 1:
+            report_shared_tensors(model_states)
 
-    print(f"✅ 成功加载！数据类型: {type(data)}\n")
-
-    # 情况 1: 是字典（最常见：state_dict 或自定义 checkpoint）
-    if isinstance(data, dict):
-        print("📌 这是一个字典（dict），可能包含以下内容：")
-        keys = list(data.keys())
-        print(f"   键名列表: {keys}\n")
-
-        # 检查是否是标准 state_dict（含 bert 层）
-        if any('bert' in k for k in keys):
-            print("✅ 检测到 BERT 权重，可能是标准 state_dict")
-            # 尝试找分类层
-            classifier_keys = [k for k in keys if ('classifier' in k or 'fc' in k or 'evidence' in k) and 'weight' in k]
-            if classifier_keys:
-                key = classifier_keys[0]
-                shape = data[key].shape
-                print(f"🎯 分类层 '{key}' 形状: {shape}")
-                if len(shape) == 2:
-                    num_labels = shape[0]
-                    print(f"   → 推断标签数量: {num_labels}")
-            else:
-                print("⚠️ 未找到明显分类层，请手动检查键名")
-
-        # 检查是否是自定义 checkpoint（如你之前的格式）
-        if "num_classes" in keys and "model_states" in keys:
-            print("✅ 检测到自定义 checkpoint 格式（多二分类器结构）")
-            num_classes = data["num_classes"]
-            model_states = data["model_states"]
-            print(f"   - 标签数量: {num_classes}")
-            print(f"   - 模型状态数量: {len(model_states)}")
-            if isinstance(model_states, list) and len(model_states) > 0:
-                first_state = model_states[0]
-                if isinstance(first_state, dict):
-                    print(f"   - 第一个模型的参数数量: {len(first_state)}")
-                    # 尝试找 evidence_layer
-                    evidence_keys = [k for k in first_state.keys() if 'evidence_layer' in k]
-                    if evidence_keys:
-                        print(f"   - 检测到 EDL 结构: {evidence_keys}")
-
-    # 情况 2: 是列表（如 [state_dict, label_list]）
+    # 情况 2: 标准 state_dict
+    elif isinstance(data, dict) and any(isinstance(v, TensorMeta) for v in data.values()):
+        print("✅ 这是 state_dict")
+        report_state_dict(data)
+
+    # 情况 3: 列表（如 [state_dict, label_list]）
     elif isinstance(data, list):
         print(f"📌 这是一个列表，长度: {len(data)}")
-        for i, item in enumerate(data[:3]):  # 只看前3项
-            print(f"   第 {i+1} 项类型: {type(item)}")
-            if isinstance(item, dict) and len(item) > 0:
-                sample_key = next(iter(item))
-                print(f"     示例键: {sample_key}, 值形状: {item[sample_key].shape if hasattr(item[sample_key], 'shape') else 'N/A'}")
-
-    # 情况 3: 是完整模型对象
-    elif hasattr(data, 'state_dict'):
-        print("✅ 这是一个完整模型对象")
-        state_dict = data.state_dict()
-        print(f"   参数数量: {len(state_dict)}")
-        # 找分类层
-        for name, param in state_dict.items():
-            if 'classifier' in name and 'weight' in name:
-                print(f"   分类层 '{name}' 形状: {param.shape}")
+        for i, item in enumerate(data):
+            print(f"   第 {i + 1} 项类型: {type(item).__name__}")
+            if isinstance(item, dict):
+                report_state_dict(item, indent="     ")
+
+    # 情况 4: 完整模型对象
+    elif isinstance(data, _Opaque):
+        print(f"✅ 这是一个完整模型对象: {type(data).__name__}")
+        tensors = list(_iter_tensors(getattr(data, "state", {})))
+        print(f"   张量数: {len(tensors)}，占用: {_mb(sum(t.nbytes for t in tensors))}")
 
     else:
         print("❓ 未知格式，请手动分析")
 
-    print("\n" + "="*50)
-    print("💡 下一步建议:")
-    if isinstance(data, dict) and "num_classes" in data and "model_states" in data:
-        print("  你的是「多二分类器 EDL 模型」，请使用你之前提供的推理逻辑。")
-    elif isinstance(data, dict) and any('bert' in k for k in data.keys()):
-        print("  你的是「标准 BERT 多标签模型」，可用通用分类代码。")
-    else:
-        print("  请根据上述信息定制加载逻辑。")
+    print(f"\n⏱️ 耗时 {time.perf_counter() - start:.2f} 秒（未读取任何张量数据）")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,42 +1,62 @@
 # llm_clients.py
+# 各服务商的 SDK 在第一次调用该服务商时才导入，import 本模块不加载 openai / zhipuai
 import os
-from openai import OpenAI
-from zhipuai import ZhipuAI
+import time
+
+from usage_metrics import USAGE
 
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 ZHIPUAI_API_KEY = os.getenv("ZHIPUAI_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 MOONSHOT_API_KEY = os.getenv("MOONSHOT_API_KEY")
 
+QWEN_MODEL = "qwen-plus"
+GLM_MODEL = "glm-4-flash"
+DEEPSEEK_MODEL = "deepseek-chat"
+MOONSHOT_MODEL = "moonshot-v1-8k"  # 也可用 moonshot-v1-32k / v1-128k
+
 def call_qwen(prompt: str, timeout: int = 30) -> str:
     if not DASHSCOPE_API_KEY:
         return "❌ 未配置 DASHSCOPE_API_KEY"
+    started = time.perf_counter()
+    # 先取出回答再记账，取回答出错时只在 except 中记一次（带上已计费的 usage）
+    response = None
     try:
+        from openai import OpenAI
         client = OpenAI(
             api_key=DASHSCOPE_API_KEY,
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
         )
         response = client.chat.completions.create(
-            model="qwen-plus",
+            model=QWEN_MODEL,
             messages=[{"role": "user", "content": prompt}],
             timeout=timeout
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        USAGE.record("qwen", QWEN_MODEL, started, response)
+        return content
     except Exception as e:
+        USAGE.record("qwen", QWEN_MODEL, started, response, error=e)
         return f"❌ Qwen 调用失败: {str(e)}"
 
 def call_glm(prompt: str, timeout: int = 30) -> str:
     if not ZHIPUAI_API_KEY:
         return "❌ 未配置 ZHIPUAI_API_KEY"
+    started = time.perf_counter()
+    response = None
     try:
+        from zhipuai import ZhipuAI
         client = ZhipuAI(api_key=ZHIPUAI_API_KEY)
         response = client.chat.completions.create(
-            model="glm-4-flash",
+            model=GLM_MODEL,
             messages=[{"role": "user", "content": prompt}],
             timeout=timeout
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        USAGE.record("glm", GLM_MODEL, started, response)
+        return content
     except Exception as e:
+        USAGE.record("glm", GLM_MODEL, started, response, error=e)
         return f"❌ GLM 调用失败: {str(e)}"
     
 
@@ -45,17 +65,23 @@ def call_deepseek(prompt: str, timeout: int = 30) -> str:
     
     if not DEEPSEEK_API_KEY:
         return "❌ 未配置 DEEPSEEK_API_KEY"
+    started = time.perf_counter()
+    response = None
     try:
+        from openai import OpenAI
         client = OpenAI(
             api_key=DEEPSEEK_API_KEY,
             base_url="https://api.deepseek.com/v1"
         )
         response = client.chat.completions.create(
-            model="deepseek-chat",
+            model=DEEPSEEK_MODEL,
             messages=[{"role": "user", "content": prompt}]
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        USAGE.record("deepseek", DEEPSEEK_MODEL, started, response)
+        return content
     except Exception as e:
+        USAGE.record("deepseek", DEEPSEEK_MODEL, started, response, error=e)
         return f"❌ DeepSeek 调用失败: {str(e)}"
     
 
@@ -64,18 +90,24 @@ def call_deepseek(prompt: str, timeout: int = 30) -> str:
 def call_moonshot(prompt: str, timeout: int = 30) -> str:
     if not MOONSHOT_API_KEY:
         return "❌ 未配置 MOONSHOT_API_KEY"
+    started = time.perf_counter()
+    response = None
     try:
+        from openai import OpenAI
         client = OpenAI(
             api_key=MOONSHOT_API_KEY,
             base_url="https://api.moonshot.cn/v1"
         )
         response = client.chat.completions.create(
-            model="moonshot-v1-8k",  # 也可用 moonshot-v1-32k / v1-128k
+            model=MOONSHOT_MODEL,
             messages=[{"role": "user", "content": prompt}],
             timeout=timeout
         )
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        USAGE.record("moonshot", MOONSHOT_MODEL, started, response)
+        return content
     except Exception as e:
+        USAGE.record("moonshot", MOONSHOT_MODEL, started, response, error=e)
         error_msg = str(e)
         if "Insufficient Balance" in error_msg:
             return "💰 Moonshot 余额不足，请登录 https://www.moonshot.cn 充值"
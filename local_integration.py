@@ -0,0 +1,192 @@
+# local_integration.py
+import hashlib
+import html
+import re
+from typing import Dict, List, Optional
+
+# 近重复句判定阈值（MinHash 估计的 Jaccard 相似度）
+DEDUP_THRESHOLD = 0.7
+# 字符 shingle 长度（中文按字切分，3 字一组效果较好）
+SHINGLE_SIZE = 3
+# MinHash 签名长度 = 分桶数 × 每桶行数
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for i in range(NUM_PERM)
+]
+
+H3_STYLE = "color:#2e7d32; margin:16px 0 8px 0;"
+
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_ULIST_RE = re.compile(r"^\s*[-*+•]\s+(.*)$")
+_OLIST_RE = re.compile(r"^\s*\d+[.、)]\s+(.*)$")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*|__(.+?)__")
+_ITALIC_RE = re.compile(r"(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])")
+_CODE_RE = re.compile(r"`([^`]+)`")
+
+
+def _render_inline(text: str) -> str:
+    """
+    行内元素：先转义 HTML，再处理 `code`、**粗体**、*斜体*
+    """
+    text = html.escape(text, quote=False)
+    codes: List[str] = []
+
+    def _stash(m):
+        codes.append(f"<code>{m.group(1)}</code>")
+        return f"\x00{len(codes) - 1}\x00"
+
+    text = _CODE_RE.sub(_stash, text)
+    text = _BOLD_RE.sub(lambda m: f"<strong>{m.group(1) or m.group(2)}</strong>", text)
+    text = _ITALIC_RE.sub(r"<em>\1</em>", text)
+    return re.sub(r"\x00(\d+)\x00", lambda m: codes[int(m.group(1))], text)
+
+
+def render_markdown(text: str) -> str:
+    """
+    单遍逐行的 Markdown → HTML 渲染：标题、有序/无序列表、代码块、段落和行内格式
+    已经是 HTML 片段的内容原样返回
+    """
+    stripped = text.strip()
+    if stripped.startswith("<") and stripped.endswith(">"):
+        return stripped
+
+    out: List[str] = []
+    paragraph: List[str] = []
+    list_tag: Optional[str] = None
+    in_code = False
+
+    def _flush_paragraph():
+        if paragraph:
+            out.append("<p>" + "<br>".join(paragraph) + "</p>")
+            paragraph.clear()
+
+    def _close_list():
+        nonlocal list_tag
+        if list_tag:
+            out.append(f"</{list_tag}>")
+            list_tag = None
+
+    for line in stripped.splitlines():
+        if line.strip().startswith("```"):
+            _flush_paragraph()
+            _close_list()
+            out.append("</code></pre>" if in_code else "<pre><code>")
+            in_code = not in_code
+            continue
+        if in_code:
+            out.append(html.escape(line, quote=False))
+            continue
+        if not line.strip():
+            _flush_paragraph()
+            _close_list()
+            continue
+
+        heading = _HEADING_RE.match(line)
+        ulist = _ULIST_RE.match(line)
+        olist = _OLIST_RE.match(line)
+        if heading:
+            _flush_paragraph()
+            _close_list()
+            out.append(f"<h3 style='{H3_STYLE}'>{_render_inline(heading.group(2))}</h3>")
+        elif ulist or olist:
+            _flush_paragraph()
+            tag = "ul" if ulist else "ol"
+            if list_tag != tag:
+                _close_list()
+                out.append(f"<{tag}>")
+                list_tag = tag
+            out.append(f"<li>{_render_inline((ulist or olist).group(1))}</li>")
+        else:
+            _close_list()
+            paragraph.append(_render_inline(line.strip()))
+
+    _flush_paragraph()
+    _close_list()
+    if in_code:
+        out.append("</code></pre>")
+    return "\n".join(out)
+
+
+def _minhash(sentence: str) -> List[int]:
+    """
+    字符 shingle 的 MinHash 签名
+    """
+    chars = re.sub(r"\s+", "", sentence)
+    if len(chars) <= SHINGLE_SIZE:
+        shingles = {chars}
+    else:
+        shingles = {chars[i:i + SHINGLE_SIZE] for i in range(len(chars) - SHINGLE_SIZE + 1)}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+              for s in shingles]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+class _NearDuplicateFilter:
+    """
+    基于 MinHash + LSH 分桶的近重复句过滤器：只与落入相同桶的已保留句子比较
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: List[List[int]] = []
+        self.buckets: Dict[tuple, List[int]] = {}
+
+    def is_duplicate(self, sentence: str) -> bool:
+        """
+        判断句子是否与已保留的句子近似重复；不重复时记录该句
+        """
+        signature = _minhash(sentence)
+        keys = [(band, tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+                for band in range(NUM_BANDS)]
+        candidates = {idx for key in keys for idx in self.buckets.get(key, [])}
+        for idx in candidates:
+            other = self.signatures[idx]
+            similarity = sum(x == y for x, y in zip(signature, other)) / NUM_PERM
+            if similarity >= self.threshold:
+                return True
+        self.signatures.append(signature)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(len(self.signatures) - 1)
+        return False
+
+
+def _dedupe_markdown(text: str, seen: _NearDuplicateFilter) -> str:
+    """
+    按行去掉与之前内容近似重复的句子，保留行首的 Markdown 结构标记
+    """
+    lines = []
+    for line in text.splitlines():
+        marker = re.match(r"^(\s*(?:#{1,6}|[-*+•]|\d+[.、)])\s+)?", line).group(0)
+        body = line[len(marker):]
+        kept = [s for s in _SENTENCE_RE.findall(body)
+                if len(s.strip()) <= SHINGLE_SIZE or not seen.is_duplicate(s)]
+        if kept or not body.strip():
+            lines.append(marker + "".join(kept))
+    return "\n".join(lines)
+
+
+def assemble_report(individual_answers: Dict[str, str], labels: List[str]) -> str:
+    """
+    不调用大模型，按标签分节拼装整合报告：去掉各回答之间近似重复的句子，再渲染为 HTML
+    """
+    seen = _NearDuplicateFilter()
+    sections = []
+    ordered = [label for label in labels if label in individual_answers]
+    ordered += [label for label in individual_answers if label not in ordered]
+    for label in ordered:
+        answer = individual_answers[label].strip()
+        if answer.startswith("【") and "】" in answer:
+            answer = answer.split("】", 1)[-1].strip()
+        body = render_markdown(_dedupe_markdown(answer, seen))
+        sections.append(
+            f"<div class='answer-section' style='margin-bottom:16px;'>"
+            f"<h3 style='{H3_STYLE}'>📌 {label}视角</h3>{body}</div>"
+        )
+    return "\n".join(sections)
@@ -0,0 +1,212 @@
+# session_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# 每个会话最多保留的对话轮数（超出后丢弃最早的轮次）
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "50"))
+# 所有会话在内存中的总预算（MB），超出后按 LRU 淘汰最久未访问的会话
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256"))
+# 会话空闲超过该秒数即视为冷会话，从内存中移出
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+# 冷会话落盘的 SQLite 文件路径；留空则淘汰即丢弃
+SESSION_SPILL_PATH = os.getenv("SESSION_SPILL_PATH", "")
+
+
+def _turn_size(turn: Dict[str, Any]) -> int:
+    """
+    估算单轮对话占用的字节数（按 UTF-8 序列化后的长度计）
+    """
+    return len(json.dumps(turn, ensure_ascii=False).encode("utf-8"))
+
+
+class SessionStore:
+    """
+    服务端会话存储：按会话 ID 保存对话轮次，限制单会话轮数与全局内存，
+    空闲或超预算的会话按 LRU 顺序移出内存，配置了 spill_path 时写入 SQLite，再次访问时自动加载回内存
+    """
+
+    def __init__(self, max_turns: int = SESSION_MAX_TURNS,
+                 memory_budget_mb: float = SESSION_MEMORY_BUDGET_MB,
+                 idle_seconds: int = SESSION_IDLE_SECONDS,
+                 spill_path: Optional[str] = SESSION_SPILL_PATH or None):
+        self.max_turns = max_turns
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.idle_seconds = idle_seconds
+        # session_id -> {"turns": [...], "sizes": [...], "bytes": int, "last_access": float}
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._evicted = 0
+        self._spilled = 0
+        self._lock = threading.RLock()
+        self._db = None
+        if spill_path:
+            self._db = sqlite3.connect(spill_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, turns TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def new_session(self) -> str:
+        """
+        创建新会话，返回会话 ID
+        """
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = {"turns": [], "sizes": [], "bytes": 0, "last_access": time.time()}
+        return session_id
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """
+        返回会话的对话轮次（列表副本）；会话不存在时返回空列表
+        """
+        with self._lock:
+            entry = self._touch(session_id)
+            return list(entry["turns"]) if entry else []
+
+    def append(self, session_id: str, turn: Dict[str, Any]) -> None:
+        """
+        追加一轮对话，超出单会话轮数上限时丢弃最早的轮次，并按全局预算执行淘汰
+        """
+        size = _turn_size(turn)
+        with self._lock:
+            entry = self._touch(session_id)
+            if entry is None:
+                entry = {"turns": [], "sizes": [], "bytes": 0, "last_access": time.time()}
+                self._sessions[session_id] = entry
+            entry["turns"].append(turn)
+            entry["sizes"].append(size)
+            entry["bytes"] += size
+            self._total_bytes += size
+            while len(entry["turns"]) > self.max_turns:
+                entry["turns"].pop(0)
+                dropped = entry["sizes"].pop(0)
+                entry["bytes"] -= dropped
+                self._total_bytes -= dropped
+            self._evict(keep=session_id)
+
+    def pop(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        移除并返回最后一轮对话；会话不存在或为空时返回 None
+        """
+        with self._lock:
+            entry = self._touch(session_id)
+            if not entry or not entry["turns"]:
+                return None
+            size = entry["sizes"].pop()
+            entry["bytes"] -= size
+            self._total_bytes -= size
+            return entry["turns"].pop()
+
+    def replace_last(self, session_id: str, turn: Dict[str, Any]) -> bool:
+        """
+        用 turn 替换最后一轮对话（重新生成回答时使用）；会话为空时返回 False
+        """
+        size = _turn_size(turn)
+        with self._lock:
+            entry = self._touch(session_id)
+            if not entry or not entry["turns"]:
+                return False
+            delta = size - entry["sizes"][-1]
+            entry["turns"][-1] = turn
+            entry["sizes"][-1] = size
+            entry["bytes"] += delta
+            self._total_bytes += delta
+            self._evict(keep=session_id)
+            return True
+
+    def clear(self, session_id: str) -> None:
+        """
+        删除会话（内存与落盘数据）
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry:
+                self._total_bytes -= entry["bytes"]
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        当前存储状态，用于监控
+        """
+        with self._lock:
+            spilled_now = 0
+            if self._db is not None:
+                spilled_now = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "sessions_in_memory": len(self._sessions),
+                "sessions_on_disk": spilled_now,
+                "memory_bytes": self._total_bytes,
+                "memory_budget_bytes": self.memory_budget,
+                "evicted_total": self._evicted,
+                "spilled_total": self._spilled,
+            }
+
+    def _touch(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        标记会话为最近访问；不在内存中时尝试从落盘数据加载
+        """
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._load_spilled(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = entry
+            self._total_bytes += entry["bytes"]
+            self._evict(keep=session_id)
+        entry["last_access"] = time.time()
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _load_spilled(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT turns FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._db.commit()
+        turns = json.loads(row[0])
+        sizes = [_turn_size(t) for t in turns]
+        return {"turns": turns, "sizes": sizes, "bytes": sum(sizes), "last_access": time.time()}
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """
+        先移出空闲超时的会话，再按 LRU 顺序移出会话直到满足内存预算（keep 指定的会话不会被移出）
+        """
+        now = time.time()
+        for session_id in list(self._sessions.keys()):
+            if session_id == keep:
+                continue
+            if now - self._sessions[session_id]["last_access"] < self.idle_seconds:
+                break  # OrderedDict 按访问时间排序，后面的会话更新
+            self._spill(session_id)
+
+        for session_id in list(self._sessions.keys()):
+            if self._total_bytes <= self.memory_budget:
+                break
+            if session_id != keep:
+                self._spill(session_id)
+
+    def _spill(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id)
+        self._total_bytes -= entry["bytes"]
+        self._evicted += 1
+        if self._db is not None and entry["turns"]:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, turns, last_access) VALUES (?, ?, ?)",
+                (session_id, json.dumps(entry["turns"], ensure_ascii=False), entry["last_access"])
+            )
+            self._db.commit()
+            self._spilled += 1
+
+
+SESSION_STORE = SessionStore()
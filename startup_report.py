@@ -0,0 +1,118 @@
+# startup_report.py
+"""
+启动耗时报告：在子进程中用 python -X importtime 导入目标模块，统计每个模块的导入耗时，
+并检查导入完成后是否已加载了应延迟到首次使用时才导入的重型模块
+
+用法:
+    python startup_report.py [app] [--top 20] [--budget-ms 3000] [--json]
+
+存在问题（超出耗时预算，或启动时已加载 DEFERRED_MODULES 中的模块）时退出码为 1，可直接用于测试或 CI 检查；
+也可在测试中调用 measure_imports() / check_report() 取得结构化结果
+CI 中由 .github/workflows/startup-imports.yml 对 app 与 classifier_service 运行
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+# 启动时不应导入的模块：大模型 SDK 在第一次调用对应服务商时导入，torch / transformers 在第一次本地分类时导入
+DEFERRED_MODULES = ("torch", "transformers", "openai", "zhipuai")
+# 导入目标模块的耗时预算（毫秒），0 表示不检查
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "0"))
+
+
+def _parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出：每行 "import time: self [us] | cumulative | 模块名"，模块名前的缩进表示嵌套深度
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # 表头行
+        stripped = name.lstrip()
+        modules.append({
+            "name": stripped.strip(),
+            "depth": (len(name) - len(stripped) - 1) // 2,
+            "self_ms": self_us / 1000,
+            "cumulative_ms": cumulative_us / 1000,
+        })
+    return modules
+
+
+def measure_imports(module="app", env=None):
+    """
+    在新的子进程中导入 module，返回导入耗时与导入后已加载的模块
+    {"module", "wall_ms", "total_ms", "modules": [...], "by_package": {...}, "loaded": [...]}
+    """
+    code = f"import sys, json\nimport {module}\nprint(json.dumps(sorted(sys.modules)))"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            env={**os.environ, **(env or {})}, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    modules = _parse_importtime(result.stderr)
+    target = next((m for m in modules if m["name"] == module and m["depth"] == 0), None)
+    by_package = defaultdict(float)
+    for m in modules:
+        by_package[m["name"].split(".")[0]] += m["self_ms"]
+    return {
+        "module": module,
+        "wall_ms": wall_ms,
+        "total_ms": target["cumulative_ms"] if target else sum(m["cumulative_ms"] for m in modules if m["depth"] == 0),
+        "modules": modules,
+        "by_package": dict(sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)),
+        "loaded": json.loads(result.stdout.strip().splitlines()[-1]),
+    }
+
+
+def check_report(report, budget_ms=STARTUP_IMPORT_BUDGET_MS, deferred=DEFERRED_MODULES):
+    """
+    返回问题列表（为空表示通过）
+    """
+    problems = []
+    if budget_ms and report["total_ms"] > budget_ms:
+        problems.append(f"导入 {report['module']} 用时 {report['total_ms']:.0f} ms，超出预算 {budget_ms:.0f} ms")
+    loaded = set(report["loaded"])
+    for name in deferred:
+        if name in loaded:
+            problems.append(f"启动时已导入 {name}（应在首次使用时再导入）")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计模块导入耗时并检查延迟导入")
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=20, help="显示耗时最多的前 N 个包")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_IMPORT_BUDGET_MS)
+    parser.add_argument("--json", action="store_true", help="输出 JSON 报告")
+    args = parser.parse_args()
+
+    report = measure_imports(args.module)
+    problems = check_report(report, args.budget_ms)
+    if args.json:
+        print(json.dumps({**{k: v for k, v in report.items() if k != "loaded"}, "problems": problems},
+                         ensure_ascii=False, indent=2))
+    else:
+        print(f"⏱️ 导入 {args.module}: {report['total_ms']:.0f} ms（子进程总用时 {report['wall_ms']:.0f} ms）")
+        print(f"   按包统计（自身耗时，前 {args.top} 个）:")
+        for package, ms in list(report["by_package"].items())[:args.top]:
+            print(f"     {package:<28} {ms:8.1f} ms")
+        deferred_status = ", ".join(f"{name}{'❌' if name in report['loaded'] else '✅'}" for name in DEFERRED_MODULES)
+        print(f"   延迟导入检查: {deferred_status}")
+        for problem in problems:
+            print(f"❌ {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
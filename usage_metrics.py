@@ -0,0 +1,190 @@
+# usage_metrics.py
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 用量记录周期性追加写入的 JSONL 文件；留空则不落盘
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", "llm_usage.jsonl")
+# 两次落盘之间的间隔（秒）
+USAGE_DUMP_SECONDS = float(os.getenv("USAGE_DUMP_SECONDS", "60"))
+# 内存中保留的最近调用条数（界面展示用）
+USAGE_RECENT_CALLS = int(os.getenv("USAGE_RECENT_CALLS", "200"))
+
+# 各模型单价（元 / 百万 tokens，[输入, 输出]），按各平台公开价填写，以实际账单为准；
+# 可用环境变量 LLM_PRICES（JSON，同样格式）覆盖或补充
+MODEL_PRICES = {
+    "qwen-plus": [0.8, 2.0],
+    "glm-4-flash": [0.0, 0.0],
+    "deepseek-chat": [2.0, 8.0],
+    "moonshot-v1-8k": [12.0, 12.0],
+}
+MODEL_PRICES.update(json.loads(os.getenv("LLM_PRICES", "{}")))
+
+# 未设置标签 / 路由方式时的记录值
+UNLABELED = "直接回答"
+UNKNOWN_MODE = "未知"
+
+_CALL_CONTEXT: contextvars.ContextVar = contextvars.ContextVar("llm_call_context", default=None)
+
+
+@contextlib.contextmanager
+def usage_context(**fields):
+    """
+    为其中发起的大模型调用标注 label / mode / speculative 等字段，可嵌套，内层覆盖外层
+    """
+    current = dict(_CALL_CONTEXT.get() or {})
+    current.update(fields)
+    token = _CALL_CONTEXT.set(current)
+    try:
+        yield
+    finally:
+        _CALL_CONTEXT.reset(token)
+
+
+def _new_totals() -> Dict[str, Any]:
+    return {"calls": 0, "errors": 0, "speculative_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "total_tokens": 0, "cost": 0.0, "latency_sum": 0.0, "latency_max": 0.0}
+
+
+class UsageRecorder:
+    """
+    记录每次大模型调用的 token 数、延迟与模型名，按服务商 / 标签 / 路由方式累计，
+    并按 dump_seconds 周期把新增的调用记录和累计汇总追加写入 JSONL
+    """
+
+    def __init__(self, log_path: Optional[str] = USAGE_LOG_PATH or None,
+                 dump_seconds: float = USAGE_DUMP_SECONDS, recent_calls: int = USAGE_RECENT_CALLS):
+        self.log_path = log_path
+        self.dump_seconds = dump_seconds
+        # (provider, label, mode) -> 累计值
+        self._totals: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._recent: deque = deque(maxlen=recent_calls)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._dumper: Optional[threading.Thread] = None
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def record(self, provider: str, model: str, started: float, response: Any = None,
+               error: Optional[BaseException] = None) -> Dict[str, Any]:
+        """
+        记录一次调用；started 为调用前的 time.perf_counter()，response 为 SDK 返回的对象（读取其 usage）
+        """
+        latency = time.perf_counter() - started
+        usage = getattr(response, "usage", None)
+        prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0)
+        completion_tokens = int(getattr(usage, "completion_tokens", 0) or 0)
+        total_tokens = int(getattr(usage, "total_tokens", 0) or 0) or prompt_tokens + completion_tokens
+        input_price, output_price = MODEL_PRICES.get(model, [0.0, 0.0])
+        context = _CALL_CONTEXT.get() or {}
+        entry = {
+            "ts": time.time(),
+            "provider": provider,
+            "model": model,
+            "label": context.get("label", UNLABELED),
+            "mode": context.get("mode", UNKNOWN_MODE),
+            "speculative": bool(context.get("speculative", False)),
+            "degrade_level": int(context.get("degrade_level", 0)),
+            "ok": error is None,
+            "error": str(error) if error is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost": (prompt_tokens * input_price + completion_tokens * output_price) / 1e6,
+            "latency": round(latency, 4),
+        }
+        with self._lock:
+            totals = self._totals.setdefault((provider, entry["label"], entry["mode"]), _new_totals())
+            totals["calls"] += 1
+            totals["errors"] += 0 if entry["ok"] else 1
+            totals["speculative_calls"] += 1 if entry["speculative"] else 0
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens", "cost"):
+                totals[key] += entry[key]
+            totals["latency_sum"] += latency
+            totals["latency_max"] = max(totals["latency_max"], latency)
+            self._recent.append(entry)
+            if self.log_path:
+                self._pending.append(entry)
+                self._ensure_dumper()
+        return entry
+
+    def summary(self, by: Tuple[str, ...] = ("provider",)) -> List[Dict[str, Any]]:
+        """
+        按 by 中的维度（provider / label / mode 的任意组合）汇总累计值，按费用、tokens 降序
+        """
+        dims = ("provider", "label", "mode")
+        grouped: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        with self._lock:
+            for key, totals in self._totals.items():
+                group_key = tuple(key[dims.index(d)] for d in by)
+                merged = grouped.setdefault(group_key, _new_totals())
+                for name, value in totals.items():
+                    merged[name] = max(merged[name], value) if name == "latency_max" else merged[name] + value
+        rows = []
+        for group_key, totals in grouped.items():
+            row = dict(zip(by, group_key))
+            row.update(totals)
+            row["latency_mean"] = totals["latency_sum"] / totals["calls"] if totals["calls"] else 0.0
+            rows.append(row)
+        return sorted(rows, key=lambda r: (r["cost"], r["total_tokens"]), reverse=True)
+
+    def register_gauge(self, name: str, fn: Callable[[], Any]) -> None:
+        """
+        在 snapshot（以及落盘的汇总行）中附带 fn() 的当前值，如准入控制的降级等级
+        """
+        self._gauges[name] = fn
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        当前累计汇总：按服务商、标签、路由方式以及三者组合，另附已登记的状态值
+        """
+        return {
+            "ts": time.time(),
+            "by_provider": self.summary(("provider",)),
+            "by_label": self.summary(("label",)),
+            "by_mode": self.summary(("mode",)),
+            "by_provider_label_mode": self.summary(("provider", "label", "mode")),
+            "gauges": {name: fn() for name, fn in list(self._gauges.items())},
+        }
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._recent)[-limit:]
+
+    def dump(self) -> int:
+        """
+        把上次落盘后新增的调用记录和当前累计汇总追加写入 JSONL，返回写入的调用条数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending or not self.log_path:
+            return 0
+        lines = [json.dumps({"type": "call", **entry}, ensure_ascii=False) for entry in pending]
+        lines.append(json.dumps({"type": "summary", **self.snapshot()}, ensure_ascii=False))
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return len(pending)
+
+    def _ensure_dumper(self) -> None:
+        # 在第一次记录时才启动落盘线程（调用方已持有锁）
+        if self._dumper is not None:
+            return
+        self._dumper = threading.Thread(target=self._dump_loop, name="usage-dump", daemon=True)
+        self._dumper.start()
+        atexit.register(self.dump)
+
+    def _dump_loop(self) -> None:
+        while True:
+            time.sleep(self.dump_seconds)
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"⚠️ 用量记录写入失败: {e}")
+
+
+USAGE = UsageRecorder()